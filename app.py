@@ -1,15 +1,50 @@
-from flask import Flask, request, jsonify
-import json
+from flask import Blueprint, Flask, abort, current_app, has_app_context, jsonify, request, send_from_directory
+import os
 import hashlib
 import hmac
 import re
+import time
 from datetime import datetime
 
-app = Flask(__name__)
+from event_log import get_logger
+from metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY, STAGE_SECONDS, count_cache_lookup
+from request_profiler import PROFILE_DIR, profiled, profiling_available
+
+# Routes are registered on this blueprint; create_app() builds an app around it
+bp = Blueprint('nutrisync', __name__)
+log = get_logger('app')
 
 # Your Mailgun webhook signing key
 WEBHOOK_SIGNING_KEY = "53929c56588d06f7b5c12856406207e0"
 
+# Async ingestion: verify and queue webhooks on disk, reply 202 immediately, and let
+# background workers run the parse -> nutrition -> save pipeline
+ASYNC_INGESTION = os.environ.get("NUTRISYNC_ASYNC_INGESTION", "0") == "1"
+INGESTION_WORKERS = int(os.environ.get("NUTRISYNC_INGESTION_WORKERS", "2"))
+QUEUE_DB_FILE = "nutrisync_queue.db"
+
+# Index of already-processed emails, so retried/re-forwarded copies are answered
+# from the stored result. Only final outcomes are stored; failures can be retried.
+# A partial success has already saved its order, so a retry would store it twice.
+DEDUP_DB_FILE = "nutrisync_dedup.db"
+DEDUP_STORED_STATUSES = ("success", "partial_success", "filtered")
+# Status for a copy that arrives while the original is still being processed. It isn't
+# 2xx, so Mailgun delivers the copy again later; if the original fails, the copy is
+# processed then instead of being lost.
+DEDUP_IN_PROGRESS_STATUS = 409
+
+# Parsed and nutrition-enhanced orders, indexed by time/restaurant/service
+ORDER_DB_FILE = "nutrisync_orders.db"
+
+# /nutrition-summary: window when no ?from= is given, and how many orders to list
+SUMMARY_DEFAULT_DAYS = 7
+SUMMARY_RECENT_ORDERS = 10
+# /analytics: window when no ?from= is given
+ANALYTICS_DEFAULT_DAYS = 365
+# /orders: default and largest ?limit=
+ORDERS_DEFAULT_LIMIT = 100
+ORDERS_MAX_LIMIT = 1000
+
 def verify_webhook_signature(token, timestamp, signature):
     """Verify that the webhook is from Mailgun"""
     try:
@@ -20,17 +55,31 @@ def verify_webhook_signature(token, timestamp, signature):
         ).hexdigest()
         return hmac.compare_digest(signature, hmac_digest)
     except Exception as e:
-        print(f"Signature verification error: {e}")
+        log.error('webhook.signature_error', f"Signature verification error: {e}", error=str(e))
         return False
 
+def _current_app() -> Flask:
+    """The app handling the current request, or the module-level app outside one"""
+    return current_app._get_current_object() if has_app_context() else app
+
+def get_nutrition_tracker():
+    """Get the long-lived nutrition tracker owned by this app (created on first use)"""
+    extensions = _current_app().extensions
+    tracker = extensions.get('nutrition_tracker')
+    if tracker is None:
+        from nutrition_tracker import get_tracker
+        tracker = extensions['nutrition_tracker'] = get_tracker()
+    return tracker
+
 def extract_verification_link(body):
-    """Extract Gmail verification link from email body"""
+    """Extract Gmail verification link from email body (a string or ParsedEmail)"""
     
     # Convert HTML to text if needed
-    from bs4 import BeautifulSoup
-    if '<html' in body.lower():
-        soup = BeautifulSoup(body, 'html.parser')
-        text_body = soup.get_text()
+    from email_parser import ParsedEmail
+    email = ParsedEmail.wrap("", body)
+    body = email.body
+    if email.is_html_document:
+        text_body = email.text
     else:
         text_body = body
     
@@ -51,7 +100,7 @@ def extract_verification_link(body):
             return link
     
     # Also check in the original HTML for href attributes
-    if '<html' in body.lower():
+    if email.is_html_document:
         href_pattern = r'href=["\']([^"\']*(?:verify|confirm|forwarding)[^"\']*)["\']'
         href_matches = re.findall(href_pattern, body, re.IGNORECASE)
         if href_matches:
@@ -59,7 +108,7 @@ def extract_verification_link(body):
     
     return None
 
-@app.route('/')
+@bp.route('/')
 def hello():
     return """
     <h1>🍔 NutriSync - DoorDash Order Parser with USDA Macro Tracking</h1>
@@ -73,194 +122,362 @@ def hello():
         <li>✅ Real-time nutrition lookup via USDA API</li>
         <li>✅ Smart food matching (tries multiple search strategies)</li>
         <li>✅ Caching to avoid repeated API calls</li>
-        <li>✅ Enhanced orders saved as <code>enhanced_order_*.json</code></li>
+        <li>✅ Enhanced orders saved to <code>nutrisync_orders.db</code></li>
     </ul>
     
     <h2>🔗 Useful Endpoints</h2>
     <ul>
         <li><a href="/verification-files">/verification-files</a> - View Gmail verification links</li>
         <li><a href="/nutrition-summary">/nutrition-summary</a> - View recent nutrition summary</li>
+        <li><a href="/analytics">/analytics</a> - Rolling averages, macro trends and per-restaurant breakdown</li>
+        <li><a href="/orders">/orders</a> - Order history (<code>?from=&amp;to=&amp;restaurant=&amp;service=</code>)</li>
+        <li><a href="/cache-stats">/cache-stats</a> - Nutrition cache and API client statistics</li>
+        <li><a href="/metrics">/metrics</a> - Stage latencies and cache/API counters (Prometheus format)</li>
         <li><a href="/test">/test</a> - Test with local paste.txt file</li>
     </ul>
     """
 
-@app.route('/webhook/email', methods=['POST'])
-def handle_email():
-    """Process incoming emails with enhanced Gmail verification handling and USDA nutrition tracking"""
+def get_dedup_index():
+    """Get the processed-email index owned by this app"""
+    extensions = _current_app().extensions
+    index = extensions.get('dedup_index')
+    if index is None:
+        from dedup_index import DedupIndex
+        index = extensions['dedup_index'] = DedupIndex(DEDUP_DB_FILE)
+    return index
+
+def get_order_store():
+    """Get the order store owned by this app. On first use, order_*.json files from
+    earlier versions are imported into it."""
+    extensions = _current_app().extensions
+    store = extensions.get('order_store')
+    if store is None:
+        from order_store import OrderStore
+        store = OrderStore(ORDER_DB_FILE)
+        store.import_legacy_files()
+        extensions['order_store'] = store
+    return store
+
+def get_order_analytics():
+    """Get the NumPy analytics view over the order store (columns cached between requests)"""
+    extensions = _current_app().extensions
+    analytics = extensions.get('order_analytics')
+    if analytics is None:
+        from nutrition_analytics import OrderAnalytics
+        analytics = extensions['order_analytics'] = OrderAnalytics(get_order_store())
+    return analytics
+
+def extract_email_fields(email_data):
+    """Get (subject, sender, body) from a Mailgun payload"""
+    subject = email_data.get('subject', '')
+    sender = email_data.get('sender', '') or email_data.get('from', '')
+    body = (email_data.get('stripped-html') or 
+            email_data.get('body-html') or 
+            email_data.get('stripped-text') or
+            email_data.get('body-plain', ''))
+    return subject, sender, body
+
+def in_progress_duplicate():
+    """Response for a copy that arrives while the original is still being processed"""
+    return ({"status": "in_progress", "reason": "Same email is already being processed, retry later"},
+            DEDUP_IN_PROGRESS_STATUS)
+
+def find_processed_email(email_data, digest):
+    """Return (response_dict, http_status) for an email we've already seen, or None"""
+    dedup = get_dedup_index()
+    previous = dedup.find(dedup.aliases_for(email_data), digest)
+    count_cache_lookup('dedup', previous is not None)
+    if previous is None:
+        return None
+    if previous['status'] != 'done':
+        log.info('dedup.in_progress', "♻️ Duplicate email - original copy is still being processed")
+        return in_progress_duplicate()
+    log.info('dedup.duplicate', "♻️ Duplicate email - returning stored result")
+    return dict(previous['result'], duplicate=True), 200
+
+def process_email(email_data, timestamp):
+    """Run the filter -> parse -> nutrition -> save pipeline for one email.
+    Returns (response_dict, http_status)."""
     
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    print(f"\n📧 WEBHOOK RECEIVED - {timestamp}")
+    # Extract email details
+    subject, sender, body = extract_email_fields(email_data)
     
-    try:
-        # Get email data (handle both JSON and form data)
-        email_data = request.get_json() if request.is_json else dict(request.form)
-        
-        # Verify webhook signature (optional but recommended)
-        webhook_signature = email_data.get('signature')
-        webhook_timestamp = email_data.get('timestamp')
-        webhook_token = email_data.get('token')
-        
-        if webhook_signature and webhook_timestamp and webhook_token:
-            if not verify_webhook_signature(webhook_token, webhook_timestamp, webhook_signature):
-                print("❌ Invalid webhook signature")
-                return jsonify({"status": "error", "message": "Invalid signature"}), 403
-        
-        # Extract email details
-        subject = email_data.get('subject', '')
-        sender = email_data.get('sender', '') or email_data.get('from', '')
-        body = (email_data.get('stripped-html') or 
-                email_data.get('body-html') or 
-                email_data.get('stripped-text') or
-                email_data.get('body-plain', ''))
+    # Parsed once here and shared by the filter, service detection and parsers
+    from email_parser import ParsedEmail
+    email = ParsedEmail(subject, body, sender)
+    
+    log.info('email.received', f"From: {sender}\nSubject: {subject}\nBody length: {len(body)}",
+             sender=sender, subject=subject, body_length=len(body))
+    
+    # Handle Gmail verification emails with link extraction
+    if 'forwarding-noreply@google.com' in sender:
+        log.info('gmail.verification', "✅ Gmail verification email received")
         
-        print(f"From: {sender}")
-        print(f"Subject: {subject}")
-        print(f"Body length: {len(body)}")
+        # Extract verification link from email body
+        verification_link = extract_verification_link(email)
         
-        # Handle Gmail verification emails with link extraction
-        if 'forwarding-noreply@google.com' in sender:
-            print("✅ Gmail verification email received")
+        if verification_link:
+            log.info('gmail.verification_link', f"\n🔗 VERIFICATION LINK FOUND:\n🔗 {verification_link}\n"
+                     "🔗 Copy and paste this link in your browser to verify Gmail forwarding!", link=verification_link)
             
-            # Extract verification link from email body
-            verification_link = extract_verification_link(body)
+            # Save verification link to file for easy access
+            verification_file = f"gmail_verification_{timestamp}.txt"
+            with open(verification_file, 'w') as f:
+                f.write(f"Gmail Verification Link:\n")
+                f.write(f"{verification_link}\n\n")
+                f.write(f"Instructions:\n")
+                f.write(f"1. Copy the link above\n")
+                f.write(f"2. Paste it in your browser\n")
+                f.write(f"3. Click to verify Gmail forwarding\n")
+                f.write(f"4. Return to Gmail settings to confirm verification\n")
             
-            if verification_link:
-                print(f"\n🔗 VERIFICATION LINK FOUND:")
-                print(f"🔗 {verification_link}")
-                print(f"🔗 Copy and paste this link in your browser to verify Gmail forwarding!")
-                
-                # Save verification link to file for easy access
-                verification_file = f"gmail_verification_{timestamp}.txt"
-                with open(verification_file, 'w') as f:
-                    f.write(f"Gmail Verification Link:\n")
-                    f.write(f"{verification_link}\n\n")
-                    f.write(f"Instructions:\n")
-                    f.write(f"1. Copy the link above\n")
-                    f.write(f"2. Paste it in your browser\n")
-                    f.write(f"3. Click to verify Gmail forwarding\n")
-                    f.write(f"4. Return to Gmail settings to confirm verification\n")
-                
-                print(f"📄 Verification link saved to: {verification_file}")
-                
-                # Also save the full email for debugging
-                with open(f"gmail_verification_full_{timestamp}.txt", 'w') as f:
-                    f.write(f"Subject: {subject}\n")
-                    f.write(f"From: {sender}\n")
-                    f.write(f"Body:\n{body}\n")
-                
-                return jsonify({
-                    "status": "success", 
-                    "message": "Gmail verification handled",
-                    "verification_link": verification_link,
-                    "instructions": "Copy the verification_link and paste it in your browser to complete Gmail forwarding setup"
-                }), 200
-            else:
-                print("⚠️ No verification link found in email")
-                # Still save the email for manual inspection
-                with open(f"gmail_verification_no_link_{timestamp}.txt", 'w') as f:
-                    f.write(f"Subject: {subject}\n")
-                    f.write(f"From: {sender}\n")
-                    f.write(f"Body:\n{body}\n")
-                
-                return jsonify({
-                    "status": "success", 
-                    "message": "Gmail verification received but no link found",
-                    "note": "Check the saved email file for manual verification"
-                }), 200
+            log.info('gmail.verification_saved', f"📄 Verification link saved to: {verification_file}",
+                     path=verification_file)
+            
+            # Also save the full email for debugging
+            with open(f"gmail_verification_full_{timestamp}.txt", 'w') as f:
+                f.write(f"Subject: {subject}\n")
+                f.write(f"From: {sender}\n")
+                f.write(f"Body:\n{body}\n")
+            
+            return {
+                "status": "success", 
+                "message": "Gmail verification handled",
+                "verification_link": verification_link,
+                "instructions": "Copy the verification_link and paste it in your browser to complete Gmail forwarding setup"
+            }, 200
+        else:
+            log.warning('gmail.no_verification_link', "⚠️ No verification link found in email")
+            # Still save the email for manual inspection
+            with open(f"gmail_verification_no_link_{timestamp}.txt", 'w') as f:
+                f.write(f"Subject: {subject}\n")
+                f.write(f"From: {sender}\n")
+                f.write(f"Body:\n{body}\n")
+            
+            return {
+                "status": "success", 
+                "message": "Gmail verification received but no link found",
+                "note": "Check the saved email file for manual verification"
+            }, 200
+    
+    # Handle other system emails (delivery services send receipts from no-reply addresses too)
+    if any(skip in sender.lower() for skip in ['noreply', 'no-reply', 'system', 'admin']):
+        from email_parser import detect_service_from_sender
+        if detect_service_from_sender(sender) is None and 'doordash' not in subject.lower():
+            log.info('email.ignored', "⏭️ System email - ignoring", reason='system_email')
+            return {"status": "ignored", "reason": "System email"}, 200
+    
+    # Skip copies of emails we've already processed (Mailgun retries, re-forwards)
+    from dedup_index import content_hash
+    dedup = get_dedup_index()
+    aliases = dedup.aliases_for(email_data)
+    digest = content_hash(subject, body)
+    
+    duplicate = find_processed_email(email_data, digest)
+    if duplicate:
+        return duplicate
+    if not dedup.claim(digest):
+        return in_progress_duplicate()
+    
+    try:
+        response, status = process_order_email(email, timestamp)
+    except Exception:
+        dedup.release(digest)
+        raise
+    
+    if response.get('status') in DEDUP_STORED_STATUSES:
+        with STAGE_SECONDS.time('persist'):
+            dedup.record(digest, aliases, response)
+    else:
+        dedup.release(digest)
+    return response, status
+
+def process_order_email(email, timestamp):
+    """Filter, parse, look up nutrition and save one order email (a ParsedEmail).
+    Returns (response_dict, http_status)."""
+    
+    # Process DoorDash emails
+    from email_parser import should_process_email, parse_food_delivery_email
+    
+    with STAGE_SECONDS.time('filter'):
+        passed = should_process_email(email.subject, email, email.sender)
+    if not passed:
+        log.info('email.filtered', "⏭️ Email filtered out")
+        return {"status": "filtered", "reason": "Not a delivery order confirmation"}, 200
+    
+    # Parse order
+    with STAGE_SECONDS.time('parse'):
+        result = parse_food_delivery_email(email.subject, email)
+    
+    if result:
+        item_lines = "".join(f"\n   {i+1}. {item['quantity']}x {item['name']} - ${item['price']}"
+                             for i, item in enumerate(result['items']))
+        log.info('order.parsed', f"\n✅ ORDER PARSED!\n🏪 Restaurant: {result['restaurant']}\n"
+                 f"💰 Total: ${result['total']}\n🍔 Items ({len(result['items'])}):{item_lines}",
+                 service=result.get('service'), restaurant=result['restaurant'], total=result['total'],
+                 items=len(result['items']))
         
-        # Handle other system emails
-        if any(skip in sender.lower() for skip in ['noreply', 'no-reply', 'system', 'admin']):
-            if 'doordash' not in sender.lower() and 'doordash' not in subject.lower():
-                print("⏭️ System email - ignoring")
-                return jsonify({"status": "ignored", "reason": "System email"}), 200
+        # Save original order
+        store = get_order_store()
+        with STAGE_SECONDS.time('persist'):
+            order_id = store.add_order(result)
         
-        # Process DoorDash emails
-        from email_parser import should_process_email, parse_food_delivery_email
+        log.info('order.saved', f"📄 Order saved: #{order_id}", order_id=order_id)
         
-        if not should_process_email(subject, body, sender):
-            print("⏭️ Email filtered out")
-            return jsonify({"status": "filtered", "reason": "Not a DoorDash order"}), 200
+        # NEW: Add USDA nutrition analysis
+        try:
+            from nutrition_tracker import enhance_order_with_nutrition
+            with STAGE_SECONDS.time('nutrition'):
+                enhanced_order = enhance_order_with_nutrition(result, tracker=get_nutrition_tracker())
+            
+            # Save enhanced order with nutrition data
+            with STAGE_SECONDS.time('persist'):
+                store.set_enhanced(order_id, enhanced_order)
+            
+            log.info('order.enhanced', f"🍎 Enhanced order with USDA nutrition saved: #{order_id}", order_id=order_id)
+            
+            # Count successful nutrition lookups
+            items_with_nutrition = sum(1 for item in enhanced_order['items'] if item.get('nutrition'))
+            total_items = len(enhanced_order['items'])
+            
+            # Return enhanced response
+            return {
+                "status": "success",
+                "restaurant": result['restaurant'],
+                "total": result['total'],
+                "items_count": total_items,
+                "nutrition_found": f"{items_with_nutrition}/{total_items}",
+                "total_calories": enhanced_order['meal_totals']['total_calories'],
+                "macro_breakdown": enhanced_order['meal_totals']['macro_percentages'],
+                "timestamp": timestamp,
+                "order_id": order_id,
+                "nutrition_source": "USDA FoodData Central API"
+            }, 200
+            
+        except Exception as nutrition_error:
+            log.error('order.nutrition_failed', f"⚠️ USDA nutrition analysis failed: {nutrition_error}\n"
+                      "📄 Continuing with basic order data...", order_id=order_id, exc_info=True)
+            
+            # Fall back to original behavior if nutrition fails
+            return {
+                "status": "partial_success",
+                "restaurant": result['restaurant'],
+                "total": result['total'],
+                "items_count": len(result['items']),
+                "nutrition_error": str(nutrition_error),
+                "timestamp": timestamp,
+                "order_id": order_id,
+                "note": "Order parsed successfully but nutrition lookup failed"
+            }, 200
         
-        # Parse order
-        result = parse_food_delivery_email(subject, body)
+    else:
+        log.warning('order.parse_failed', "❌ Parsing failed")
+        return {"status": "failed", "reason": "Parsing failed"}, 200
+
+def run_ingestion_job(payload):
+    """Worker entry point for a queued webhook"""
+    response, status = process_email(payload['email_data'], payload['timestamp'])
+    return {"response": response, "http_status": status}
+
+def get_work_queue():
+    """Get the durable ingestion queue owned by this app"""
+    extensions = _current_app().extensions
+    queue = extensions.get('work_queue')
+    if queue is None:
+        from work_queue import WorkQueue
+        queue = extensions['work_queue'] = WorkQueue(QUEUE_DB_FILE)
+    return queue
+
+def start_ingestion_workers():
+    """Start the background ingestion workers (once per process)"""
+    flask_app = _current_app()
+    workers = flask_app.extensions.get('ingestion_workers')
+    if workers is None:
+        from work_queue import WorkerPool
+
+        def run_job(payload):
+            with flask_app.app_context():
+                return run_ingestion_job(payload)
+
+        workers = flask_app.extensions['ingestion_workers'] = WorkerPool(
+            get_work_queue(), run_job, num_workers=INGESTION_WORKERS)
+        workers.start()
+    return workers
+
+@bp.before_app_request
+def ensure_ingestion_workers():
+    """Start this process's ingestion workers on its first request, so jobs left in the
+    durable queue by a previous run are picked up (gunicorn starts them at fork instead)"""
+    if ASYNC_INGESTION:
+        start_ingestion_workers()
+
+@bp.route('/webhook/email', methods=['POST'])
+@profiled('webhook')
+def handle_email():
+    """Process incoming emails with enhanced Gmail verification handling and USDA nutrition tracking"""
+    
+    # Whole-request latency, alongside the per-stage timings inside
+    with STAGE_SECONDS.time('webhook'):
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        log.info('webhook.received', f"\n📧 WEBHOOK RECEIVED - {timestamp}")
         
-        if result:
-            print(f"\n✅ ORDER PARSED!")
-            print(f"🏪 Restaurant: {result['restaurant']}")
-            print(f"💰 Total: ${result['total']}")
-            print(f"🍔 Items ({len(result['items'])}):")
-            
-            for i, item in enumerate(result['items']):
-                print(f"   {i+1}. {item['quantity']}x {item['name']} - ${item['price']}")
+        try:
+            # Get email data (handle both JSON and form data)
+            email_data = request.get_json() if request.is_json else dict(request.form)
             
-            # Save original order
-            order_file = f"order_{timestamp}.json"
-            with open(order_file, 'w') as f:
-                json.dump(result, f, indent=2)
+            # Verify webhook signature (optional but recommended)
+            webhook_signature = email_data.get('signature')
+            webhook_timestamp = email_data.get('timestamp')
+            webhook_token = email_data.get('token')
             
-            print(f"📄 Order saved to: {order_file}")
+            if webhook_signature and webhook_timestamp and webhook_token:
+                with STAGE_SECONDS.time('signature'):
+                    valid = verify_webhook_signature(webhook_token, webhook_timestamp, webhook_signature)
+                if not valid:
+                    log.warning('webhook.invalid_signature', "❌ Invalid webhook signature")
+                    return jsonify({"status": "error", "message": "Invalid signature"}), 403
             
-            # NEW: Add USDA nutrition analysis
-            try:
-                print(f"\n🔄 STARTING USDA NUTRITION LOOKUP...")
-                from nutrition_tracker import enhance_order_with_nutrition
-                enhanced_order = enhance_order_with_nutrition(result)
-                
-                # Save enhanced order with nutrition data
-                enhanced_file = f"enhanced_order_{timestamp}.json"
-                with open(enhanced_file, 'w') as f:
-                    json.dump(enhanced_order, f, indent=2)
-                
-                print(f"🍎 Enhanced order with USDA nutrition saved to: {enhanced_file}")
-                
-                # Count successful nutrition lookups
-                items_with_nutrition = sum(1 for item in enhanced_order['items'] if item.get('nutrition'))
-                total_items = len(enhanced_order['items'])
-                
-                # Return enhanced response
-                return jsonify({
-                    "status": "success",
-                    "restaurant": result['restaurant'],
-                    "total": result['total'],
-                    "items_count": total_items,
-                    "nutrition_found": f"{items_with_nutrition}/{total_items}",
-                    "total_calories": enhanced_order['meal_totals']['total_calories'],
-                    "macro_breakdown": enhanced_order['meal_totals']['macro_percentages'],
-                    "timestamp": timestamp,
-                    "order_file": order_file,
-                    "enhanced_file": enhanced_file,
-                    "nutrition_source": "USDA FoodData Central API"
-                }), 200
-                
-            except Exception as nutrition_error:
-                print(f"⚠️ USDA nutrition analysis failed: {nutrition_error}")
-                print("📄 Continuing with basic order data...")
-                import traceback
-                traceback.print_exc()
+            # Async mode: persist the email and reply right away; workers do the rest
+            if ASYNC_INGESTION:
+                # Answer known duplicates straight away instead of queueing them again
+                from dedup_index import content_hash
+                subject, _, body = extract_email_fields(email_data)
+                duplicate = find_processed_email(email_data, content_hash(subject, body))
+                if duplicate:
+                    response, status = duplicate
+                    return jsonify(response), status
                 
-                # Fall back to original behavior if nutrition fails
+                job_id = get_work_queue().enqueue({"email_data": email_data, "timestamp": timestamp})
+                log.info('webhook.queued', f"📥 Queued as job {job_id}", job_id=job_id)
                 return jsonify({
-                    "status": "partial_success",
-                    "restaurant": result['restaurant'],
-                    "total": result['total'],
-                    "items_count": len(result['items']),
-                    "nutrition_error": str(nutrition_error),
-                    "timestamp": timestamp,
-                    "order_file": order_file,
-                    "note": "Order parsed successfully but nutrition lookup failed"
-                }), 200
+                    "status": "queued",
+                    "job_id": job_id,
+                    "status_url": f"/jobs/{job_id}",
+                    "timestamp": timestamp
+                }), 202
             
-        else:
-            print("❌ Parsing failed")
-            return jsonify({"status": "failed", "reason": "Parsing failed"}), 200
-            
-    except Exception as e:
-        print(f"❌ Webhook Error: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"status": "error", "error": str(e)}), 200  # Return 200 to avoid retries
+            response, status = process_email(email_data, timestamp)
+            return jsonify(response), status
+                
+        except Exception as e:
+            log.error('webhook.error', f"❌ Webhook Error: {e}", exc_info=True)
+            return jsonify({"status": "error", "error": str(e)}), 200  # Return 200 to avoid retries
+
+@bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status (and result, once finished) of a queued webhook"""
+    job = get_work_queue().get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    return jsonify(job)
 
-@app.route('/test')
+@bp.route('/jobs')
+def job_counts():
+    """Number of queued/running/done/failed ingestion jobs"""
+    return jsonify({"async_ingestion": ASYNC_INGESTION, "jobs": get_work_queue().counts()})
+
+@bp.route('/test')
+@profiled('test')
 def test():
     """Test with local file using USDA nutrition lookup"""
     try:
@@ -270,18 +487,18 @@ def test():
         subject = "Fwd: Order Confirmation for Kevin from McDonald's"
         sender = "xuk654@gmail.com"
         
-        from email_parser import should_process_email, parse_food_delivery_email
+        from email_parser import ParsedEmail, should_process_email, parse_food_delivery_email
         
-        print(f"\n🧪 LOCAL TEST - {subject}")
-        print(f"🔑 Testing USDA API nutrition lookup...")
+        log.info('test.start', f"\n🧪 LOCAL TEST - {subject}\n🔑 Testing USDA API nutrition lookup...")
         
-        if should_process_email(subject, body, sender):
-            result = parse_food_delivery_email(subject, body)
+        email = ParsedEmail(subject, body, sender)
+        if should_process_email(subject, email, sender):
+            result = parse_food_delivery_email(subject, email)
             if result:
                 # Test USDA nutrition analysis
                 try:
                     from nutrition_tracker import enhance_order_with_nutrition
-                    enhanced_order = enhance_order_with_nutrition(result)
+                    enhanced_order = enhance_order_with_nutrition(result, tracker=get_nutrition_tracker())
                     
                     # Count successful lookups
                     items_with_nutrition = sum(1 for item in enhanced_order['items'] if item.get('nutrition'))
@@ -297,8 +514,7 @@ def test():
                         "test_note": "Using USDA FoodData Central API for real nutrition data"
                     })
                 except Exception as e:
-                    import traceback
-                    traceback.print_exc()
+                    log.error('test.nutrition_failed', f"⚠️ Nutrition lookup failed: {e}", exc_info=True)
                     return jsonify({
                         "status": "partial_success",
                         "restaurant": result['restaurant'],
@@ -315,7 +531,7 @@ def test():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
-@app.route('/verification-files')
+@bp.route('/verification-files')
 def list_verification_files():
     """List all verification files for easy access"""
     import os
@@ -344,33 +560,27 @@ def list_verification_files():
         "instructions": "Check the most recent file for your Gmail verification link"
     })
 
-@app.route('/nutrition-summary')
+@bp.route('/nutrition-summary')
 def nutrition_summary():
-    """Get nutrition summary from recent enhanced orders"""
-    import glob
-    from datetime import datetime, timedelta
+    """Get nutrition summary for ?from=YYYY-MM-DD&to=YYYY-MM-DD (default: last 7 days).
+    Totals come from the per-day rollups, so the cost grows with days, not orders."""
+    from datetime import date, timedelta
     
-    # Get enhanced order files from last 7 days
-    recent_files = []
-    cutoff_date = datetime.now() - timedelta(days=7)
+    try:
+        end_day = date.fromisoformat(request.args['to']) if request.args.get('to') else date.today()
+        start_day = (date.fromisoformat(request.args['from']) if request.args.get('from')
+                     else end_day - timedelta(days=SUMMARY_DEFAULT_DAYS - 1))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if start_day > end_day:
+        return jsonify({"status": "error", "message": "'from' must not be after 'to'"}), 400
     
-    for file in glob.glob("enhanced_order_*.json"):
-        try:
-            # Extract timestamp from filename
-            timestamp_str = file.replace("enhanced_order_", "").replace(".json", "")
-            file_date = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S")
-            
-            if file_date >= cutoff_date:
-                recent_files.append((file, file_date))
-        except:
-            continue
+    store = get_order_store()
+    daily = store.daily_rollups(start_day, end_day)
     
-    if not recent_files:
+    if not daily:
         return jsonify({"message": "No recent enhanced orders found"})
     
-    # Sort by date (most recent first)
-    recent_files.sort(key=lambda x: x[1], reverse=True)
-    
     total_nutrition = {
         'total_calories': 0,
         'total_protein': 0,
@@ -379,51 +589,51 @@ def nutrition_summary():
         'total_sodium': 0,
         'total_cost': 0
     }
+    total_orders = 0
     
-    orders = []
+    for day in daily:
+        total_orders += day['orders']
+        total_nutrition['total_calories'] += day['calories']
+        total_nutrition['total_protein'] += day['protein']
+        total_nutrition['total_carbs'] += day['carbs']
+        total_nutrition['total_fat'] += day['fat']
+        total_nutrition['total_sodium'] += day['sodium']
+        total_nutrition['total_cost'] += day['cost']
     
-    for file_path, file_date in recent_files:
-        try:
-            with open(file_path, 'r') as f:
-                order = json.load(f)
-            
-            meal_totals = order.get('meal_totals', {})
-            
-            # Add to running totals
-            total_nutrition['total_calories'] += meal_totals.get('total_calories', 0)
-            total_nutrition['total_protein'] += meal_totals.get('total_protein', 0)
-            total_nutrition['total_carbs'] += meal_totals.get('total_carbs', 0)
-            total_nutrition['total_fat'] += meal_totals.get('total_fat', 0)
-            total_nutrition['total_sodium'] += meal_totals.get('total_sodium', 0)
-            total_nutrition['total_cost'] += order.get('total', 0)
-            
-            # Count nutrition sources
-            nutrition_sources = []
-            for item in order.get('items', []):
-                if item.get('nutrition') and item['nutrition'].get('source'):
-                    nutrition_sources.append(item['nutrition']['source'])
-            
-            orders.append({
-                'restaurant': order.get('restaurant'),
-                'date': file_date.strftime('%Y-%m-%d %H:%M'),
-                'total_cost': order.get('total'),
-                'calories': meal_totals.get('total_calories', 0),
-                'protein': meal_totals.get('total_protein', 0),
-                'carbs': meal_totals.get('total_carbs', 0),
-                'fat': meal_totals.get('total_fat', 0),
-                'nutrition_sources': list(set(nutrition_sources))  # Unique sources
-            })
-            
-        except Exception as e:
-            print(f"Error processing {file_path}: {e}")
-            continue
+    # Most recent orders in the range (an indexed, LIMITed query)
+    orders = []
+    for record in store.query(start=datetime.combine(start_day, datetime.min.time()),
+                              end=datetime.combine(end_day + timedelta(days=1), datetime.min.time()),
+                              enhanced_only=True, limit=SUMMARY_RECENT_ORDERS):
+        order = record['enhanced']
+        meal_totals = order.get('meal_totals', {})
+        
+        # Count nutrition sources
+        nutrition_sources = []
+        for item in order.get('items', []):
+            if item.get('nutrition') and item['nutrition'].get('source'):
+                nutrition_sources.append(item['nutrition']['source'])
+        
+        orders.append({
+            'restaurant': order.get('restaurant'),
+            'date': record['ordered_at'].strftime('%Y-%m-%d %H:%M'),
+            'total_cost': order.get('total'),
+            'calories': meal_totals.get('total_calories', 0),
+            'protein': meal_totals.get('total_protein', 0),
+            'carbs': meal_totals.get('total_carbs', 0),
+            'fat': meal_totals.get('total_fat', 0),
+            'nutrition_sources': list(set(nutrition_sources))  # Unique sources
+        })
     
-    # Calculate average daily nutrition (if multiple days)
-    days_span = max(1, (recent_files[0][1] - recent_files[-1][1]).days + 1)
+    # Average over every day in the range, including days without orders
+    days_span = (end_day - start_day).days + 1
     
     return jsonify({
-        "summary_period": f"Last {days_span} days",
-        "total_orders": len(orders),
+        "summary_period": (f"{start_day.isoformat()} to {end_day.isoformat()}" if request.args.get('to')
+                           else f"Last {days_span} days"),
+        "from": start_day.isoformat(),
+        "to": end_day.isoformat(),
+        "total_orders": total_orders,
         "total_nutrition": total_nutrition,
         "daily_averages": {
             'avg_calories': round(total_nutrition['total_calories'] / days_span, 1),
@@ -432,43 +642,192 @@ def nutrition_summary():
             'avg_fat': round(total_nutrition['total_fat'] / days_span, 1),
             'avg_cost': round(total_nutrition['total_cost'] / days_span, 2)
         },
+        "daily_totals": [
+            {
+                'date': day['day'].isoformat(),
+                'orders': day['orders'],
+                'calories': round(day['calories'], 1),
+                'protein': round(day['protein'], 1),
+                'carbs': round(day['carbs'], 1),
+                'fat': round(day['fat'], 1),
+                'cost': round(day['cost'], 2)
+            }
+            for day in daily
+        ],
         "recent_orders": orders,
         "nutrition_source": "USDA FoodData Central API",
         "note": "All nutrition data sourced from USDA government database"
     })
 
-@app.route('/cache-stats')
+@bp.route('/analytics')
+def nutrition_analytics():
+    """Long-range analytics for ?from=YYYY-MM-DD&to=YYYY-MM-DD&restaurant= (default: last year):
+    rolling 7/30-day averages, macro trends, spend per 1000 kcal, per-restaurant breakdown"""
+    from datetime import date, timedelta
+    
+    try:
+        end_day = date.fromisoformat(request.args['to']) if request.args.get('to') else date.today()
+        start_day = (date.fromisoformat(request.args['from']) if request.args.get('from')
+                     else end_day - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if start_day > end_day:
+        return jsonify({"status": "error", "message": "'from' must not be after 'to'"}), 400
+    
+    return jsonify(get_order_analytics().summary(start_day, end_day, restaurant=request.args.get('restaurant')))
+
+@bp.route('/orders')
+def list_orders():
+    """Order history, filtered by ?from=YYYY-MM-DD&to=YYYY-MM-DD&restaurant=&service=&limit=
+    (both days included, like /nutrition-summary and /analytics)"""
+    from datetime import date, timedelta
+    
+    try:
+        start_day = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end_day = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+        limit = int(request.args.get('limit', ORDERS_DEFAULT_LIMIT))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if start_day and end_day and start_day > end_day:
+        return jsonify({"status": "error", "message": "'from' must not be after 'to'"}), 400
+    if not 1 <= limit <= ORDERS_MAX_LIMIT:
+        return jsonify({"status": "error", "message": f"'limit' must be between 1 and {ORDERS_MAX_LIMIT}"}), 400
+    
+    orders = get_order_store().query(
+        start=datetime.combine(start_day, datetime.min.time()) if start_day else None,
+        end=datetime.combine(end_day + timedelta(days=1), datetime.min.time()) if end_day else None,
+        restaurant=request.args.get('restaurant'),
+        service=request.args.get('service'),
+        limit=limit,
+    )
+    return jsonify({
+        "count": len(orders),
+        "orders": [
+            {
+                'id': record['id'],
+                'date': record['ordered_at'].strftime('%Y-%m-%d %H:%M'),
+                'service': record['service'],
+                'restaurant': record['restaurant'],
+                'total_cost': record['total'],
+                'items': record['order'].get('items', []),
+                'meal_totals': (record['enhanced'] or {}).get('meal_totals'),
+            }
+            for record in orders
+        ],
+    })
+
+@bp.route('/cache-stats')
 def cache_stats():
     """View nutrition cache statistics"""
+    tracker = get_nutrition_tracker()
+    # Items Nutritionix could not match, skipped until their entry expires
+    negative_cache = tracker.negative_cache.stats()
+    # Request/retry counts, circuit breaker state and today's quota usage
+    api_client = tracker.client.stats()
     try:
-        with open('nutrition_cache.json', 'r') as f:
-            cache = json.load(f)
-        
-        # Analyze cache contents
+        # The tracker's own cache (SQLite or JSON, whichever it is configured with)
         sources = {}
-        total_items = len(cache)
-        
-        for key, data in cache.items():
+        total_items = 0
+        for key, data in tracker.cache.items():
+            total_items += 1
             source = data.get('source', 'unknown')
-            if source not in sources:
-                sources[source] = 0
-            sources[source] += 1
+            sources[source] = sources.get(source, 0) + 1
         
         return jsonify({
             "total_cached_items": total_items,
             "sources_breakdown": sources,
-            "cache_file": "nutrition_cache.json",
+            "cache_file": tracker.cache_file,
+            "negative_cache": negative_cache,
+            "api_client": api_client,
             "note": "Cache helps avoid repeated USDA API calls for same food items"
         })
         
-    except FileNotFoundError:
-        return jsonify({
-            "total_cached_items": 0,
-            "message": "No cache file found yet - will be created after first nutrition lookup"
-        })
     except Exception as e:
         return jsonify({"error": str(e)})
 
+@bp.route('/profiles/<path:filename>')
+def profile_file(filename):
+    """A per-request profile (folded stacks) linked from a profiled response"""
+    if not profiling_available():
+        abort(404)
+    return send_from_directory(PROFILE_DIR, filename, mimetype='text/plain')
+
+@bp.route('/metrics')
+def metrics():
+    """Stage latencies, cache hit/miss counts and Nutritionix calls, in Prometheus text format"""
+    return REGISTRY.render(), 200, {'Content-Type': PROMETHEUS_CONTENT_TYPE}
+
+@bp.route('/cache/reload', methods=['POST'])
+def reload_cache():
+    """Re-read the nutrition cache from disk (picks up entries from other workers)"""
+    tracker = get_nutrition_tracker()
+    tracker.reload_cache()
+    return jsonify({"status": "success", "cached_items": len(tracker.cache)})
+
+@bp.route('/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Forget one cache entry (?key=...) or drop the whole in-memory cache tier"""
+    tracker = get_nutrition_tracker()
+    key = request.args.get('key')
+    tracker.invalidate_cache(key)
+    return jsonify({"status": "success", "invalidated": key or "all", "cached_items": len(tracker.cache)})
+
+# Modules that handlers import on first use; preload_app() imports them up front
+PRELOAD_MODULES = ('bs4', 'email_parser', 'nutrition_tracker', 'dedup_index', 'order_store',
+                   'nutrition_analytics', 'work_queue')
+# A small receipt run through the parsers at preload, so regexes compiled on first
+# use (re's cache) and the HTML parser's setup are done before workers fork
+PRELOAD_SAMPLE_EMAIL = (
+    "Order Confirmation for Kevin from McDonald's",
+    "no-reply@doordash.com",
+    "<html><body><p>Paid with Apple Pay</p><p>McDonald's</p><p>Total: $12.34</p>"
+    "<p>1x McDouble (Individual Items) $3.49</p><p>Total Charged $12.34</p></body></html>",
+)
+
+def preload_app(flask_app: Flask):
+    """
+    Does the work handlers otherwise leave to the first request: imports the
+    parsers, BeautifulSoup, lxml and NumPy, runs a sample receipt through the
+    parser, and loads the nutrition cache and branded-item index into memory.
+    """
+    import importlib
+    from email_parser import ParsedEmail, parse_food_delivery_email
+
+    start = time.perf_counter()
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+
+    subject, sender, body = PRELOAD_SAMPLE_EMAIL
+    email = ParsedEmail(subject, body, sender)
+    order = parse_food_delivery_email(subject, email, sender) or {}
+    extract_verification_link(email)
+
+    with flask_app.app_context():
+        tracker = get_nutrition_tracker()
+        for item in order.get('items', []):
+            tracker.clean_item_name(item['name'])
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    log.info('app.preloaded', f"🔥 Preloaded parsers and nutrition cache in {elapsed_ms:.0f} ms "
+             f"({len(tracker.cache)} cached items, {len(tracker.branded_index)} branded items)",
+             duration_ms=round(elapsed_ms, 1), cached_items=len(tracker.cache),
+             branded_items=len(tracker.branded_index))
+
+def create_app(preload: bool = False) -> Flask:
+    """
+    Builds the NutriSync app. With preload=True, everything handlers load lazily
+    is loaded now (see preload_app), so a pre-forking server can load it once and
+    share it with its workers copy-on-write (see wsgi.py).
+    """
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(bp)
+    if preload:
+        preload_app(flask_app)
+    return flask_app
+
+# The app used by `python app.py`, scripts and the benchmarks
+app = create_app()
+
 if __name__ == '__main__':
     print("🚀 Starting NutriSync with USDA API Integration...")
     print("📧 Ready for DoorDash order emails")
@@ -478,12 +837,20 @@ if __name__ == '__main__':
     print("🔑 Using your USDA API key: YzTOpkjoupRbj0RJ7mzt5Jjp6igfFgg1uAz1u6rg")
     print("📄 Files saved:")
     print("   - gmail_verification_*.txt (Gmail setup)")
-    print("   - order_*.json (original orders)")
-    print("   - enhanced_order_*.json (with USDA nutrition)")
-    print("   - nutrition_cache.json (API response cache)")
+    print(f"   - {ORDER_DB_FILE} (orders, with USDA nutrition)")
+    print("   - nutritionix_cache.db (API response cache)")
     print("🌐 Endpoints:")
     print("   - http://localhost:5000/ (home)")
     print("   - http://localhost:5000/test (test with paste.txt)")
-    print("   - http://localhost:5000/nutrition-summary (recent nutrition)")
+    print("   - http://localhost:5000/nutrition-summary (nutrition, ?from=&to=)")
+    print("   - http://localhost:5000/analytics (long-range trends, ?from=&to=&restaurant=)")
+    print("   - http://localhost:5000/orders (order history, ?from=&to=&restaurant=&service=)")
     print("   - http://localhost:5000/cache-stats (API cache stats)")
+    print("   - http://localhost:5000/metrics (Prometheus metrics)")
+    print("   - http://localhost:5000/jobs (async ingestion queue)")
+    if ASYNC_INGESTION:
+        print(f"📥 Async ingestion enabled ({INGESTION_WORKERS} workers, queue: {QUEUE_DB_FILE})")
+        start_ingestion_workers()
+    if profiling_available():
+        print(f"🔬 Per-request profiling enabled (profiles in {PROFILE_DIR}/, served at /profiles/<file>)")
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,301 @@
+"""Bulk import of past delivery receipts from an mbox file or a directory of .eml files.
+
+Messages are streamed from disk and parsed across a pool of worker processes, so
+the mailbox is never held in memory and throughput scales with CPU cores:
+
+    python backfill.py "~/Takeout/Mail/All mail.mbox"
+    python backfill.py ./receipts/ --workers 8 --jsonl backfill_orders.jsonl
+
+Orders go into the app's order store (nutrisync_orders.db) unless --jsonl is given.
+The nutrition summary and analytics only count orders with nutrition data, so pass
+--enhance to look each imported order up before it is stored:
+
+    python backfill.py ./receipts/ --enhance
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from email import policy
+from email.parser import BytesParser
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional
+
+
+def iter_mbox_messages(path: str) -> Iterator[bytes]:
+    """Yield raw messages from an mbox file one at a time.
+    Reads line by line instead of building mailbox.mbox's table of contents."""
+    lines: List[bytes] = []
+    previous_blank = True
+    with open(path, 'rb') as f:
+        for line in f:
+            # A "From " line only separates messages at the start or after a blank line
+            if line.startswith(b'From ') and previous_blank:
+                if lines:
+                    yield b''.join(lines)
+                lines = []
+                previous_blank = False
+                continue
+            previous_blank = line in (b'\n', b'\r\n')
+            # Undo mboxrd ">From " quoting
+            if line.startswith(b'>') and line.lstrip(b'>').startswith(b'From '):
+                line = line[1:]
+            lines.append(line)
+    if lines:
+        yield b''.join(lines)
+
+
+def iter_eml_messages(directory: str) -> Iterator[bytes]:
+    """Yield raw messages from every .eml file under `directory`."""
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith('.eml'):
+                with open(os.path.join(root, name), 'rb') as f:
+                    yield f.read()
+
+
+def iter_messages(source: str) -> Iterator[bytes]:
+    return iter_eml_messages(source) if os.path.isdir(source) else iter_mbox_messages(source)
+
+
+def _init_worker():
+    # The parsers log progress for every email; workers only report problems.
+    # Logging is set up here, not by swapping sys.stdout: the at-fork hook has already
+    # bound the log writer to the real stdout by the time this runs.
+    from event_log import configure_logging
+    configure_logging(level='WARNING')
+
+
+def _message_body(message) -> str:
+    """Prefer the HTML part (what Mailgun's stripped-html gives the webhook), then plain text."""
+    part = message.get_body(preferencelist=('html', 'plain'))
+    if part is None:
+        return ''
+    try:
+        return part.get_content()
+    except (LookupError, UnicodeDecodeError):
+        payload = part.get_payload(decode=True) or b''
+        return payload.decode('utf-8', 'replace')
+
+
+def process_raw_message(raw: bytes) -> Optional[Dict]:
+    """Parse one raw email. Returns an order record, or None if it isn't a receipt."""
+    from email_parser import ParsedEmail, detect_service, parse_food_delivery_email, should_process_email
+
+    message = BytesParser(policy=policy.default).parsebytes(raw)
+    subject = str(message.get('Subject', ''))
+    sender = str(message.get('From', ''))
+    email = ParsedEmail(subject, _message_body(message), sender)
+
+    service = detect_service(subject, email, sender)
+    if service is None:
+        return None
+    # Same filter as the webhook, so promos and account emails aren't imported
+    if not should_process_email(subject, email, sender):
+        return None
+
+    order = parse_food_delivery_email(subject, email, sender)
+    if not order or not order.get('items'):
+        return None
+
+    try:
+        email_date = parsedate_to_datetime(message['Date']).isoformat() if message['Date'] else None
+    except (TypeError, ValueError):
+        email_date = None
+
+    order['email_date'] = email_date
+    order['message_id'] = str(message.get('Message-ID', '')).strip() or None
+    order['subject'] = subject
+    return order
+
+
+def process_batch(raw_messages: List[bytes]) -> List[Optional[Dict]]:
+    results = []
+    for raw in raw_messages:
+        try:
+            results.append(process_raw_message(raw))
+        except Exception:
+            # One malformed email shouldn't lose the rest of the batch
+            results.append(None)
+    return results
+
+
+def _batches(messages: Iterator[bytes], size: int) -> Iterator[List[bytes]]:
+    batch = []
+    for raw in messages:
+        batch.append(raw)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class JsonlOrderWriter:
+    """Buffers orders and appends them to a JSON Lines file in bulk."""
+
+    def __init__(self, path: str, batch_size: int = 500):
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer: List[Dict] = []
+        self.written = 0
+
+    def add(self, order: Dict):
+        self.buffer.append(order)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(order) + '\n' for order in self.buffer))
+        self.written += len(self.buffer)
+        self.buffer = []
+
+
+class OrderStoreWriter:
+    """Buffers orders and bulk-inserts them into an OrderStore. Orders are keyed by
+    Message-ID, so re-running a backfill over the same mailbox adds nothing twice.
+    With `tracker` set, each order is stored with its nutrition-enhanced version too,
+    so it counts towards the daily rollups."""
+
+    def __init__(self, store, batch_size: int = 500, tracker=None):
+        self.store = store
+        self.batch_size = batch_size
+        self.tracker = tracker
+        self.buffer: List[Dict] = []
+        self.written = 0
+        self.enhanced = 0
+
+    def add(self, order: Dict):
+        self.buffer.append(order)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    @staticmethod
+    def _record(order: Dict) -> Dict:
+        ordered_at = datetime.fromisoformat(order['email_date']) if order.get('email_date') else None
+        message_id = order.get('message_id')
+        return {
+            'order': order,
+            'ordered_at': ordered_at,
+            'source': 'backfill',
+            'source_key': f"message-id:{message_id.strip('<>').lower()}" if message_id else None,
+        }
+
+    def _enhance(self, order: Dict) -> Optional[Dict]:
+        from nutrition_tracker import enhance_order_with_nutrition
+        try:
+            enhanced = enhance_order_with_nutrition(order, tracker=self.tracker)
+        except Exception as e:
+            # Keep the order; it just won't count towards the rollups
+            print(f"⚠️ Nutrition lookup failed for {order.get('restaurant')}: {e}", flush=True)
+            return None
+        self.enhanced += 1
+        return enhanced
+
+    def flush(self):
+        if not self.buffer:
+            return
+        records = [self._record(order) for order in self.buffer]
+        if self.tracker is not None:
+            for record in records:
+                record['enhanced'] = self._enhance(record['order'])
+            # Persist lookups as we go, so an interrupted backfill doesn't repeat them
+            self.tracker.save_cache()
+        self.written += self.store.bulk_insert(records)
+        self.buffer = []
+
+
+def run_backfill(source: str, writer, workers: Optional[int] = None, batch_size: int = 32,
+                 progress_interval: float = 2.0) -> Dict:
+    """Stream messages from `source` through a process pool and hand orders to `writer`.
+    At most a few batches per worker are in flight, so memory stays bounded."""
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2
+    seen_message_ids = set()
+    stats = {'messages': 0, 'bytes': 0, 'orders': 0, 'duplicates': 0}
+    start = last_report = time.perf_counter()
+
+    def report(final=False):
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        label = "✅ Done" if final else "⏳"
+        print(f"{label} {stats['messages']} messages, {stats['orders']} orders "
+              f"({stats['messages'] / elapsed:.0f} msg/s, {stats['bytes'] / elapsed / 1e6:.1f} MB/s)", flush=True)
+
+    def collect(future):
+        for order in future.result():
+            if order is None:
+                continue
+            message_id = order.get('message_id')
+            if message_id and message_id in seen_message_ids:
+                stats['duplicates'] += 1
+                continue
+            if message_id:
+                seen_message_ids.add(message_id)
+            writer.add(order)
+            stats['orders'] += 1
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        in_flight = set()
+        for batch in _batches(iter_messages(source), batch_size):
+            stats['messages'] += len(batch)
+            stats['bytes'] += sum(len(raw) for raw in batch)
+            in_flight.add(pool.submit(process_batch, batch))
+
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+
+            if time.perf_counter() - last_report >= progress_interval:
+                report()
+                last_report = time.perf_counter()
+
+        for future in in_flight:
+            collect(future)
+
+    writer.flush()
+    stats['seconds'] = round(time.perf_counter() - start, 2)
+    report(final=True)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import past delivery receipts from an mbox file or .eml directory")
+    parser.add_argument('source', help="mbox file, or directory containing .eml files")
+    parser.add_argument('--db', default='nutrisync_orders.db', help="order store database to import into")
+    parser.add_argument('--jsonl', default=None, help="append orders to this JSON Lines file instead of the store")
+    parser.add_argument('--workers', type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument('--batch-size', type=int, default=32, help="messages per worker task")
+    parser.add_argument('--enhance', action='store_true',
+                        help="look up nutrition for each order before storing it; without this, imported orders "
+                             "are not counted by /nutrition-summary or /analytics")
+    args = parser.parse_args(argv)
+    if args.enhance and args.jsonl:
+        parser.error("--enhance only applies when importing into the order store")
+
+    print(f"📬 Importing receipts from {args.source} with {args.workers or os.cpu_count()} workers")
+    if args.jsonl:
+        writer, destination = JsonlOrderWriter(args.jsonl), args.jsonl
+    else:
+        from order_store import OrderStore
+        tracker = None
+        if args.enhance:
+            from nutrition_tracker import get_tracker
+            tracker = get_tracker()
+        writer, destination = OrderStoreWriter(OrderStore(args.db), tracker=tracker), args.db
+    stats = run_backfill(args.source, writer, workers=args.workers, batch_size=args.batch_size)
+    print(f"📄 {writer.written} orders written to {destination} "
+          f"({stats['duplicates']} duplicate messages skipped, {stats['seconds']}s)")
+    if args.enhance:
+        print(f"🍎 {writer.enhanced} orders enhanced with nutrition data")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
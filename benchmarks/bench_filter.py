@@ -0,0 +1,161 @@
+"""Benchmark should_process_email against the original multi-scan filter.
+
+Checks that both filters make the same accept/reject decision on every email in
+the corpus, then times them. Run from the repository root:
+
+    python benchmarks/bench_filter.py [--repeat N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_log import configure_logging
+from email_parser import should_process_email
+
+# The filter logs through a queue, not print(), so silence it at the source
+configure_logging(level='WARNING')
+
+def legacy_should_process_email(subject, body, sender):
+    """The original multi-scan filter, kept verbatim as the reference implementation"""
+    
+    print(f"\n🔍 FILTERING EMAIL...")
+    print(f"   Subject: {subject}")
+    
+    # Must be from DoorDash (direct or forwarded)
+    is_doordash = (
+        "no-reply@doordash.com" in (sender or "") or
+        "doordash.com" in (sender or "") or
+        "no-reply@doordash.com" in body or
+        "DoorDash Order" in body or
+        ("doordash" in body.lower() and "forwarded message" in body.lower())
+    )
+    
+    if not is_doordash:
+        print("   ❌ Not from DoorDash")
+        return False
+    
+    # Must have order confirmation indicators
+    order_indicators = [
+        "Order Confirmation for", "Thanks for your order", "Total Charged",
+        "Your receipt", "Track Your Order"
+    ]
+    
+    found_indicators = [ind for ind in order_indicators if ind in body]
+    if not found_indicators:
+        print("   ❌ No order confirmation indicators")
+        return False
+    
+    # Must have financial indicators
+    financial_indicators = ["Total Charged", "Subtotal", "Delivery Fee", "Service Fee", "$"]
+    found_financial = [ind for ind in financial_indicators if ind in body]
+    if not found_financial:
+        print("   ❌ No financial indicators")
+        return False
+    
+    # Exclude non-order emails
+    exclusions = [
+        "login", "password", "reset", "verification", "promotional", "marketing",
+        "survey", "rate your", "we miss you", "special offer", "account", "security"
+    ]
+    
+    combined_text = (body + " " + subject).lower()
+    exclusions_found = [exc for exc in exclusions if exc in combined_text]
+    if exclusions_found:
+        print(f"   ❌ Contains exclusions: {exclusions_found}")
+        return False
+    
+    # Check for restaurant pattern
+    restaurant_found = bool(re.search(r"Order Confirmation for .+ from (.+)", body, re.IGNORECASE))
+    
+    # Final validation - need multiple strong indicators
+    strong_indicators = [
+        "Order Confirmation" in body,
+        "Total Charged" in body,
+        "Your receipt" in body,
+        "Track Your Order" in body,
+        "Delivery Fee" in body or "Service Fee" in body,
+        restaurant_found
+    ]
+    
+    strong_count = sum(strong_indicators)
+    print(f"   ✓ Strong indicators: {strong_count}/6")
+    
+    if strong_count >= 3:
+        print("   ✅ EMAIL PASSES FILTER")
+        return True
+    else:
+        print(f"   ❌ Not enough indicators ({strong_count}/6)")
+        return False
+
+def build_corpus(seed=0):
+    """A mix of real, HTML, oversized, rejected and randomly mutated emails"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, 'paste.txt'), 'r', encoding='utf-8') as f:
+        receipt = f.read()
+    
+    subject = "Fwd: Order Confirmation for Kevin from McDonald's"
+    html = "<html><body>" + "".join(f"<p>{line}</p>\n" for line in receipt.splitlines()) + "</body></html>"
+    padding = "<div style='color:#333;font-family:Arial'>&nbsp;</div>\n" * 5000
+    
+    corpus = [
+        ("plain", subject, receipt, "xuk654@gmail.com"),
+        ("html", subject, html, "xuk654@gmail.com"),
+        ("large_html", subject, padding + html + padding, "xuk654@gmail.com"),
+        ("direct", "Order Confirmation for Kevin from McDonald's", receipt, "no-reply@doordash.com"),
+        ("not_doordash", "Your Uber Eats order", receipt.replace("DoorDash", "Uber").replace("doordash", "uber"), "uber@uber.com"),
+        ("promo", "We miss you! Special offer inside", receipt, "no-reply@doordash.com"),
+        ("subject_exclusion", "Reset your password", receipt, "no-reply@doordash.com"),
+    ]
+    
+    # Random mutations: drop lines, swap case, splice in trigger phrases
+    rng = random.Random(seed)
+    phrases = ["Order Confirmation for X from Y", "order confirmation FOR a from b", "Total Charged $5.00",
+               "DoorDash Order", "---------- Forwarded message ---------", "Track Your Order", "Your receipt",
+               "Delivery Fee", "rate your", "ACCOUNT", "Subtotal", "Service Fee", "doordash"]
+    lines = receipt.splitlines()
+    for i in range(300):
+        sample = [line for line in lines if rng.random() > 0.3]
+        for _ in range(rng.randint(0, 4)):
+            sample.insert(rng.randint(0, len(sample)), rng.choice(phrases))
+        text = "\n".join(sample)
+        if rng.random() < 0.2:
+            text = text.upper() if rng.random() < 0.5 else text.lower()
+        sender = rng.choice(["xuk654@gmail.com", "no-reply@doordash.com", ""])
+        corpus.append((f"mutation_{i}", rng.choice([subject, "Fwd: hello", "Your account"]), text, sender))
+    return corpus
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200, help='calls per email per implementation')
+    args = parser.parse_args()
+    
+    corpus = build_corpus()
+    mismatches = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, subject, body, sender in corpus:
+            if should_process_email(subject, body, sender) != legacy_should_process_email(subject, body, sender):
+                mismatches.append(name)
+    
+    print(f"Decisions compared on {len(corpus)} emails: {len(mismatches)} mismatches")
+    if mismatches:
+        print(f"  Mismatched: {mismatches}")
+    
+    print(f"\n{'email':<20}{'size':>10}{'legacy (us)':>14}{'current (us)':>15}{'speedup':>10}")
+    for name, subject, body, sender in corpus[:7]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            legacy = timeit.timeit(lambda: legacy_should_process_email(subject, body, sender), number=args.repeat)
+            current = timeit.timeit(lambda: should_process_email(subject, body, sender), number=args.repeat)
+        print(f"{name:<20}{len(body):>10}{legacy / args.repeat * 1e6:>14.1f}"
+              f"{current / args.repeat * 1e6:>15.1f}{legacy / current:>9.1f}x")
+    
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
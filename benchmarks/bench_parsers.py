@@ -0,0 +1,77 @@
+"""Microbenchmarks for the email filter, the parsers and item-name cleaning.
+
+Times should_process_email, parse_doordash_email, parse_ubereats_email and
+clean_item_name on every email variant from the synthetic corpus (plain, HTML,
+forwarded, large). Each call starts from the raw strings, so HTML-to-text
+conversion is included. Run from the repository root:
+
+    python benchmarks/bench_parsers.py [--number N] [--repeat R] [--large-bytes B]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from event_log import configure_logging
+
+# Per-call log lines would dominate the timings
+configure_logging(level='WARNING')
+
+from corpus import VARIANTS, generate_email
+from email_parser import parse_doordash_email, parse_ubereats_email, should_process_email
+from nutrition_tracker import NutritionixTracker
+
+def time_call(fn, number, repeat):
+    """Median and best seconds per call over `repeat` runs of `number` calls"""
+    runs = [t / number for t in timeit.repeat(fn, number=number, repeat=repeat)]
+    return statistics.median(runs), min(runs)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=50, help='calls per timing run')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs per case (median is reported)')
+    parser.add_argument('--large-bytes', type=int, default=500_000, help='approximate size of "large" emails')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    emails = {
+        (service, variant): generate_email(rng, service, variant, large_bytes=args.large_bytes)
+        for service in ('doordash', 'ubereats') for variant in VARIANTS
+    }
+
+    cases = []
+    for variant in VARIANTS:
+        email = emails[('doordash', variant)]
+        cases.append(('should_process_email', variant, email,
+                      lambda e=email: should_process_email(e['subject'], e['body'], e['sender'])))
+    for variant in VARIANTS:
+        email = emails[('doordash', variant)]
+        cases.append(('parse_doordash_email', variant, email,
+                      lambda e=email: parse_doordash_email(e['subject'], e['body'])))
+    for variant in VARIANTS:
+        email = emails[('ubereats', variant)]
+        cases.append(('parse_ubereats_email', variant, email,
+                      lambda e=email: parse_ubereats_email(e['subject'], e['body'])))
+
+    # Item names as they appear in receipts, with category suffixes and option lines
+    names = ["Diet Coke® (Beverages)", "French Fries • Large (500 Cal.)", "McDouble (Individual Items)",
+             "Spicy Crispy Chicken Sandwich", "Chips & Guacamole (Fries, Sides & More) • Extra Cheese (50 Cal.)"]
+    clean = NutritionixTracker.clean_item_name
+    cases.append(('clean_item_name', f'{len(names)} names', {'body': "".join(names)},
+                  lambda: [clean(None, name) for name in names]))
+
+    print(f"{'function':<24}{'variant':<12}{'size':>10}{'median (us)':>14}{'best (us)':>12}{'calls/s':>12}")
+    for function, variant, email, fn in cases:
+        median, best = time_call(fn, args.number, args.repeat)
+        print(f"{function:<24}{variant:<12}{len(email['body']):>10}{median * 1e6:>14.1f}"
+              f"{best * 1e6:>12.1f}{1 / median:>12.0f}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
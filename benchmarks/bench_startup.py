@@ -0,0 +1,123 @@
+"""Startup and first-request latency, with and without preloading.
+
+Each run starts a fresh interpreter in a copy of a working directory seeded with
+--cache-entries nutrition cache entries and --branded-items branded items. The
+run builds the app with create_app(preload=False) or create_app(preload=True)
+and then times its first and second webhooks. Nutritionix calls go to a local
+mock server. Run from the repository root:
+
+    python benchmarks/bench_startup.py [--runs N] [--cache-entries N] [--branded-items N]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ('lazy', 'preload')
+PAYLOADS_FILE = 'bench_payloads.json'
+
+def seed_workdir(workdir, cache_entries, branded_items):
+    """Fills the nutrition cache and branded-item index the app will load at startup"""
+    from branded_index import BrandedItemIndex
+    from nutrition_cache import SqliteCache
+    from nutrition_tracker import BRANDED_INDEX_DB_FILE, CACHE_DB_FILE
+
+    nutrition = {'calories': 420, 'protein': 21.0, 'carbs': 40.0, 'fat': 18.0, 'source': 'bench'}
+    cache = SqliteCache(os.path.join(workdir, CACHE_DB_FILE))
+    cache.set_many({f"restaurant {i % 500}|menu item {i}": nutrition for i in range(cache_entries)})
+    cache.close()
+
+    index = BrandedItemIndex(os.path.join(workdir, BRANDED_INDEX_DB_FILE))
+    index.add_items({'food_name': f"Menu Item {i} Combo", 'brand_name': f"Restaurant {i % 500}",
+                     'nix_item_id': f"bench{i:08d}", 'nf_calories': 420} for i in range(branded_items))
+    index.close()
+
+def child(mode):
+    """Runs in the fresh interpreter: prints one JSON line of timings"""
+    import resource
+
+    start = time.perf_counter()
+    import app as nutrisync_app
+    imported = time.perf_counter()
+    flask_app = nutrisync_app.create_app(preload=mode == 'preload')
+    created = time.perf_counter()
+
+    with open(PAYLOADS_FILE, encoding='utf-8') as f:
+        payloads = json.load(f)
+    client = flask_app.test_client()
+    timings = []
+    for payload in payloads:
+        request_start = time.perf_counter()
+        response = client.post('/webhook/email', data=payload)
+        timings.append(time.perf_counter() - request_start)
+        if response.get_json().get('status') != 'success':
+            raise RuntimeError(f"webhook failed: {response.get_json()}")
+
+    print(json.dumps({
+        'import': imported - start,
+        'create': created - imported,
+        'first': timings[0],
+        'second': timings[1],
+        'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per mode (median is reported)')
+    parser.add_argument('--cache-entries', type=int, default=20_000, help='nutrition cache entries to seed')
+    parser.add_argument('--branded-items', type=int, default=5_000, help='branded index items to seed')
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child)
+
+    from corpus import generate_corpus, mailgun_payload
+    from load_test import sign
+    from mock_nutritionix import MockNutritionixServer
+
+    import app as nutrisync_app
+
+    mock = MockNutritionixServer(latency_ms=0, jitter_ms=0).start()
+    env = dict(os.environ, NUTRISYNC_NUTRITIONIX_URL=mock.url, NUTRISYNC_LOG_LEVEL='WARNING')
+    seed_dir = tempfile.mkdtemp(prefix='nutrisync-startup-')
+    seed_workdir(seed_dir, args.cache_entries, args.branded_items)
+    emails = generate_corpus(2, seed=0, services=('doordash',), variants=('html',))
+    payloads = [sign(mailgun_payload(email), nutrisync_app.WEBHOOK_SIGNING_KEY) for email in emails]
+
+    print(f"🚀 {args.runs} fresh processes per mode, {args.cache_entries} cached items, "
+          f"{args.branded_items} branded items")
+    results = {mode: [] for mode in MODES}
+    for run in range(args.runs):
+        for mode in MODES:
+            workdir = os.path.join(seed_dir, f"run_{run}_{mode}")
+            shutil.copytree(seed_dir, workdir, ignore=shutil.ignore_patterns('run_*'))
+            with open(os.path.join(workdir, PAYLOADS_FILE), 'w', encoding='utf-8') as f:
+                json.dump(payloads, f)
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode], cwd=workdir,
+                                    env=env, capture_output=True, text=True, check=True).stdout
+            results[mode].append(json.loads(output.strip().splitlines()[-1]))
+    mock.stop()
+    shutil.rmtree(seed_dir, ignore_errors=True)
+
+    print(f"\n{'mode':<10}{'import (ms)':>13}{'create (ms)':>13}{'1st req (ms)':>14}{'2nd req (ms)':>14}"
+          f"{'ready+1st (ms)':>16}{'max RSS (MB)':>14}")
+    for mode, runs in results.items():
+        median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        total = statistics.median(run['import'] + run['create'] + run['first'] for run in runs)
+        print(f"{mode:<10}{median['import'] * 1000:>13.1f}{median['create'] * 1000:>13.1f}"
+              f"{median['first'] * 1000:>14.1f}{median['second'] * 1000:>14.1f}{total * 1000:>16.1f}"
+              f"{median['rss_mb']:>14.1f}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""Synthetic DoorDash and Uber Eats order emails for benchmarks.
+
+Every email is built from templates shaped like real receipts (see paste.txt), in
+four variants: plain text, HTML, forwarded through Gmail, and very large (an HTML
+receipt buried in tracking markup). Generation is deterministic for a given seed.
+Write a corpus to disk to inspect it:
+
+    python benchmarks/corpus.py --count 20 --out /tmp/corpus
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+VARIANTS = ('plain', 'html', 'forwarded', 'large')
+SERVICES = ('doordash', 'ubereats')
+
+RESTAURANTS = {
+    "McDonald's": ["McDouble", "Big Mac", "French Fries", "Spicy Crispy Chicken Sandwich", "Diet Coke®",
+                   "10 Piece Chicken McNuggets", "McFlurry with OREO Cookies", "Egg McMuffin"],
+    "Chipotle": ["Burrito Bowl", "Chicken Burrito", "Chips & Guacamole", "Steak Quesadilla", "Sofritas Salad"],
+    "Taco Bell": ["Crunchwrap Supreme", "Chalupa Supreme", "Nachos BellGrande", "Baja Blast Freeze",
+                  "Cheesy Gordita Crunch"],
+    "Wendy's": ["Dave's Single", "Baconator", "Spicy Chicken Sandwich", "Frosty", "4 Piece Nuggets"],
+    "Panda Express": ["Orange Chicken", "Chow Mein", "Fried Rice", "Beijing Beef", "Honey Walnut Shrimp"],
+    "Subway": ["Italian B.M.T.", "Turkey Breast Footlong", "Meatball Marinara", "Cookies"],
+}
+CATEGORIES = ["Individual Items", "Beverages", "Fries, Sides & More", "Entrees", "Combos"]
+OPTIONS = ["• Large (500 Cal.)", "• Medium (320 Cal.)", "• No Ice (0 Cal.)", "• Extra Cheese (50 Cal.)"]
+NAMES = ["Kevin", "Alex", "Sam", "Jordan", "Priya", "Wei", "Maria"]
+
+def _order(rng, restaurant=None, max_items=6):
+    restaurant = restaurant or rng.choice(sorted(RESTAURANTS))
+    menu = RESTAURANTS[restaurant]
+    items = []
+    for name in rng.sample(menu, rng.randint(1, min(max_items, len(menu)))):
+        items.append({'quantity': rng.randint(1, 3), 'name': name, 'price': round(rng.uniform(1.0, 12.0), 2)})
+    subtotal = sum(item['quantity'] * item['price'] for item in items)
+    fees = {'Taxes': round(subtotal * 0.09, 2), 'Delivery Fee': round(rng.uniform(0, 4), 2),
+            'Service Fee': round(subtotal * 0.15, 2), 'Tip': float(rng.randint(1, 6))}
+    return {
+        'restaurant': restaurant,
+        'customer': rng.choice(NAMES),
+        'order_number': rng.randint(10 ** 7, 10 ** 8),
+        'items': items,
+        'subtotal': round(subtotal, 2),
+        'fees': fees,
+        'total': round(subtotal + sum(fees.values()), 2),
+    }
+
+def _doordash_text(order, rng):
+    lines = [
+        "DOORDASH",
+        "Thanks for your",
+        f"order, {order['customer']}",
+        "The estimated delivery time for your order",
+        "is 8:23 PM - 8:33 PM. Track your order in",
+        "the DoorDash app or website.",
+        "Track Your Order",
+        "",
+        "Paid with Apple Pay",
+        order['restaurant'],
+        f"Total: ${order['total']:.2f}",
+        "Your receipt",
+        f"Order #{order['order_number']}",
+        f"- For: {order['customer']} -",
+        "",
+    ]
+    for item in order['items']:
+        lines.append(f"{item['quantity']}x\t{item['name']} ({rng.choice(CATEGORIES)})")
+        if rng.random() < 0.4:
+            lines.append(rng.choice(OPTIONS))
+        lines += ["", f"${item['price']:.2f}"]
+    lines += ["", f"Subtotal\t${order['subtotal']:.2f}"]
+    lines += [f"{name}\t${amount:.2f}" for name, amount in order['fees'].items()]
+    lines += ["", f"Total Charged\t${order['total']:.2f}", "Get Order Help", "", "©2021 DoorDash, Inc.",
+              "303 2nd St.", "San Francisco CA 94107", "Help Center  |  View email in browser"]
+    subject = f"Order Confirmation for {order['customer']} from {order['restaurant']}"
+    return subject, "no-reply@doordash.com", "\n".join(lines)
+
+def _ubereats_text(order, rng):
+    lines = [
+        "Uber Eats",
+        f"Thanks for ordering, {order['customer']}",
+        f"Your order from {order['restaurant']}",
+        f"Order #{order['order_number']}",
+        "",
+    ]
+    for item in order['items']:
+        lines.append(f"{item['quantity']} x {item['name']} ${item['price']:.2f}")
+    lines += ["", f"Subtotal ${order['subtotal']:.2f}"]
+    lines += [f"{name} ${amount:.2f}" for name, amount in order['fees'].items()]
+    lines += [f"Total ${order['total']:.2f}", "", "Rate your order", "Uber Technologies Inc."]
+    subject = f"Your Uber Eats order from {order['restaurant']}"
+    return subject, "noreply@uber.com", "\n".join(lines)
+
+def _to_html(text):
+    rows = "".join(f"<tr><td style=\"padding:4px;font-family:Arial\">{line}</td></tr>\n"
+                   for line in text.replace("&", "&amp;").splitlines())
+    return f"<html><head><title>Receipt</title></head><body><table>\n{rows}</table></body></html>"
+
+def _forward(subject, sender, body, customer):
+    header = (
+        "---------- Forwarded message ---------\n"
+        f"From: {sender}\n"
+        "Date: Thu, Sep 16, 2021 at 8:13 PM\n"
+        f"Subject: {subject}\n"
+        f"To: <{customer.lower()}@gmail.com>\n\n"
+    )
+    return f"Fwd: {subject}", f"{customer.lower()}@gmail.com", header + body
+
+def _pad(html, rng, target_bytes):
+    """Wraps an HTML receipt in tracking pixels and layout markup up to ~target_bytes"""
+    block = ("<div style='color:#333;font-family:Arial;line-height:1.4'>&nbsp;"
+             "<img src='https://t.example.com/o/{n}.gif' width='1' height='1'></div>\n")
+    blocks = []
+    size = len(html)
+    while size < target_bytes:
+        chunk = block.format(n=rng.randint(0, 10 ** 9))
+        blocks.append(chunk)
+        size += len(chunk)
+    half = len(blocks) // 2
+    head, tail = html.split("<body>", 1)
+    return head + "<body>" + "".join(blocks[:half]) + tail.replace("</body>", "".join(blocks[half:]) + "</body>")
+
+def generate_email(rng, service='doordash', variant='plain', restaurant=None, large_bytes=500_000):
+    """One email as {'service', 'variant', 'subject', 'sender', 'body', 'order'}"""
+    order = _order(rng, restaurant)
+    subject, sender, body = (_doordash_text if service == 'doordash' else _ubereats_text)(order, rng)
+    if variant in ('html', 'large'):
+        body = _to_html(body)
+    if variant == 'large':
+        body = _pad(body, rng, large_bytes)
+    if variant == 'forwarded':
+        subject, sender, body = _forward(subject, sender, body, order['customer'])
+    return {'service': service, 'variant': variant, 'subject': subject, 'sender': sender, 'body': body,
+            'order': order}
+
+def generate_corpus(count, seed=0, services=SERVICES, variants=VARIANTS, large_bytes=500_000):
+    """`count` emails cycling through every service/variant combination"""
+    rng = random.Random(seed)
+    combos = [(service, variant) for service in services for variant in variants]
+    return [generate_email(rng, *combos[i % len(combos)], large_bytes=large_bytes) for i in range(count)]
+
+def mailgun_payload(email):
+    """The form fields Mailgun posts to /webhook/email for an email"""
+    body_field = 'body-html' if email['body'].lstrip().startswith('<html') else 'body-plain'
+    return {'subject': email['subject'], 'sender': email['sender'], body_field: email['body']}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=len(SERVICES) * len(VARIANTS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--large-bytes', type=int, default=500_000, help='approximate size of "large" emails')
+    parser.add_argument('--out', required=True, help='directory to write one JSON file per email into')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for i, email in enumerate(generate_corpus(args.count, args.seed, large_bytes=args.large_bytes)):
+        path = os.path.join(args.out, f"{i:04d}_{email['service']}_{email['variant']}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(email, f, indent=2)
+    print(f"📬 Wrote {args.count} emails to {args.out}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
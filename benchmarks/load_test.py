@@ -0,0 +1,163 @@
+"""End-to-end webhook load test against a local mock Nutritionix server.
+
+Starts the mock API and the Flask app (threaded WSGI server) in this process,
+with every database in a temporary directory. It then posts signed
+Mailgun-style webhooks built from the synthetic corpus, from --concurrency
+client threads, and reports p50/p95/p99 latency and requests per second. The
+API client's rate limit and daily budget are lifted unless --keep-api-limits is
+given. Run from the repository root:
+
+    python benchmarks/load_test.py --requests 500 --concurrency 16 --latency-ms 80
+"""
+import argparse
+import hashlib
+import hmac
+import logging
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+from werkzeug.serving import make_server
+
+from corpus import VARIANTS, generate_corpus, mailgun_payload
+from event_log import configure_logging
+from mock_nutritionix import MockNutritionixServer
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def sign(payload, signing_key):
+    """Adds Mailgun's token/timestamp/signature fields to a webhook payload"""
+    token = uuid.uuid4().hex
+    timestamp = str(int(time.time()))
+    signature = hmac.new(signing_key.encode('utf-8'), f"{timestamp}{token}".encode('utf-8'),
+                         hashlib.sha256).hexdigest()
+    return dict(payload, token=token, timestamp=timestamp, signature=signature)
+
+def build_payloads(args, signing_key):
+    rng = random.Random(args.seed)
+    emails = generate_corpus(args.requests + args.warmup, seed=args.seed, services=args.services.split(','),
+                             variants=args.variants.split(','), large_bytes=args.large_bytes)
+    payloads = [sign(mailgun_payload(email), signing_key) for email in emails]
+    # Mailgun retries and re-forwards: resend some earlier emails verbatim
+    for i in range(args.warmup + 1, len(payloads)):
+        if rng.random() < args.duplicate_rate:
+            payloads[i] = payloads[rng.randrange(args.warmup, i)]
+    return payloads[:args.warmup], payloads[args.warmup:]
+
+def lift_api_limits(tracker):
+    from nutritionix_client import TokenBucket
+    tracker.client.limiter = TokenBucket(rate=1e9, capacity=1e9)
+    tracker.client.budget.limit = 10 ** 12
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help='webhooks to time')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed webhooks sent first')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--services', default='doordash', help='comma-separated: doordash,ubereats')
+    parser.add_argument('--variants', default=','.join(VARIANTS), help=f"comma-separated: {','.join(VARIANTS)}")
+    parser.add_argument('--large-bytes', type=int, default=500_000, help='approximate size of "large" emails')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0, help='fraction of webhooks that are resends')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='mock Nutritionix latency')
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of mock API calls that fail')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--miss-rate', type=float, default=0.0, help='fraction of foods the mock API can\'t match')
+    parser.add_argument('--keep-api-limits', action='store_true', help='keep the client rate limit and budget')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep-dir', action='store_true', help='keep the temporary working directory')
+    args = parser.parse_args()
+
+    configure_logging(level=args.log_level)
+    # Werkzeug's per-request access log would dominate the output
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    # The app and tracker open their databases relative to the working directory
+    workdir = tempfile.mkdtemp(prefix='nutrisync-load-')
+    os.chdir(workdir)
+
+    import app as nutrisync_app
+    from metrics import CACHE_LOOKUPS
+
+    mock = MockNutritionixServer(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                                 error_status=args.error_status, miss_rate=args.miss_rate).start()
+    tracker = nutrisync_app.get_nutrition_tracker()
+    mock.point_tracker_at(tracker)
+    if not args.keep_api_limits:
+        lift_api_limits(tracker)
+
+    server = make_server('127.0.0.1', 0, nutrisync_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='webhook-server', daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/webhook/email"
+
+    warmup, payloads = build_payloads(args, nutrisync_app.WEBHOOK_SIGNING_KEY)
+    local = threading.local()
+
+    def post(payload):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.post(url, data=payload, timeout=120)
+            body = response.json()
+            status = body.get('status', str(response.status_code))
+            if body.get('duplicate'):
+                status = f"{status} (duplicate)"
+        except (requests.exceptions.RequestException, ValueError) as e:
+            status = type(e).__name__
+        return time.perf_counter() - start, status
+
+    for payload in warmup:
+        post(payload)
+
+    print(f"🚚 {len(payloads)} webhooks, {args.concurrency} clients, mock API latency "
+          f"{args.latency_ms:.0f}±{args.jitter_ms:.0f} ms, error rate {args.error_rate:.0%}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(post, payloads))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    statuses = Counter(status for _, status in results)
+    hits = sum(CACHE_LOOKUPS.value(cache, 'hit') for cache in ('item', 'local_index'))
+    misses = CACHE_LOOKUPS.value('item', 'miss')
+
+    print(f"\n{'requests':<14}{len(results)}")
+    print(f"{'elapsed':<14}{elapsed:.2f} s")
+    print(f"{'throughput':<14}{len(results) / elapsed:.1f} req/s")
+    for label, p in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100)):
+        print(f"{label:<14}{percentile(latencies, p) * 1000:.1f} ms")
+    print(f"{'statuses':<14}{dict(statuses)}")
+    print(f"{'api calls':<14}{mock.stats}")
+    print(f"{'item lookups':<14}{hits:.0f} resolved locally or from cache, {misses:.0f} cache misses")
+
+    server.shutdown()
+    mock.stop()
+    if args.keep_dir:
+        print(f"\n📁 Databases kept in {workdir}")
+    else:
+        os.chdir('/')
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
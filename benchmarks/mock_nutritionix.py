@@ -0,0 +1,190 @@
+"""A local stand-in for the Nutritionix API with configurable latency and errors.
+
+Serves the two endpoints the tracker uses: GET /v2/search/instant, which returns
+branded items for the restaurant named in the query, and POST
+/v2/natural/nutrients, which returns one food per comma-separated phrase.
+Nutrient values are derived from the food name, so repeated runs give the same
+answers. GET /stats returns request counts. Run standalone:
+
+    python benchmarks/mock_nutritionix.py --port 8765 --latency-ms 80 --error-rate 0.02
+
+or start it in-process with MockNutritionixServer(...).start().
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from corpus import RESTAURANTS
+
+QUANTITY_PATTERN = re.compile(r'^\s*(\d+)\s+')
+
+def _brand_key(name):
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+def _food(name, brand=None, quantity=1):
+    """A Nutritionix-shaped food with nutrients derived from its name"""
+    seed = zlib.crc32(name.lower().encode('utf-8'))
+    rng = random.Random(seed)
+    food = {
+        'food_name': name,
+        'serving_qty': quantity,
+        'serving_unit': 'serving',
+        'nf_calories': quantity * rng.randint(50, 900),
+        'nf_protein': quantity * round(rng.uniform(0, 45), 1),
+        'nf_total_carbohydrate': quantity * round(rng.uniform(0, 90), 1),
+        'nf_total_fat': quantity * round(rng.uniform(0, 50), 1),
+        'nf_dietary_fiber': quantity * round(rng.uniform(0, 8), 1),
+        'nf_sugars': quantity * round(rng.uniform(0, 40), 1),
+        'nf_sodium': quantity * rng.randint(0, 2000),
+        'nf_saturated_fat': quantity * round(rng.uniform(0, 15), 1),
+    }
+    if brand:
+        food['brand_name'] = brand
+        food['nix_item_id'] = f"mock{seed:08x}"
+    return food
+
+class _Handler(BaseHTTPRequestHandler):
+    server: 'MockNutritionixServer'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self):
+        """Sleeps for the configured latency; returns an error status to send instead, or None"""
+        config = self.server.config
+        delay = config['latency_ms'] + random.uniform(-config['jitter_ms'], config['jitter_ms'])
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if random.random() < config['error_rate']:
+            return config['error_status']
+        return None
+
+    def _count(self, key):
+        with self.server.stats_lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + 1
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            with self.server.stats_lock:
+                return self._reply(200, dict(self.server.stats))
+        if url.path != '/v2/search/instant':
+            return self._reply(404, {'message': 'not found'})
+
+        self._count('instant')
+        error = self._simulate()
+        if error:
+            self._count(f'error_{error}')
+            return self._reply(error, {'message': 'simulated error'})
+
+        query = parse_qs(url.query).get('query', [''])[0]
+        key = _brand_key(query)
+        branded = []
+        for restaurant, menu in RESTAURANTS.items():
+            if _brand_key(restaurant) in key or key == _brand_key(restaurant):
+                branded = [_food(name, restaurant) for name in menu]
+                break
+        if random.random() < self.server.config['miss_rate']:
+            branded = []
+        self._reply(200, {'branded': branded, 'common': []})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if url.path != '/v2/natural/nutrients':
+            return self._reply(404, {'message': 'not found'})
+
+        self._count('nutrients')
+        error = self._simulate()
+        if error:
+            self._count(f'error_{error}')
+            return self._reply(error, {'message': 'simulated error'})
+
+        query = payload.get('query', '')
+        # "1 Big Mac, 2 French Fries from McDonald's"
+        phrases = query.rsplit(' from ', 1)[0].split(', ')
+        foods = []
+        for phrase in phrases:
+            if random.random() < self.server.config['miss_rate']:
+                continue
+            match = QUANTITY_PATTERN.match(phrase)
+            quantity = int(match.group(1)) if match else 1
+            name = QUANTITY_PATTERN.sub('', phrase).strip()
+            if name:
+                foods.append(_food(name, quantity=quantity))
+        if not foods:
+            return self._reply(404, {'message': "We couldn't match any of your foods"})
+        self._reply(200, {'foods': foods})
+
+class MockNutritionixServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=50.0, jitter_ms=10.0, error_rate=0.0,
+                 error_status=503, miss_rate=0.0):
+        super().__init__((host, port), _Handler)
+        self.config = {'latency_ms': latency_ms, 'jitter_ms': jitter_ms, 'error_rate': error_rate,
+                       'error_status': error_status, 'miss_rate': miss_rate}
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def point_tracker_at(self, tracker):
+        """Sends a NutritionixTracker's API calls to this server"""
+        tracker.instant_endpoint = f"{self.url}/v2/search/instant"
+        tracker.nutrients_endpoint = f"{self.url}/v2/natural/nutrients"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-nutritionix', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='mean response latency')
+    parser.add_argument('--jitter-ms', type=float, default=10.0, help='latency varies uniformly by +/- this')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=503, help='HTTP status of failed requests')
+    parser.add_argument('--miss-rate', type=float, default=0.0, help='fraction of foods/queries with no match')
+    args = parser.parse_args()
+
+    server = MockNutritionixServer(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate,
+                                   args.error_status, args.miss_rate)
+    print(f"🧪 Mock Nutritionix listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
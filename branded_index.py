@@ -0,0 +1,251 @@
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
+
+# BM25 parameters (the usual defaults): term-frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Score multiplier for items whose brand is the restaurant being ordered from
+BRAND_BOOST = 2.0
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens with apostrophes dropped ("McDonald's" -> "mcdonalds") and
+    simple plural stripping, so "French Fries" and "french fry" share tokens.
+    """
+    tokens = []
+    for word in TOKEN_RE.findall((text or '').lower().replace("'", "").replace("’", "")):
+        if len(word) > 3 and word.endswith('ies'):
+            word = word[:-3] + 'y'
+        elif len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def brand_key(name: str) -> str:
+    """Brand/restaurant name reduced to letters and digits, for comparing spellings."""
+    return re.sub(r'[^a-z0-9]', '', (name or '').lower())
+
+
+def brand_matches(brand: str, restaurant: str) -> bool:
+    """True if a Nutritionix brand name refers to the restaurant ("McDonald's" ~ "Mcdonalds USA")."""
+    brand, restaurant = brand_key(brand), brand_key(restaurant)
+    if not brand or not restaurant:
+        return False
+    if brand == restaurant:
+        return True
+    shorter, longer = sorted((brand, restaurant), key=len)
+    return len(shorter) >= 4 and shorter in longer
+
+
+def item_id_for(item: dict) -> str:
+    return item.get('nix_item_id') or f"{item.get('brand_name', '')}|{item.get('food_name', '')}".lower()
+
+
+class BrandedItemIndex:
+    """
+    A local inverted index over every branded item received from Nutritionix. Items
+    are persisted in SQLite and indexed in memory by food-name token; queries are
+    ranked with BM25, multiplied by BRAND_BOOST for items of the ordering
+    restaurant's brand. Each result also carries a 0-1 confidence (IDF-weighted
+    overlap between the query and the item name), which callers use to decide
+    whether a local match is good enough to skip the API.
+    """
+
+    def __init__(self, path: str = "nutritionix_branded.db"):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS branded_items ("
+            " item_id TEXT PRIMARY KEY,"
+            " brand TEXT,"
+            " food_name TEXT,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " from_search INTEGER NOT NULL DEFAULT 1)"
+        )
+        # Databases from before menu snapshots: keep all their items as search results
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(branded_items)")}
+        if 'from_search' not in columns:
+            conn.execute("ALTER TABLE branded_items ADD COLUMN from_search INTEGER NOT NULL DEFAULT 1")
+        conn.commit()
+        self.reload()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def reload(self):
+        """Rebuilds the in-memory index from the database (picks up other processes' items)."""
+        with self._lock:
+            # Removed items leave a None slot so doc ids stay stable
+            self._docs: List[Optional[Dict]] = []
+            self._doc_ids: Dict[str, int] = {}
+            self._postings: Dict[str, Dict[int, int]] = {}
+            self._total_length = 0
+            for (data,) in self._conn().execute("SELECT data FROM branded_items"):
+                self._index(json.loads(data))
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    def _index(self, item: dict) -> int:
+        item_id = item_id_for(item)
+        tokens = Counter(tokenize(item.get('food_name', '')))
+        doc = {
+            'item': item,
+            'brand': item.get('brand_name', ''),
+            'tokens': tokens,
+            'token_set': set(tokens),
+            'length': sum(tokens.values()),
+        }
+
+        doc_id = self._doc_ids.get(item_id)
+        if doc_id is None:
+            doc_id = self._doc_ids[item_id] = len(self._docs)
+            self._docs.append(doc)
+        else:
+            # Re-received item: drop its old postings before indexing the new version
+            self._unindex(doc_id)
+            self._docs[doc_id] = doc
+
+        for token, count in tokens.items():
+            self._postings.setdefault(token, {})[doc_id] = count
+        self._total_length += doc['length']
+        return doc_id
+
+    def _unindex(self, doc_id: int):
+        old = self._docs[doc_id]
+        for token in old['tokens']:
+            self._postings[token].pop(doc_id, None)
+        self._total_length -= old['length']
+
+    def remove_items(self, item_ids: Iterable[str], keep_searched: bool = False):
+        """
+        Deletes items (by item_id_for) from the database and the index. With
+        keep_searched, items that an ordinary search also returned are kept.
+        """
+        item_ids = list(item_ids)
+        conn = self._conn()
+        if keep_searched:
+            searched = set()
+            for i in range(0, len(item_ids), 500):
+                chunk = item_ids[i:i + 500]
+                searched.update(row[0] for row in conn.execute(
+                    "SELECT item_id FROM branded_items WHERE from_search = 1"
+                    f" AND item_id IN ({','.join('?' * len(chunk))})", chunk))
+            item_ids = [item_id for item_id in item_ids if item_id not in searched]
+        if not item_ids:
+            return
+        with conn:
+            conn.executemany("DELETE FROM branded_items WHERE item_id = ?", [(item_id,) for item_id in item_ids])
+        with self._lock:
+            for item_id in item_ids:
+                doc_id = self._doc_ids.pop(item_id, None)
+                if doc_id is not None:
+                    self._unindex(doc_id)
+                    self._docs[doc_id] = None
+
+    def add_items(self, items: Iterable[dict], from_search: bool = True) -> Set[int]:
+        """
+        Stores and indexes branded items (Nutritionix 'branded' results). Returns
+        their doc ids. Menu snapshots pass from_search=False, so removing a snapshot
+        doesn't remove items that searches found too (see remove_items).
+        """
+        items = [item for item in items if item.get('food_name')]
+        if not items:
+            return set()
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO branded_items (item_id, brand, food_name, data, updated_at, from_search)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(item_id) DO UPDATE SET brand = excluded.brand, food_name = excluded.food_name,"
+                " data = excluded.data, updated_at = excluded.updated_at,"
+                " from_search = max(from_search, excluded.from_search)",
+                [(item_id_for(item), item.get('brand_name'), item.get('food_name'), json.dumps(item), now,
+                  int(from_search)) for item in items],
+            )
+        with self._lock:
+            return {self._index(item) for item in items}
+
+    def _idf(self, token: str) -> float:
+        df = len(self._postings.get(token, ()))
+        n = len(self._doc_ids)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, restaurant: Optional[str] = None, limit: int = 5,
+               doc_ids: Optional[Set[int]] = None) -> List[Dict]:
+        """
+        Ranks indexed items for `query`, optionally only among `doc_ids`. Returns up to
+        `limit` results, best first, as {'doc_id', 'item', 'score', 'confidence', 'brand_match'}.
+        """
+        query_tokens = set(tokenize(query))
+        if not query_tokens:
+            return []
+
+        with self._lock:
+            if not self._doc_ids:
+                return []
+            avg_length = self._total_length / len(self._doc_ids) or 1
+            idf = {token: self._idf(token) for token in query_tokens}
+
+            scores: Dict[int, float] = {}
+            for token in query_tokens:
+                for doc_id, tf in self._postings.get(token, {}).items():
+                    if doc_ids is not None and doc_id not in doc_ids:
+                        continue
+                    length = self._docs[doc_id]['length']
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf[token] * tf * (BM25_K1 + 1) / norm
+
+            results = []
+            for doc_id, score in scores.items():
+                doc = self._docs[doc_id]
+                is_brand = bool(restaurant) and brand_matches(doc['brand'], restaurant)
+                if is_brand:
+                    score *= BRAND_BOOST
+                # IDF-weighted Jaccard overlap between the query and the item name
+                union = query_tokens | doc['token_set']
+                shared = sum(idf[token] for token in query_tokens & doc['token_set'])
+                total = sum(idf.get(token) or self._idf(token) for token in union)
+                results.append({
+                    'doc_id': doc_id,
+                    'item': doc['item'],
+                    'score': score,
+                    'confidence': shared / total if total else 0.0,
+                    'brand_match': is_brand,
+                })
+
+        results.sort(key=lambda result: (result['score'], result['confidence']), reverse=True)
+        return results[:limit]
+
+    def best_match(self, query: str, restaurant: str, min_confidence: float) -> Optional[Dict]:
+        """The top-ranked item of the restaurant's brand, if its confidence is at least `min_confidence`."""
+        for result in self.search(query, restaurant, limit=3):
+            if result['brand_match']:
+                return result if result['confidence'] >= min_confidence else None
+        return None
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Forwarding/reply prefixes added to the subject by mail clients
+SUBJECT_PREFIX_RE = re.compile(r'^\s*((fwd?|fw|re)\s*:\s*)+', re.IGNORECASE)
+TAG_RE = re.compile(r'<[^>]+>')
+# Header lines that differ between forwarded copies of the same email
+FORWARD_HEADER_RE = re.compile(
+    r'^\s*(-+\s*forwarded message\s*-+|begin forwarded message:?|(from|to|cc|date|sent|subject)\s*:.*)$',
+    re.IGNORECASE | re.MULTILINE,
+)
+QUOTE_PREFIX_RE = re.compile(r'^[\s>]+', re.MULTILINE)
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_email_content(subject: str, body: str) -> str:
+    """
+    Reduces an email to the parts that identify the order, so the same receipt
+    hashes the same whether it arrived directly, via Gmail auto-forwarding or via a
+    manual forward: subject prefixes, HTML tags, forwarding headers, quote markers
+    and whitespace differences are removed.
+    """
+    subject = SUBJECT_PREFIX_RE.sub('', subject or '')
+    text = TAG_RE.sub(' ', body or '')
+    text = FORWARD_HEADER_RE.sub(' ', text)
+    text = QUOTE_PREFIX_RE.sub('', text)
+    return WHITESPACE_RE.sub(' ', f"{subject} {text}").strip().lower()
+
+
+def content_hash(subject: str, body: str) -> str:
+    return hashlib.sha256(normalize_email_content(subject, body).encode('utf-8')).hexdigest()
+
+
+class DedupIndex:
+    """
+    Remembers which emails have already been processed, keyed by a normalized
+    content hash plus aliases (Mailgun token, Message-Id). A repeat delivery is
+    answered from the stored result instead of being parsed and looked up again.
+    While one copy is being processed its hash is claimed, so concurrent copies
+    are recognised as duplicates too.
+    """
+
+    def __init__(self, path: str = "nutrisync_dedup.db", processing_timeout: float = 600):
+        self.path = path
+        # A claim older than this is assumed to belong to a crashed worker
+        self.processing_timeout = processing_timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_emails ("
+            " content_hash TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " result TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS email_aliases ("
+            " alias TEXT PRIMARY KEY,"
+            " content_hash TEXT NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def aliases_for(email_data: Dict) -> List[str]:
+        """Delivery identifiers from a Mailgun payload (token, Message-Id)."""
+        aliases = []
+        token = email_data.get('token')
+        if token:
+            aliases.append(f"token:{token}")
+        message_id = email_data.get('Message-Id') or email_data.get('message-id') or email_data.get('message_id')
+        if message_id:
+            aliases.append(f"message-id:{message_id.strip().strip('<>').lower()}")
+        return aliases
+
+    def find(self, aliases: List[str], digest: str) -> Optional[Dict]:
+        """
+        Looks up a previous copy by alias first (cheap, exact), then by content hash.
+        Returns {'content_hash', 'status', 'result'} or None.
+        """
+        conn = self._conn()
+        for alias in aliases:
+            row = conn.execute("SELECT content_hash FROM email_aliases WHERE alias = ?", (alias,)).fetchone()
+            if row:
+                digest = row[0]
+                break
+        row = conn.execute(
+            "SELECT status, result, updated_at FROM processed_emails WHERE content_hash = ?", (digest,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, result, updated_at = row
+        if status == 'processing' and time.time() - updated_at > self.processing_timeout:
+            return None
+        return {'content_hash': digest, 'status': status, 'result': json.loads(result) if result else None}
+
+    def claim(self, digest: str) -> bool:
+        """Marks a hash as being processed. Returns False if another copy got there first."""
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "DELETE FROM processed_emails WHERE content_hash = ? AND status = 'processing' AND updated_at < ?",
+                (digest, now - self.processing_timeout),
+            )
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO processed_emails (content_hash, status, created_at, updated_at)"
+                " VALUES (?, 'processing', ?, ?)",
+                (digest, now, now),
+            )
+        return cursor.rowcount == 1
+
+    def record(self, digest: str, aliases: List[str], result: Dict):
+        """Stores the final result for a hash and links the delivery aliases to it."""
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT INTO processed_emails (content_hash, status, result, created_at, updated_at)"
+                " VALUES (?, 'done', ?, ?, ?)"
+                " ON CONFLICT(content_hash) DO UPDATE SET status = 'done', result = excluded.result,"
+                " updated_at = excluded.updated_at",
+                (digest, json.dumps(result), now, now),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO email_aliases (alias, content_hash) VALUES (?, ?)",
+                [(alias, digest) for alias in aliases],
+            )
+
+    def release(self, digest: str):
+        """Drops an unfinished claim so a later copy can be processed normally."""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM processed_emails WHERE content_hash = ? AND status = 'processing'", (digest,))
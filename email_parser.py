@@ -1,57 +1,171 @@
 import re
+from functools import cached_property
 from bs4 import BeautifulSoup
 
+from event_log import get_logger
+from metrics import STAGE_SECONDS
+
+try:
+    import lxml.html
+    import lxml.etree
+except ImportError:  # fall back to BeautifulSoup's pure-Python parser
+    lxml = None
+
+log = get_logger('email_parser')
+
+# --- Email filter ---
+# Phrase tables are built once at import. Case-sensitive phrases are matched with
+# str's C substring search on the original body; case-insensitive ones against a
+# single ASCII-lowercased bytes view of it (see _ascii_lower).
+ORDER_INDICATORS = (
+    "Order Confirmation for", "Thanks for your order", "Total Charged",
+    "Your receipt", "Track Your Order"
+)
+FINANCIAL_INDICATORS = ("Total Charged", "Subtotal", "Delivery Fee", "Service Fee", "$")
+FILTER_EXCLUSIONS = (
+    "login", "password", "reset", "verification", "promotional", "marketing",
+    "survey", "rate your", "we miss you", "special offer", "account", "security"
+)
+# Longest exclusion phrase, used to catch one spanning the body/subject boundary
+_EXCLUSION_SPAN = max(len(exc) for exc in FILTER_EXCLUSIONS)
+
+# A match can only start at 'order confirmation for', so the search is anchored there
+RESTAURANT_CONFIRMATION_PATTERN = re.compile(rb"order confirmation for .+ from (.+)")
+
+def _ascii_lower(text):
+    """Lowercase `text` for case-insensitive matching of ASCII phrases.
+    Returns UTF-8 bytes with only A-Z lowered, which is several times cheaper than
+    str.lower() on large non-ASCII bodies and finds the same ASCII phrases."""
+    if '\u212a' in text:
+        # KELVIN SIGN is the only non-ASCII character str.lower() turns into an ASCII letter
+        text = text.replace('\u212a', 'k')
+    return text.encode('utf-8', 'surrogatepass').lower()
+
+class ParsedEmail:
+    """One incoming email, shared by the filter, service detection and the parsers.
+    The text, DOM and lowercased views are each built at most once, on first use."""
+    
+    def __init__(self, subject, body, sender=""):
+        self.subject = subject or ""
+        self.body = body or ""
+        self.sender = sender or ""
+    
+    @classmethod
+    def wrap(cls, subject, body, sender=""):
+        """Use `body` as-is if it's already a ParsedEmail, otherwise wrap the raw strings"""
+        if isinstance(body, ParsedEmail):
+            return body
+        return cls(subject, body, sender)
+    
+    @cached_property
+    def lowered_body(self):
+        return _ascii_lower(self.body)
+    
+    @cached_property
+    def lowered_subject(self):
+        return _ascii_lower(self.subject)
+    
+    @cached_property
+    def is_html_document(self):
+        return b"<html" in self.lowered_body
+    
+    @cached_property
+    def soup(self):
+        return BeautifulSoup(self.body, 'lxml' if lxml else 'html.parser')
+    
+    @cached_property
+    def text(self):
+        """Body with HTML markup removed"""
+        body = self.body
+        if '<' not in body and '&' not in body:
+            # Nothing an HTML parser would change
+            return body
+        with STAGE_SECONDS.time('html_to_text'):
+            if lxml is not None and '</' in body:
+                # lxml's C parser is much faster than BeautifulSoup for real HTML documents
+                try:
+                    return lxml.html.fromstring(body).text_content()
+                except (ValueError, lxml.etree.ParserError):
+                    pass
+            if 'soup' in self.__dict__:
+                return self.soup.get_text()
+            return BeautifulSoup(body, 'html.parser').get_text()
+    
+    def contains_ci(self, phrase, subject_first=False):
+        """Case-insensitive check for an ASCII phrase in (body + " " + subject), or
+        (subject + " " + body) with subject_first, without building the joined copy."""
+        phrase = phrase.encode('ascii')
+        if phrase in self.lowered_body or phrase in self.lowered_subject:
+            return True
+        span = len(phrase)
+        if subject_first:
+            joined = self.lowered_subject[-span:] + b" " + self.lowered_body[:span]
+        else:
+            joined = self.lowered_body[-span:] + b" " + self.lowered_subject[:span]
+        return phrase in joined
+
+def _filter_service(email, sender):
+    """The registered service an email comes from, or None. Direct mail is recognised
+    by its sender domain, forwarded copies by the service's keywords."""
+    service = detect_service_from_sender(sender)
+    if service:
+        return service
+    body = email.body
+    if "no-reply@doordash.com" in body or "DoorDash Order" in body:
+        return 'doordash'
+    if b"forwarded message" in email.lowered_body:
+        for service, registration in PARSERS.items():
+            if any(keyword in email.lowered_body for keyword in registration['keyword_bytes']):
+                return service
+    return None
+
 def should_process_email(subject, body, sender):
-    """Enhanced filtering for DoorDash order confirmations"""
-    
-    print(f"\n🔍 FILTERING EMAIL...")
-    print(f"   Subject: {subject}")
-    
-    # Must be from DoorDash (direct or forwarded)
-    is_doordash = (
-        "no-reply@doordash.com" in (sender or "") or
-        "doordash.com" in (sender or "") or
-        "no-reply@doordash.com" in body or
-        "DoorDash Order" in body or
-        ("doordash" in body.lower() and "forwarded message" in body.lower())
-    )
+    """Enhanced filtering for order confirmations from any registered service.
+    `body` may be a ParsedEmail to reuse its lowercased view."""
+    
+    email = ParsedEmail.wrap(subject, body, sender)
+    body = email.body
     
-    if not is_doordash:
-        print("   ❌ Not from DoorDash")
+    if log.sample():
+        log.debug('filter.start', f"\n🔍 FILTERING EMAIL...\n   Subject: {subject}", subject=subject)
+    
+    # Must be from a registered delivery service (direct or forwarded)
+    service = _filter_service(email, sender)
+    if service is None:
+        log.info('filter.rejected', "   ❌ Not from a supported delivery service", reason='sender')
         return False
     
     # Must have order confirmation indicators
-    order_indicators = [
-        "Order Confirmation for", "Thanks for your order", "Total Charged",
-        "Your receipt", "Track Your Order"
-    ]
-    
-    found_indicators = [ind for ind in order_indicators if ind in body]
-    if not found_indicators:
-        print("   ❌ No order confirmation indicators")
+    if not any(ind in body for ind in PARSERS[service]['order_indicators']):
+        log.info('filter.rejected', "   ❌ No order confirmation indicators", reason='no_order_indicators')
         return False
     
     # Must have financial indicators
-    financial_indicators = ["Total Charged", "Subtotal", "Delivery Fee", "Service Fee", "$"]
-    found_financial = [ind for ind in financial_indicators if ind in body]
-    if not found_financial:
-        print("   ❌ No financial indicators")
+    if not any(ind in body for ind in FINANCIAL_INDICATORS):
+        log.info('filter.rejected', "   ❌ No financial indicators", reason='no_financial_indicators')
         return False
     
-    # Exclude non-order emails
-    exclusions = [
-        "login", "password", "reset", "verification", "promotional", "marketing",
-        "survey", "rate your", "we miss you", "special offer", "account", "security"
-    ]
-    
-    combined_text = (body + " " + subject).lower()
-    exclusions_found = [exc for exc in exclusions if exc in combined_text]
+    # Exclude non-order emails (body and subject, including a phrase spanning the two)
+    lowered_body = email.lowered_body
+    subject_text = lowered_body[-_EXCLUSION_SPAN:] + b" " + email.lowered_subject
+    exclusions_found = [exc for exc, exc_bytes in PARSERS[service]['exclusion_bytes']
+                        if exc_bytes in lowered_body or exc_bytes in subject_text]
     if exclusions_found:
-        print(f"   ❌ Contains exclusions: {exclusions_found}")
+        log.info('filter.rejected', f"   ❌ Contains exclusions: {exclusions_found}",
+                 reason='exclusions', exclusions=exclusions_found)
         return False
     
+    # The strong indicators below are DoorDash's receipt layout
+    if service != 'doordash':
+        log.info('filter.passed', "   ✅ EMAIL PASSES FILTER", service=service)
+        return True
+    
     # Check for restaurant pattern
-    restaurant_found = bool(re.search(r"Order Confirmation for .+ from (.+)", body, re.IGNORECASE))
+    confirmation_pos = lowered_body.find(b"order confirmation for")
+    restaurant_found = (
+        confirmation_pos >= 0 and
+        bool(RESTAURANT_CONFIRMATION_PATTERN.search(lowered_body, confirmation_pos))
+    )
     
     # Final validation - need multiple strong indicators
     strong_indicators = [
@@ -64,65 +178,117 @@ def should_process_email(subject, body, sender):
     ]
     
     strong_count = sum(strong_indicators)
-    print(f"   ✓ Strong indicators: {strong_count}/6")
+    if log.sample():
+        log.debug('filter.indicators', f"   ✓ Strong indicators: {strong_count}/6", strong_indicators=strong_count)
     
     if strong_count >= 3:
-        print("   ✅ EMAIL PASSES FILTER")
+        log.info('filter.passed', "   ✅ EMAIL PASSES FILTER", strong_indicators=strong_count)
         return True
     else:
-        print(f"   ❌ Not enough indicators ({strong_count}/6)")
+        log.info('filter.rejected', f"   ❌ Not enough indicators ({strong_count}/6)",
+                 reason='weak_indicators', strong_indicators=strong_count)
         return False
 
-def parse_food_delivery_email(subject, body):
-    """Parse food delivery emails"""
-    service = detect_service(subject, body)
+# --- Parser registry ---
+# Each delivery service registers its parser with the sender domains it mails from
+# and the keywords that identify a forwarded copy. Dispatch looks the sender's domain
+# up in a dict first, so adding services doesn't slow detection for the others.
+PARSERS = {}
+SENDER_DOMAINS = {}
+SENDER_DOMAIN_PATTERN = re.compile(r'@([A-Za-z0-9.-]+)')
+
+def register_parser(service, sender_domains=(), keywords=(), order_indicators=(), exclusions=FILTER_EXCLUSIONS):
+    """Decorator that registers `parse(subject, body)` for a delivery service.
+    Keyword detection runs in registration order. The filter needs one of the
+    (case-sensitive) `order_indicators` in the body and none of the `exclusions`."""
+    def decorator(parse):
+        PARSERS[service] = {
+            'parse': parse,
+            'sender_domains': tuple(sender_domains),
+            'keywords': tuple(keywords),
+            'keyword_bytes': tuple(keyword.encode('ascii') for keyword in keywords),
+            'order_indicators': tuple(order_indicators),
+            'exclusion_bytes': tuple((exc, exc.encode('ascii')) for exc in exclusions),
+        }
+        for domain in sender_domains:
+            SENDER_DOMAINS[domain.lower()] = service
+        return parse
+    return decorator
+
+def detect_service_from_sender(sender):
+    """Service for a sender address like 'no-reply@messages.doordash.com', or None"""
+    for domain in SENDER_DOMAIN_PATTERN.findall(sender or ""):
+        labels = domain.lower().split('.')
+        # Try the full domain, then each parent domain
+        for i in range(len(labels) - 1):
+            service = SENDER_DOMAINS.get('.'.join(labels[i:]))
+            if service:
+                return service
+    return None
+
+def parse_food_delivery_email(subject, body, sender=None):
+    """Parse food delivery emails (`body` may be a ParsedEmail)"""
+    email = ParsedEmail.wrap(subject, body, sender)
+    service = detect_service(subject, email, sender)
     
-    if service == 'doordash':
-        return parse_doordash_email(subject, body)
-    elif service == 'ubereats':
-        return parse_ubereats_email(subject, body)
+    if service in PARSERS:
+        return PARSERS[service]['parse'](subject, email)
     else:
         return None
 
-def detect_service(subject, body):
-    """Detect delivery service"""
-    text = (subject + " " + body).lower()
+def detect_service(subject, body, sender=None):
+    """Detect delivery service: by sender domain first, then by keywords"""
+    email = ParsedEmail.wrap(subject, body, sender)
     
-    if 'doordash' in text:
-        return 'doordash'
-    elif 'uber eats' in text or 'ubereats' in text:
-        return 'ubereats'
-    elif 'grubhub' in text:
-        return 'grubhub'
+    service = detect_service_from_sender(sender or email.sender)
+    if service:
+        return service
+    
+    for service, registration in PARSERS.items():
+        if any(email.contains_ci(keyword, subject_first=True) for keyword in registration['keywords']):
+            return service
     
     return None
 
+# --- DoorDash ---
+DOORDASH_SUBJECT_PATTERN = re.compile(r'Order Confirmation for .+ from (.+)', re.IGNORECASE)
+DOORDASH_RESTAURANT_PATTERNS = [
+    re.compile(r'Paid with.*?\n([A-Za-z\s&\']+)\nTotal:', re.IGNORECASE | re.DOTALL),
+    re.compile(r'Paid with.*?([A-Za-z\s&\']+)\s*Total:', re.IGNORECASE | re.DOTALL),
+    re.compile(r'Thanks for your order[^A-Za-z]*([A-Za-z\s&\']+)\n', re.IGNORECASE | re.DOTALL),
+    re.compile(r'order from ([^,\n]+)', re.IGNORECASE | re.DOTALL),
+]
+PAYMENT_WORDS_PATTERN = re.compile(r'Apple Pay|Google Pay|with', re.IGNORECASE)
+DOORDASH_TOTAL_PATTERNS = [
+    re.compile(r'Total Charged\s*\$([0-9]+\.[0-9]{2})', re.IGNORECASE),
+    re.compile(r'Total:\s*\$([0-9]+\.[0-9]{2})', re.IGNORECASE),
+]
+DOORDASH_ITEM_PATTERNS = [
+    re.compile(r'(\d+)x\s*([^•$\n]+?)(?:•[^$]*?)?\s*\$([0-9]+\.[0-9]{2})', re.MULTILINE),
+    re.compile(r'(\d+)x\s+([^$\n]+?)\s+\$([0-9]+\.[0-9]{2})', re.MULTILINE),
+]
+CATEGORY_SUFFIX_PATTERN = re.compile(r'\s*\([^)]+\)\s*$')
+
+@register_parser('doordash', sender_domains=['doordash.com'], keywords=['doordash'],
+                 order_indicators=ORDER_INDICATORS)
 def parse_doordash_email(subject, body):
     """Parse DoorDash order confirmation"""
     try:
-        soup = BeautifulSoup(body, 'html.parser')
-        text_content = soup.get_text() if soup else body
+        text_content = ParsedEmail.wrap(subject, body).text
         
         # Extract restaurant - check subject first (best for forwarded emails)
         restaurant = None
-        subject_match = re.search(r'Order Confirmation for .+ from (.+)', subject, re.IGNORECASE)
+        subject_match = DOORDASH_SUBJECT_PATTERN.search(subject)
         if subject_match:
             restaurant = subject_match.group(1).strip()
         
         # Fallback to body patterns
         if not restaurant:
-            patterns = [
-                r'Paid with.*?\n([A-Za-z\s&\']+)\nTotal:',
-                r'Paid with.*?([A-Za-z\s&\']+)\s*Total:',
-                r'Thanks for your order[^A-Za-z]*([A-Za-z\s&\']+)\n',
-                r'order from ([^,\n]+)',
-            ]
-            
-            for pattern in patterns:
-                match = re.search(pattern, text_content, re.IGNORECASE | re.DOTALL)
+            for pattern in DOORDASH_RESTAURANT_PATTERNS:
+                match = pattern.search(text_content)
                 if match:
                     candidate = match.group(1).strip()
-                    candidate = re.sub(r'Apple Pay|Google Pay|with', '', candidate, flags=re.IGNORECASE).strip()
+                    candidate = PAYMENT_WORDS_PATTERN.sub('', candidate).strip()
                     
                     if candidate and len(candidate) > 2 and len(candidate) < 50:
                         restaurant = candidate
@@ -130,29 +296,19 @@ def parse_doordash_email(subject, body):
         
         # Extract total
         total = None
-        total_patterns = [
-            r'Total Charged\s*\$([0-9]+\.[0-9]{2})',
-            r'Total:\s*\$([0-9]+\.[0-9]{2})',
-        ]
-        
-        for pattern in total_patterns:
-            match = re.search(pattern, text_content, re.IGNORECASE)
+        for pattern in DOORDASH_TOTAL_PATTERNS:
+            match = pattern.search(text_content)
             if match:
                 total = float(match.group(1))
                 break
         
         # Extract items
         items = []
-        item_patterns = [
-            r'(\d+)x\s*([^•$\n]+?)(?:•[^$]*?)?\s*\$([0-9]+\.[0-9]{2})',
-            r'(\d+)x\s+([^$\n]+?)\s+\$([0-9]+\.[0-9]{2})',
-        ]
-        
-        for pattern in item_patterns:
-            matches = re.findall(pattern, text_content, re.MULTILINE)
+        for pattern in DOORDASH_ITEM_PATTERNS:
+            matches = pattern.findall(text_content)
             for match in matches:
                 item_name = match[1].strip()
-                item_name = re.sub(r'\s*\([^)]+\)\s*$', '', item_name).strip()
+                item_name = CATEGORY_SUFFIX_PATTERN.sub('', item_name).strip()
                 
                 items.append({
                     'quantity': int(match[0]),
@@ -171,52 +327,55 @@ def parse_doordash_email(subject, body):
         }
         
     except Exception as e:
-        print(f"Error parsing DoorDash email: {e}")
+        log.error('parse.failed', f"Error parsing DoorDash email: {e}", service='doordash', exc_info=True)
         return None
 
+# --- Uber Eats ---
+UBEREATS_RESTAURANT_PATTERNS = [
+    re.compile(r'Your order from ([^,\n]+)', re.IGNORECASE),
+    re.compile(r'Thanks for ordering from ([^,\n]+)', re.IGNORECASE),
+    re.compile(r'Receipt for ([^,\n]+)', re.IGNORECASE),
+]
+UBEREATS_TOTAL_PATTERNS = [
+    re.compile(r'Total\s*\$([0-9]+\.[0-9]{2})', re.IGNORECASE),
+    re.compile(r'Amount Charged\s*\$([0-9]+\.[0-9]{2})', re.IGNORECASE),
+    re.compile(r'Order Total\s*\$([0-9]+\.[0-9]{2})', re.IGNORECASE),
+]
+UBEREATS_ORDER_INDICATORS = ("Your order from", "Thanks for ordering", "Receipt for", "Order #")
+# Uber Eats receipts end with a "Rate your order" link
+UBEREATS_EXCLUSIONS = tuple(exc for exc in FILTER_EXCLUSIONS if exc != "rate your")
+UBEREATS_ITEM_PATTERNS = [
+    re.compile(r'(\d+)\s+x\s+([^$\n]+?)\s+\$([0-9]+\.[0-9]{2})', re.MULTILINE),
+    re.compile(r'(\d+)\s+([^$\n]+?)\s+\$([0-9]+\.[0-9]{2})', re.MULTILINE),
+]
+
+@register_parser('ubereats', sender_domains=['uber.com', 'ubereats.com'], keywords=['uber eats', 'ubereats'],
+                 order_indicators=UBEREATS_ORDER_INDICATORS, exclusions=UBEREATS_EXCLUSIONS)
 def parse_ubereats_email(subject, body):
     """Parse Uber Eats order confirmation"""
     try:
-        soup = BeautifulSoup(body, 'html.parser')
-        text_content = soup.get_text() if soup else body
+        text_content = ParsedEmail.wrap(subject, body).text
         
         # Extract restaurant
         restaurant = None
-        patterns = [
-            r'Your order from ([^,\n]+)',
-            r'Thanks for ordering from ([^,\n]+)',
-            r'Receipt for ([^,\n]+)',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text_content, re.IGNORECASE)
+        for pattern in UBEREATS_RESTAURANT_PATTERNS:
+            match = pattern.search(text_content)
             if match:
                 restaurant = match.group(1).strip()
                 break
         
         # Extract total
         total = None
-        total_patterns = [
-            r'Total\s*\$([0-9]+\.[0-9]{2})',
-            r'Amount Charged\s*\$([0-9]+\.[0-9]{2})',
-            r'Order Total\s*\$([0-9]+\.[0-9]{2})',
-        ]
-        
-        for pattern in total_patterns:
-            match = re.search(pattern, text_content, re.IGNORECASE)
+        for pattern in UBEREATS_TOTAL_PATTERNS:
+            match = pattern.search(text_content)
             if match:
                 total = float(match.group(1))
                 break
         
         # Extract items
         items = []
-        item_patterns = [
-            r'(\d+)\s+x\s+([^$\n]+?)\s+\$([0-9]+\.[0-9]{2})',
-            r'(\d+)\s+([^$\n]+?)\s+\$([0-9]+\.[0-9]{2})',
-        ]
-        
-        for pattern in item_patterns:
-            matches = re.findall(pattern, text_content, re.MULTILINE)
+        for pattern in UBEREATS_ITEM_PATTERNS:
+            matches = pattern.findall(text_content)
             for match in matches:
                 items.append({
                     'quantity': int(match[0]),
@@ -232,5 +391,73 @@ def parse_ubereats_email(subject, body):
         }
         
     except Exception as e:
-        print(f"Error parsing Uber Eats email: {e}")
-        return None
\ No newline at end of file
+        log.error('parse.failed', f"Error parsing Uber Eats email: {e}", service='ubereats', exc_info=True)
+        return None
+
+# --- Grubhub ---
+GRUBHUB_SUBJECT_PATTERN = re.compile(r'(?:Your order|Order) from (.+?)(?: has been| is |$)', re.IGNORECASE)
+GRUBHUB_RESTAURANT_PATTERNS = [
+    re.compile(r'Your order from ([^,\n!]+?)(?: has been| is |\s*\n|$)', re.IGNORECASE | re.MULTILINE),
+    re.compile(r'Thanks for ordering from ([^,\n!]+)', re.IGNORECASE),
+    re.compile(r'order from ([^,\n!]+)', re.IGNORECASE),
+]
+# "Total" but not "Subtotal"
+GRUBHUB_TOTAL_PATTERNS = [
+    re.compile(r'(?<![A-Za-z])Total(?: charged)?\s*:?\s*\$([0-9]+\.[0-9]{2})', re.IGNORECASE),
+]
+GRUBHUB_ORDER_INDICATORS = ("Your order from", "Thanks for ordering from", "order has been", "Order #")
+GRUBHUB_ITEM_PATTERNS = [
+    re.compile(r'^\s*(\d+)\s*x?\s+([^$\n]+?)\s+\$([0-9]+\.[0-9]{2})', re.MULTILINE),
+]
+
+@register_parser('grubhub', sender_domains=['grubhub.com', 'seamless.com'], keywords=['grubhub'],
+                 order_indicators=GRUBHUB_ORDER_INDICATORS)
+def parse_grubhub_email(subject, body):
+    """Parse Grubhub (and Seamless) order confirmation"""
+    try:
+        text_content = ParsedEmail.wrap(subject, body).text
+        
+        # Extract restaurant - subject is usually "Your order from X has been received"
+        restaurant = None
+        subject_match = GRUBHUB_SUBJECT_PATTERN.search(subject)
+        if subject_match:
+            restaurant = subject_match.group(1).strip()
+        
+        if not restaurant:
+            for pattern in GRUBHUB_RESTAURANT_PATTERNS:
+                match = pattern.search(text_content)
+                if match:
+                    restaurant = match.group(1).strip()
+                    break
+        
+        # Extract total
+        total = None
+        for pattern in GRUBHUB_TOTAL_PATTERNS:
+            match = pattern.search(text_content)
+            if match:
+                total = float(match.group(1))
+                break
+        
+        # Extract items
+        items = []
+        for pattern in GRUBHUB_ITEM_PATTERNS:
+            for match in pattern.findall(text_content):
+                items.append({
+                    'quantity': int(match[0]),
+                    'name': CATEGORY_SUFFIX_PATTERN.sub('', match[1].strip()).strip(),
+                    'price': float(match[2])
+                })
+            
+            if items:
+                break
+        
+        return {
+            'service': 'grubhub',
+            'restaurant': restaurant or 'Unknown Restaurant',
+            'total': total,
+            'items': items
+        }
+        
+    except Exception as e:
+        log.error('parse.failed', f"Error parsing Grubhub email: {e}", service='grubhub', exc_info=True)
+        return None
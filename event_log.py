@@ -0,0 +1,193 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Log level for NutriSync's own loggers, e.g. DEBUG to see candidate scoring
+LOG_LEVEL = os.environ.get("NUTRISYNC_LOG_LEVEL", "INFO").upper()
+# 'text' prints the message as before; 'json' writes one JSON object per event
+LOG_FORMAT = os.environ.get("NUTRISYNC_LOG_FORMAT", "text")
+# Fraction of high-volume debug events (per-candidate scores, filter steps) that are logged
+DEBUG_SAMPLE_RATE = float(os.environ.get("NUTRISYNC_DEBUG_SAMPLE_RATE", "0.1"))
+# Records waiting for the writer thread; beyond this they are dropped, never waited on
+LOG_QUEUE_SIZE = 10000
+
+ROOT_LOGGER = "nutrisync"
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats a record as its message ('text'), or as a JSON object with the event
+    name, level, logger, thread and any fields passed to the EventLogger call ('json').
+    """
+
+    def __init__(self, fmt: str = "text"):
+        super().__init__()
+        self.json = fmt == "json"
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if not self.json:
+            if record.exc_info:
+                message = f"{message}\n{self.formatException(record.exc_info)}"
+            return message
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': getattr(record, 'event', None),
+            'message': message.strip(),
+            'thread': record.threadName,
+        }
+        data.update({key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRS and key != 'event'})
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread without ever blocking the caller: if the
+    queue is full the record is dropped and counted. Formatting happens on the
+    writer thread, not here.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Records stay in this process, so there's nothing to pickle-proof
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_lock = threading.Lock()
+_handler: Optional[NonBlockingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+# The last configure_logging() arguments, to set up again in a forked child
+_settings: tuple = (None, None, None)
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None, stream=None):
+    """
+    Routes the 'nutrisync' loggers through a bounded queue to a writer thread that
+    prints to `stream` (stdout by default). Calling it again replaces the setup.
+    """
+    global _handler, _listener, _settings
+    with _lock:
+        _settings = (level, fmt, stream)
+        if _listener is not None:
+            _listener.stop()
+        root = logging.getLogger(ROOT_LOGGER)
+        if _handler is not None:
+            root.removeHandler(_handler)
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(StructuredFormatter(fmt or LOG_FORMAT))
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        _handler = NonBlockingQueueHandler(log_queue)
+        _listener = QueueListener(log_queue, output)
+        _listener.start()
+
+        root.addHandler(_handler)
+        root.setLevel(level or LOG_LEVEL)
+        root.propagate = False
+
+
+def flush_logging():
+    """Writes out every queued record (stops and restarts the writer thread)."""
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.start()
+
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler is not None else 0
+
+
+@atexit.register
+def _stop_listener():
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+
+
+def _restart_after_fork():
+    """
+    The writer thread doesn't survive fork(), and the child can't stop it cleanly
+    (its queue may have been locked mid-put), so a forked child gets a fresh setup.
+    """
+    global _lock, _listener
+    _lock = threading.Lock()
+    if _listener is not None:
+        _listener = None
+        configure_logging(*_settings)
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+class EventLogger:
+    """
+    A named logger whose calls carry an event name and key/value fields, e.g.
+        log.info('filter.rejected', "   ❌ Not from DoorDash", reason='sender')
+    The message is what text output shows; JSON output also has the event and fields.
+    """
+
+    def __init__(self, name: str):
+        self.logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+    def enabled(self, level: int) -> bool:
+        return self.logger.isEnabledFor(level)
+
+    def sample(self, rate: Optional[float] = None) -> bool:
+        """
+        True if debug logging is on and this occurrence wins the sampling draw. Guard
+        high-volume debug events with it so they cost one check when disabled:
+            if log.sample():
+                log.debug('search.candidate', f"...", score=score)
+        """
+        return self.logger.isEnabledFor(logging.DEBUG) and random.random() < (
+            DEBUG_SAMPLE_RATE if rate is None else rate)
+
+    def _log(self, level: int, event: str, message: str, fields: dict, exc_info=None):
+        if self.logger.isEnabledFor(level):
+            fields['event'] = event
+            self.logger.log(level, message, extra=fields, exc_info=exc_info)
+
+    def debug(self, event: str, message: str = "", **fields):
+        self._log(logging.DEBUG, event, message, fields)
+
+    def info(self, event: str, message: str = "", **fields):
+        self._log(logging.INFO, event, message, fields)
+
+    def warning(self, event: str, message: str = "", **fields):
+        self._log(logging.WARNING, event, message, fields)
+
+    def error(self, event: str, message: str = "", exc_info=None, **fields):
+        self._log(logging.ERROR, event, message, fields, exc_info=exc_info)
+
+
+def get_logger(name: str) -> EventLogger:
+    """An EventLogger under 'nutrisync.<name>'. Logging is configured on first use."""
+    if _listener is None:
+        with _lock:
+            configured = _listener is not None
+        if not configured:
+            configure_logging()
+    return EventLogger(name)
@@ -0,0 +1,25 @@
+"""gunicorn settings for NutriSync: `gunicorn -c gunicorn.conf.py`"""
+import os
+
+wsgi_app = "wsgi:application"
+bind = os.environ.get("NUTRISYNC_BIND", "0.0.0.0:5000")
+
+# Import the app (and warm it) once in the master, then fork the workers
+preload_app = True
+workers = int(os.environ.get("NUTRISYNC_WORKERS", os.cpu_count() or 2))
+# Requests mostly wait on Nutritionix, so each worker also serves several at once
+worker_class = "gthread"
+threads = int(os.environ.get("NUTRISYNC_THREADS", "4"))
+# A cold order can need several rate-limited, retried API calls
+timeout = 60
+
+
+def post_fork(server, worker):
+    """Background threads don't survive fork(), so each worker starts its own ingestion
+    workers, which pick up jobs left queued or running by a previous run."""
+    import app
+    from wsgi import application
+
+    if app.ASYNC_INGESTION:
+        with application.app_context():
+            app.start_ingestion_workers()
@@ -0,0 +1,202 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from branded_index import BrandedItemIndex, brand_key, brand_matches, item_id_for
+from event_log import get_logger
+
+log = get_logger('menu_snapshots')
+
+
+class MenuSnapshots:
+    """
+    Offline copies of restaurant menus. The first time a restaurant is seen, its
+    brand's branded items are fetched once (via `fetch(restaurant)`) and added to
+    the local branded-item index, so later items from that restaurant resolve with
+    no network call. Snapshots older than `refresh_seconds` are refreshed in the
+    background on next use; at most `max_restaurants` snapshots of up to
+    `max_items` items are kept, evicting the least recently used. A failed fetch
+    is not retried for `retry_seconds`.
+    """
+
+    def __init__(self, path: str, index: BrandedItemIndex, fetch: Callable[[str], Optional[List[dict]]],
+                 refresh_seconds: float = 14 * 86400, max_restaurants: int = 50, max_items: int = 300,
+                 retry_seconds: float = 3600, touch_interval: float = 300):
+        self.path = path
+        self.index = index
+        self.fetch = fetch
+        self.refresh_seconds = refresh_seconds
+        self.max_restaurants = max_restaurants
+        self.max_items = max_items
+        self.retry_seconds = retry_seconds
+        # Recency for eviction is only written once per this many seconds per restaurant
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Restaurants being fetched right now, so concurrent orders don't fetch twice
+        self._fetching = set()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS menu_snapshots ("
+            " restaurant_key TEXT PRIMARY KEY,"
+            " restaurant TEXT NOT NULL,"
+            " item_ids TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " last_used_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS menu_fetch_failures ("
+            " restaurant_key TEXT PRIMARY KEY,"
+            " retry_after REAL NOT NULL)"
+        )
+        conn.commit()
+        # Snapshot metadata is small, so keep it in memory for the per-item checks
+        self._snapshots: Dict[str, Dict] = {
+            key: {'restaurant': restaurant, 'item_count': len(json.loads(item_ids)), 'fetched_at': fetched_at,
+                  'used_at': last_used_at}
+            for key, restaurant, item_ids, fetched_at, last_used_at in conn.execute(
+                "SELECT restaurant_key, restaurant, item_ids, fetched_at, last_used_at FROM menu_snapshots")
+        }
+        # Restaurants whose last fetch failed -> when to try again
+        self._retry_after: Dict[str, float] = dict(conn.execute(
+            "SELECT restaurant_key, retry_after FROM menu_fetch_failures"))
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def has_menu(self, restaurant: str) -> bool:
+        """True if a non-empty snapshot of the restaurant's menu is stored."""
+        snapshot = self._snapshots.get(brand_key(restaurant))
+        return bool(snapshot and snapshot['item_count'])
+
+    def ensure(self, restaurant: str) -> bool:
+        """
+        Makes sure the restaurant has a snapshot: fetches it now if there is none,
+        or refreshes it in the background if it is due. Returns has_menu().
+        """
+        key = brand_key(restaurant)
+        if not key:
+            return False
+        now = time.time()
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            if not self._retry_due(key, now):
+                return False
+            self.refresh(restaurant)
+        else:
+            if now - snapshot['used_at'] > self.touch_interval:
+                snapshot['used_at'] = now
+                conn = self._conn()
+                with conn:
+                    conn.execute("UPDATE menu_snapshots SET last_used_at = ? WHERE restaurant_key = ?", (now, key))
+            if now - snapshot['fetched_at'] > self.refresh_seconds and self._retry_due(key, now):
+                threading.Thread(target=self.refresh, args=(restaurant,), name='menu-refresh', daemon=True).start()
+        return self.has_menu(restaurant)
+
+    def _retry_due(self, key: str, now: float) -> bool:
+        """False while a failed fetch of the restaurant (by any process) is backing off."""
+        if self._retry_after.get(key, 0) > now:
+            return False
+        row = self._conn().execute(
+            "SELECT retry_after FROM menu_fetch_failures WHERE restaurant_key = ?", (key,)).fetchone()
+        if row and row[0] > now:
+            self._retry_after[key] = row[0]
+            return False
+        return True
+
+    def _record_failure(self, key: str, restaurant: str):
+        retry_after = time.time() + self.retry_seconds
+        self._retry_after[key] = retry_after
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO menu_fetch_failures (restaurant_key, retry_after) VALUES (?, ?)",
+                         (key, retry_after))
+        log.info('menu.fetch_backoff', f"⏳ Menu fetch for {restaurant} failed, retrying in {self.retry_seconds:.0f}s",
+                 restaurant=restaurant, retry_seconds=self.retry_seconds)
+
+    def refresh(self, restaurant: str):
+        """Fetches the restaurant's menu and replaces its snapshot. Fetch failures keep the old one."""
+        key = brand_key(restaurant)
+        with self._lock:
+            if key in self._fetching:
+                return
+            self._fetching.add(key)
+        try:
+            items = self.fetch(restaurant)
+            if items is None:
+                self._record_failure(key, restaurant)
+                return
+            # Only the restaurant's own brand belongs in its snapshot
+            items = [item for item in items if brand_matches(item.get('brand_name', ''), restaurant)]
+            items = items[:self.max_items]
+            item_ids = [item_id_for(item) for item in items]
+
+            conn = self._conn()
+            row = conn.execute("SELECT item_ids FROM menu_snapshots WHERE restaurant_key = ?", (key,)).fetchone()
+            if row:
+                # Items that dropped off the menu leave the index too
+                self._release(key, set(json.loads(row[0])) - set(item_ids))
+            self.index.add_items(items, from_search=False)
+
+            now = time.time()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO menu_snapshots (restaurant_key, restaurant, item_ids, fetched_at,"
+                    " last_used_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, restaurant, json.dumps(item_ids), now, now),
+                )
+                conn.execute("DELETE FROM menu_fetch_failures WHERE restaurant_key = ?", (key,))
+            self._retry_after.pop(key, None)
+            self._snapshots[key] = {'restaurant': restaurant, 'item_count': len(items), 'fetched_at': now,
+                                    'used_at': now}
+            log.info('menu.stored', f"📋 Stored menu snapshot for {restaurant}: {len(items)} items",
+                     restaurant=restaurant, items=len(items))
+            self._evict()
+        finally:
+            with self._lock:
+                self._fetching.discard(key)
+
+    def _evict(self):
+        """Drops the least recently used snapshots beyond max_restaurants."""
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT restaurant_key, item_ids FROM menu_snapshots ORDER BY last_used_at DESC LIMIT -1 OFFSET ?",
+            (self.max_restaurants,),
+        ).fetchall()
+        for key, item_ids in rows:
+            self._release(key, json.loads(item_ids))
+            with conn:
+                conn.execute("DELETE FROM menu_snapshots WHERE restaurant_key = ?", (key,))
+            self._snapshots.pop(key, None)
+            log.info('menu.evicted', f"🗑️ Evicted menu snapshot: {key}", restaurant_key=key)
+
+    def _release(self, key: str, item_ids):
+        """
+        Removes a snapshot's items from the index, except those another snapshot
+        holds or that ordinary searches found too.
+        """
+        held = set()
+        for (other_ids,) in self._conn().execute(
+                "SELECT item_ids FROM menu_snapshots WHERE restaurant_key != ?", (key,)):
+            held.update(json.loads(other_ids))
+        self.index.remove_items([item_id for item_id in item_ids if item_id not in held], keep_searched=True)
+
+    def stats(self) -> Dict:
+        return {
+            'restaurants': len(self._snapshots),
+            'items': sum(snapshot['item_count'] for snapshot in self._snapshots.values()),
+        }
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,178 @@
+import threading
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Trailing windows (in days) for the rolling averages
+ROLLING_WINDOWS = (7, 30)
+SERIES_FIELDS = ('calories', 'protein', 'carbs', 'fat', 'cost')
+EPOCH_DAY = date(1970, 1, 1)
+
+
+def _rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean over `window` days via cumulative sums (windows at the start
+    of the array average over the days available)."""
+    sums = np.cumsum(values)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return sums / counts
+
+
+def _safe_ratio(numerator: np.ndarray, denominator: np.ndarray, scale: float = 1.0) -> np.ndarray:
+    """numerator / denominator * scale, with 0 wherever the denominator is 0."""
+    result = np.zeros(np.broadcast(numerator, denominator).shape)
+    np.divide(numerator * scale, denominator, out=result, where=denominator > 0)
+    return result
+
+
+def _rounded(values: np.ndarray, digits: int = 1) -> list:
+    return np.round(values, digits).tolist()
+
+
+class OrderAnalytics:
+    """
+    Long-range nutrition analytics over the order store, computed on NumPy column
+    arrays (one element per enhanced order) instead of per-order dict loops. The
+    columns are built lazily on the first request and reused until the store's
+    revision changes, i.e. until new orders (or enhancements) arrive.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._revision = None
+        self._columns: Optional[Dict[str, np.ndarray]] = None
+        self._restaurants: Optional[np.ndarray] = None
+
+    def columns(self) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """
+        Returns (columns, restaurant names); columns['restaurant'] holds indexes into
+        the names. Both come from the same build, so a concurrent rebuild can't pair
+        new codes with old names.
+        """
+        revision = self.store.revision()
+        with self._lock:
+            if self._columns is None or revision != self._revision:
+                self._build_columns()
+                self._revision = revision
+            return self._columns, self._restaurants
+
+    def _build_columns(self):
+        rows = self.store.enhanced_columns()
+        if rows:
+            days, restaurants, *numeric = zip(*rows)
+        else:
+            days, restaurants, numeric = (), (), [()] * 5
+        names, codes = np.unique(np.array(restaurants, dtype=object), return_inverse=True)
+        self._restaurants = names
+        self._columns = {
+            'day': np.array(days, dtype=np.int64),
+            'restaurant': codes.astype(np.int64),
+            'cost': np.array(numeric[0], dtype=np.float64),
+            'calories': np.array(numeric[1], dtype=np.float64),
+            'protein': np.array(numeric[2], dtype=np.float64),
+            'carbs': np.array(numeric[3], dtype=np.float64),
+            'fat': np.array(numeric[4], dtype=np.float64),
+        }
+
+    @staticmethod
+    def _macro_percentages(protein, carbs, fat, calories) -> Dict[str, np.ndarray]:
+        return {
+            'protein': _safe_ratio(protein * 4, calories, 100),
+            'carbs': _safe_ratio(carbs * 4, calories, 100),
+            'fat': _safe_ratio(fat * 9, calories, 100),
+        }
+
+    def summary(self, start: date, end: date, restaurant: Optional[str] = None) -> Dict:
+        """
+        Analytics for the days [start, end]: per-day totals with rolling 7/30-day
+        averages, rolling macro-percentage trends, spend per 1000 kcal, and a
+        per-restaurant breakdown.
+        """
+        columns, restaurants = self.columns()
+        first_day = (start - EPOCH_DAY).days
+        last_day = (end - EPOCH_DAY).days
+        num_days = last_day - first_day + 1
+        # Reach back far enough that the first day's rolling windows are complete
+        history_start = first_day - (max(ROLLING_WINDOWS) - 1)
+
+        mask = (columns['day'] >= history_start) & (columns['day'] <= last_day)
+        if restaurant is not None:
+            matches = np.flatnonzero(restaurants == restaurant)
+            mask &= columns['restaurant'] == (matches[0] if len(matches) else -1)
+        offsets = columns['day'][mask] - history_start
+        length = last_day - history_start + 1
+
+        # Dense per-day series (zero on days without orders), history included
+        daily = {
+            field: np.bincount(offsets, weights=columns[field][mask], minlength=length)
+            for field in SERIES_FIELDS
+        }
+        daily_orders = np.bincount(offsets, minlength=length)
+        in_range = slice(length - num_days, length)
+
+        rolling = {}
+        for window in ROLLING_WINDOWS:
+            means = {field: _rolling_mean(daily[field], window) for field in SERIES_FIELDS}
+            rolling[f'{window}d'] = {field: _rounded(means[field][in_range]) for field in SERIES_FIELDS}
+            rolling[f'{window}d']['macro_percentages'] = {
+                macro: _rounded(values[in_range])
+                for macro, values in self._macro_percentages(
+                    means['protein'], means['carbs'], means['fat'], means['calories']).items()
+            }
+            rolling[f'{window}d']['spend_per_1000_kcal'] = _rounded(
+                _safe_ratio(means['cost'], means['calories'], 1000)[in_range], 2)
+
+        totals = {field: float(daily[field][in_range].sum()) for field in SERIES_FIELDS}
+        total_orders = int(daily_orders[in_range].sum())
+
+        return {
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'days': num_days,
+            'total_orders': total_orders,
+            'totals': {
+                **{field: round(value, 1) for field, value in totals.items()},
+                'spend_per_1000_kcal': round(totals['cost'] * 1000 / totals['calories'], 2)
+                if totals['calories'] else 0,
+            },
+            'daily_averages': {field: round(value / num_days, 1) for field, value in totals.items()},
+            'dates': [(start + timedelta(days=i)).isoformat() for i in range(num_days)],
+            'daily': {
+                'orders': daily_orders[in_range].tolist(),
+                **{field: _rounded(daily[field][in_range]) for field in SERIES_FIELDS},
+            },
+            'rolling': rolling,
+            'restaurants': self._restaurant_breakdown(
+                columns, restaurants, mask & (columns['day'] >= first_day)),
+        }
+
+    def _restaurant_breakdown(self, columns: Dict[str, np.ndarray], restaurants: np.ndarray,
+                              mask: np.ndarray) -> list:
+        codes = columns['restaurant'][mask]
+        size = len(restaurants)
+        orders = np.bincount(codes, minlength=size)
+        sums = {
+            field: np.bincount(codes, weights=columns[field][mask], minlength=size)
+            for field in SERIES_FIELDS
+        }
+        macros = self._macro_percentages(sums['protein'], sums['carbs'], sums['fat'], sums['calories'])
+        avg_calories = _safe_ratio(sums['calories'], orders)
+        spend_per_1000 = _safe_ratio(sums['cost'], sums['calories'], 1000)
+
+        breakdown = []
+        # Most-ordered restaurants first
+        for code in np.argsort(-orders, kind='stable'):
+            if orders[code] == 0:
+                break
+            breakdown.append({
+                'restaurant': restaurants[code],
+                'orders': int(orders[code]),
+                'calories': round(float(sums['calories'][code]), 1),
+                'avg_calories_per_order': round(float(avg_calories[code]), 1),
+                'cost': round(float(sums['cost'][code]), 2),
+                'spend_per_1000_kcal': round(float(spend_per_1000[code]), 2),
+                'macro_percentages': {macro: round(float(values[code]), 1) for macro, values in macros.items()},
+            })
+        return breakdown
@@ -0,0 +1,452 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, Optional, Tuple
+
+from event_log import get_logger
+from metrics import count_cache_lookup
+
+log = get_logger('nutrition_cache')
+
+
+class CacheBackend(ABC):
+    """
+    Base class for nutrition cache storage. Backends behave like a small key/value
+    store of JSON-serializable dicts, and also support the dict-style operations
+    (`in`, `[]`, `len`) the tracker has always used on its cache. Subclasses must
+    implement get, set, delete and items; everything else has a default.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: dict):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        ...
+
+    def set_many(self, entries: Dict[str, dict], overwrite: bool = True):
+        for key, value in entries.items():
+            if overwrite or self.get(key) is None:
+                self.set(key, value)
+
+    def flush(self):
+        """Persists any buffered writes. Backends that write through do nothing."""
+        pass
+
+    def reload(self):
+        """Drops any in-process view of the data and re-reads it from storage."""
+        pass
+
+    def close(self):
+        pass
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.items())
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: str) -> dict:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: dict):
+        self.set(key, value)
+
+    def __delitem__(self, key: str):
+        self.delete(key)
+
+
+class JsonFileCache(CacheBackend):
+    """
+    The original single-file JSON cache. Every write rewrites the whole file, so it
+    is only suitable for small caches and a single process. Writes go through a
+    temporary file and an atomic rename so a crash never leaves a truncated cache.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._data = self._load()
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Return an empty cache if file is not found or corrupted
+            return {}
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.cache-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._data, f, indent=4)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            log.error('cache.save_failed', f"Error saving cache: {e}", path=self.path, error=str(e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._data.get(key)
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._data[key] = value
+            self._save()
+
+    def set_many(self, entries: Dict[str, dict], overwrite: bool = True):
+        with self._lock:
+            for key, value in entries.items():
+                if overwrite or key not in self._data:
+                    self._data[key] = value
+            self._save()
+
+    def reload(self):
+        with self._lock:
+            self._data = self._load()
+
+    def delete(self, key: str):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._save()
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        with self._lock:
+            return iter(list(self._data.items()))
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SqliteCache(CacheBackend):
+    """
+    A SQLite-backed cache in WAL mode. Each key is a primary-key row, so reads and
+    upserts are indexed and independent of cache size, writes are atomic, and
+    several worker processes can share the same database file safely.
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value TEXT)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: dict):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO cache (key, value, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                (key, json.dumps(value), time.time()),
+            )
+
+    def set_many(self, entries: Dict[str, dict], overwrite: bool = True):
+        """
+        Upserts several entries in one transaction. With `overwrite=False`, existing
+        keys are left untouched.
+        """
+        verb = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                f"{verb} INTO cache (key, value, updated_at) VALUES (?, ?, ?)",
+                [(key, json.dumps(value), now) for key, value in entries.items()],
+            )
+
+    def delete(self, key: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        for key, value in self._conn().execute("SELECT key, value FROM cache"):
+            yield key, json.loads(value)
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def migrate_from_json(self, json_path: str) -> int:
+        """
+        One-time import of a legacy JSON cache file. Existing rows win over the file,
+        and the migration is recorded so it never runs twice. Returns rows imported.
+        """
+        conn = self._conn()
+        marker = f"migrated:{os.path.abspath(json_path)}"
+        if conn.execute("SELECT 1 FROM cache_meta WHERE name = ?", (marker,)).fetchone():
+            return 0
+
+        legacy = JsonFileCache(json_path)
+        entries = dict(legacy.items())
+        before = len(self)
+        if entries:
+            self.set_many(entries, overwrite=False)
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO cache_meta (name, value) VALUES (?, ?)", (marker, str(time.time())))
+
+        imported = len(self) - before
+        if entries:
+            log.info('cache.migrated', f"📦 Migrated {imported} cache entries from {json_path}",
+                     entries=imported, path=json_path)
+        return imported
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class WriteBehindCache(CacheBackend):
+    """
+    An in-memory tier in front of a persistent backend. The memory tier is warmed
+    from the backend once, so reads never touch disk for known keys. Writes land in
+    memory and are marked dirty; a background thread flushes dirty entries to the
+    backend in one batch every `flush_interval` seconds, and on close().
+    """
+
+    def __init__(self, backend: CacheBackend, flush_interval: float = 5.0):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._memory: Dict[str, dict] = dict(backend.items())
+        self._dirty: Dict[str, dict] = {}
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='cache-flusher', daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def get(self, key: str) -> Optional[dict]:
+        value = self._memory.get(key)
+        if value is not None:
+            return value
+        # Another process may have written the key since we warmed up
+        value = self.backend.get(key)
+        if value is not None:
+            with self._lock:
+                self._memory.setdefault(key, value)
+        return value
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._memory[key] = value
+            self._dirty[key] = value
+
+    def delete(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+            self._dirty.pop(key, None)
+            self.backend.delete(key)
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        with self._lock:
+            return iter(list(self._memory.items()))
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+        try:
+            self.backend.set_many(dirty)
+        except Exception as e:
+            log.error('cache.flush_failed', f"Error flushing cache: {e}", entries=len(dirty), error=str(e))
+            # Put the entries back so the next flush retries them (newer writes win)
+            with self._lock:
+                for key, value in dirty.items():
+                    self._dirty.setdefault(key, value)
+
+    def reload(self):
+        """Flushes pending writes, then re-warms the memory tier from the backend."""
+        self.flush()
+        self.backend.reload()
+        memory = dict(self.backend.items())
+        with self._lock:
+            memory.update(self._dirty)
+            self._memory = memory
+
+    def invalidate(self, key: Optional[str] = None):
+        """
+        With a key, removes that entry from both tiers so it is fetched again.
+        Without one, flushes and drops the whole memory tier; entries are then
+        re-read from the backend lazily.
+        """
+        if key is not None:
+            self.delete(key)
+            return
+        self.flush()
+        with self._lock:
+            self._memory = {}
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+        self.backend.close()
+
+    def after_fork(self):
+        """Restarts the flusher in a forked child; threads don't survive fork()."""
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='cache-flusher', daemon=True)
+        self._flusher.start()
+
+
+class NegativeCache:
+    """
+    Remembers items the API answered but could not match, so known-unresolvable
+    items aren't searched again on every order. Entries expire after `ttl` seconds.
+    Only confirmed misses belong here; transport failures (timeouts, 5xx) must not
+    be recorded, so the item is retried once the API is reachable again.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 86400, busy_timeout: float = 5.0):
+        self.path = path
+        self.ttl = ttl
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS negative_cache ("
+            " key TEXT PRIMARY KEY,"
+            " reason TEXT,"
+            " created_at REAL NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[dict]:
+        """Returns the live entry for `key` (counting the hit), or None."""
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE negative_cache SET hits = hits + 1 WHERE key = ? AND expires_at > ?", (key, now))
+            if cursor.rowcount == 0:
+                conn.execute("DELETE FROM negative_cache WHERE key = ? AND expires_at <= ?", (key, now))
+                count_cache_lookup('negative', False)
+                return None
+            row = conn.execute(
+                "SELECT reason, created_at, expires_at, hits FROM negative_cache WHERE key = ?", (key,)).fetchone()
+        count_cache_lookup('negative', True)
+        return {'reason': row[0], 'created_at': row[1], 'expires_at': row[2], 'hits': row[3]}
+
+    def add(self, key: str, reason: str):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO negative_cache (key, reason, created_at, expires_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET reason = excluded.reason, created_at = excluded.created_at,"
+                " expires_at = excluded.expires_at",
+                (key, reason, now, now + self.ttl),
+            )
+
+    def delete(self, key: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM negative_cache WHERE key = ?", (key,))
+
+    def purge_expired(self) -> int:
+        conn = self._conn()
+        with conn:
+            return conn.execute("DELETE FROM negative_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def stats(self, top: int = 10) -> dict:
+        """Live entry count, total hits, and the most frequently hit entries."""
+        self.purge_expired()
+        conn = self._conn()
+        entries, hits = conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM negative_cache").fetchone()
+        rows = conn.execute(
+            "SELECT key, reason, hits, expires_at FROM negative_cache ORDER BY hits DESC, created_at DESC LIMIT ?",
+            (top,),
+        ).fetchall()
+        return {
+            'entries': entries,
+            'total_hits': hits,
+            'ttl_seconds': self.ttl,
+            'top_entries': [
+                {'key': key, 'reason': reason, 'hits': entry_hits, 'expires_at': expires_at}
+                for key, reason, entry_hits, expires_at in rows
+            ],
+        }
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_cache_backend(kind: str, path: str, legacy_json_path: Optional[str] = None) -> CacheBackend:
+    """
+    Builds the cache backend named by `kind` ('sqlite' or 'json'). For SQLite, an
+    existing legacy JSON cache is migrated into the database on first use.
+    """
+    if kind == 'json':
+        return JsonFileCache(path)
+    if kind == 'sqlite':
+        backend = SqliteCache(path)
+        if legacy_json_path and os.path.exists(legacy_json_path):
+            backend.migrate_from_json(legacy_json_path)
+        return backend
+    raise ValueError(f"Unknown cache backend: {kind}")
@@ -1,10 +1,137 @@
 import requests
-import json
 import re
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Set
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import atexit
+import os
+import threading
 import time
 
+from branded_index import BrandedItemIndex, tokenize
+from event_log import get_logger
+from metrics import count_cache_lookup
+from menu_snapshots import MenuSnapshots
+from nutrition_cache import CacheBackend, NegativeCache, WriteBehindCache, create_cache_backend
+from nutritionix_client import NutritionixClient
+from single_flight import LeaseTable, SingleFlight
+
+log = get_logger('nutrition_tracker')
+
+# Nutritionix API base URL; point it at benchmarks/mock_nutritionix.py to run offline
+NUTRITIONIX_API_URL = os.environ.get("NUTRISYNC_NUTRITIONIX_URL", "https://trackapi.nutritionix.com").rstrip('/')
+
+# Maximum number of item lookups that run at the same time for a single order.
+# Each lookup can block on several HTTP calls, so orders are bounded by the
+# slowest item instead of the sum of all items.
+MAX_CONCURRENT_LOOKUPS = 4
+
+# When enabled, all uncached items of an order are sent to the Natural Language
+# API in a single query; items that can't be matched fall back to single lookups.
+BATCH_NATURAL_LANGUAGE = True
+
+# Minimum token overlap (0-1) between a returned food and an order item for the
+# batched response to be attributed to that item.
+BATCH_MATCH_THRESHOLD = 0.34
+
+# Cache storage: 'sqlite' (indexed, multi-process safe) or 'json' (legacy single file).
+# A legacy JSON cache is migrated into the SQLite database the first time it is opened.
+CACHE_BACKEND = "sqlite"
+CACHE_DB_FILE = "nutritionix_cache.db"
+LEGACY_CACHE_FILE = "nutritionix_cache.json"
+
+# Keep an in-memory copy of the cache and write new entries back in batches
+# every CACHE_FLUSH_INTERVAL seconds (and at shutdown) instead of on every miss.
+CACHE_WRITE_BEHIND = True
+CACHE_FLUSH_INTERVAL = 5.0
+
+# Items every API strategy answered without a match are remembered as known misses
+# (in the cache database) for NEGATIVE_CACHE_TTL_DAYS. Lookups that hit a transport
+# error (timeout, connection error, 429/5xx) are never recorded as misses.
+NEGATIVE_CACHE_TTL_DAYS = 7
+
+# Concurrent lookups of the same item are coalesced: within a process via
+# SingleFlight, across processes via a lease in the cache database. Waiters give up
+# on another process's lease after LOOKUP_LEASE_SECONDS, checking every LOOKUP_WAIT_POLL.
+LOOKUP_LEASE_SECONDS = 60.0
+LOOKUP_WAIT_POLL = 0.1
+
+# Every branded item returned by Instant Search is kept in a local BM25 index.
+# Items whose best same-brand match reaches LOCAL_MATCH_CONFIDENCE are resolved
+# from the index without any API call; Instant Search results are accepted at
+# SEARCH_MIN_CONFIDENCE or above, or when they share a word and the restaurant's brand.
+BRANDED_INDEX_DB_FILE = "nutritionix_branded.db"
+LOCAL_MATCH_CONFIDENCE = 0.8
+SEARCH_MIN_CONFIDENCE = 0.2
+
+# Menu snapshots: the first order from a restaurant fetches its brand's branded
+# items into the local index (one Instant Search call), so its other items resolve
+# offline. Restaurants with a snapshot resolve locally at SNAPSHOT_MATCH_CONFIDENCE.
+# Snapshots are refreshed in the background after MENU_REFRESH_DAYS; the least
+# recently used are evicted beyond MENU_SNAPSHOT_MAX_RESTAURANTS.
+MENU_SNAPSHOTS = True
+SNAPSHOT_MATCH_CONFIDENCE = 0.6
+MENU_REFRESH_DAYS = 14
+MENU_SNAPSHOT_MAX_RESTAURANTS = 50
+MENU_SNAPSHOT_MAX_ITEMS = 300
+# A failed menu fetch isn't retried for this long, so orders don't each refetch it
+MENU_FETCH_RETRY_MINUTES = 60
+
+# Instant Search query variants ("{restaurant} {name}", "{name} {restaurant}", ...)
+# are sent concurrently (up to SEARCH_FANOUT_WORKERS at a time) and their candidates
+# ranked together. Once a match of the restaurant's brand reaches
+# FANOUT_EARLY_STOP_CONFIDENCE, the remaining queries are abandoned. Disable to try
+# the variants one after another.
+SEARCH_FANOUT = True
+SEARCH_FANOUT_WORKERS = 4
+FANOUT_EARLY_STOP_CONFIDENCE = 0.8
+
+# Nutritionix API client limits. Requests are spread to NUTRITIONIX_RATE_PER_SECOND
+# (bursts of NUTRITIONIX_BURST) and capped at NUTRITIONIX_DAILY_BUDGET per UTC day
+# across all processes; set the budget to your plan's daily quota. 429/5xx responses
+# are retried up to NUTRITIONIX_MAX_RETRIES times. After BREAKER_FAILURE_THRESHOLD
+# consecutive failures, calls fail fast for BREAKER_RESET_SECONDS.
+NUTRITIONIX_RATE_PER_SECOND = 5.0
+NUTRITIONIX_BURST = 10
+NUTRITIONIX_DAILY_BUDGET = 500
+NUTRITIONIX_MAX_RETRIES = 3
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+
+# Nutrient fields that scale linearly with quantity
+NUTRIENT_FIELDS = ['calories', 'protein', 'carbs', 'fat', 'fiber', 'sugar', 'sodium', 'saturated_fat']
+
+def normalize_nutrition(nutrition: dict, quantity: int, query: Optional[str] = None) -> dict:
+    """
+    Converts nutrition for `quantity` servings into a per-serving cache record that
+    keeps where the data came from, so it can be reused for any quantity.
+    """
+    quantity = quantity if quantity and quantity > 0 else 1
+    record = nutrition.copy()
+    for key in NUTRIENT_FIELDS:
+        if key in record:
+            record[key] = record[key] / quantity
+    record['per_serving'] = True
+    record['provenance'] = {
+        'source': nutrition.get('source'),
+        'query': query,
+        'fetched_quantity': quantity,
+        'fetched_at': datetime.now().isoformat(),
+    }
+    return record
+
+def scale_nutrition(record: dict, quantity: int) -> dict:
+    """
+    Scales a per-serving cache record to `quantity` servings.
+    """
+    nutrition = record.copy()
+    nutrition.pop('per_serving', None)
+    for key in NUTRIENT_FIELDS:
+        if key in nutrition:
+            nutrition[key] = nutrition[key] * quantity
+    nutrition['quantity'] = quantity
+    return nutrition
+
 class NutritionixTracker:
     """
     A class to track nutritional information for food items using the Nutritionix API.
@@ -21,38 +148,176 @@ class NutritionixTracker:
         self.app_key = "56f69812cb54dca287ccca8f0c3355b2"
         
         # Nutritionix API endpoints
-        self.instant_endpoint = "https://trackapi.nutritionix.com/v2/search/instant"
-        self.nutrients_endpoint = "https://trackapi.nutritionix.com/v2/natural/nutrients"
+        self.instant_endpoint = f"{NUTRITIONIX_API_URL}/v2/search/instant"
+        self.nutrients_endpoint = f"{NUTRITIONIX_API_URL}/v2/natural/nutrients"
         
         # Request timeout in seconds
         self.timeout = 10
 
+        # Pooled, rate-limited, retrying API client (see nutritionix_client.py)
+        self.client = NutritionixClient(
+            self.app_id, self.app_key, timeout=self.timeout, usage_path=CACHE_DB_FILE,
+            rate_per_second=NUTRITIONIX_RATE_PER_SECOND, burst=NUTRITIONIX_BURST,
+            daily_budget=NUTRITIONIX_DAILY_BUDGET, max_retries=NUTRITIONIX_MAX_RETRIES,
+            failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_SECONDS,
+            # Every concurrent lookup may fan out SEARCH_FANOUT_WORKERS requests at once;
+            # a smaller pool drops the extra connections after each use
+            pool_size=MAX_CONCURRENT_LOOKUPS * SEARCH_FANOUT_WORKERS,
+        )
+
         # --- Cache Setup ---
-        self.cache_file = "nutritionix_cache.json"
+        self.cache_file = CACHE_DB_FILE if CACHE_BACKEND == 'sqlite' else LEGACY_CACHE_FILE
         self.cache = self.load_cache()
+        self._migrate_quantity_keys()
+        self.negative_cache = NegativeCache(CACHE_DB_FILE, ttl=NEGATIVE_CACHE_TTL_DAYS * 86400)
+        # Per-thread record of whether the current lookup hit a transport error
+        self._lookup_state = threading.local()
+        # Coalescing of concurrent lookups for the same item, in and across processes
+        self._inflight = SingleFlight()
+        self._leases = LeaseTable(CACHE_DB_FILE, lease_seconds=LOOKUP_LEASE_SECONDS)
+
+        # --- Local branded-item index ---
+        self.branded_index = BrandedItemIndex(BRANDED_INDEX_DB_FILE)
+        self.menus = MenuSnapshots(
+            BRANDED_INDEX_DB_FILE, self.branded_index, self._fetch_brand_menu,
+            refresh_seconds=MENU_REFRESH_DAYS * 86400,
+            max_restaurants=MENU_SNAPSHOT_MAX_RESTAURANTS,
+            max_items=MENU_SNAPSHOT_MAX_ITEMS,
+            retry_seconds=MENU_FETCH_RETRY_MINUTES * 60,
+        ) if MENU_SNAPSHOTS else None
     
-    def load_cache(self) -> Dict:
+    def load_cache(self) -> CacheBackend:
         """
-        Loads the nutrition cache from a local JSON file.
-        Returns an empty dictionary if the file doesn't exist or is invalid.
+        Opens the configured cache backend. Both backends start empty if no cache
+        exists yet; the SQLite backend imports the legacy JSON cache once.
+        With write-behind enabled, the backend is wrapped in a warm in-memory tier.
         """
-        try:
-            with open(self.cache_file, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            # Return an empty cache if file is not found or corrupted
-            return {}
+        backend = create_cache_backend(CACHE_BACKEND, self.cache_file, legacy_json_path=LEGACY_CACHE_FILE)
+        if CACHE_WRITE_BEHIND:
+            cache = WriteBehindCache(backend, flush_interval=CACHE_FLUSH_INTERVAL)
+            # Make sure buffered entries reach disk when the process exits
+            atexit.register(cache.close)
+            return cache
+        return backend
 
     def save_cache(self):
         """
-        Saves the current state of the cache to a local JSON file.
+        Writes any buffered cache entries to persistent storage now.
         """
-        try:
-            with open(self.cache_file, 'w') as f:
-                json.dump(self.cache, f, indent=4)
-        except Exception as e:
-            print(f"Error saving cache: {e}")
+        self.cache.flush()
+
+    def reload_cache(self):
+        """
+        Re-reads the cache from persistent storage, picking up entries written by
+        other processes. Pending writes are flushed first.
+        """
+        self.cache.reload()
+
+    def invalidate_cache(self, cache_key: Optional[str] = None):
+        """
+        Forgets one cache entry (so it is looked up again), or with no key drops
+        the in-memory tier so it is re-read from storage.
+        """
+        if cache_key is not None:
+            self.negative_cache.delete(cache_key)
+        if isinstance(self.cache, WriteBehindCache):
+            self.cache.invalidate(cache_key)
+        elif cache_key is not None:
+            self.cache.delete(cache_key)
+        else:
+            self.cache.reload()
+
+    def close(self):
+        """
+        Flushes pending cache writes and releases the cache backend.
+        """
+        self.cache.close()
+        self._release_connections()
+
+    def _release_connections(self):
+        """
+        Closes this thread's database connections and the pooled HTTP connections.
+        Each is reopened on next use.
+        """
+        self.negative_cache.close()
+        self.client.close()
+        self._leases.close()
+        if self.menus:
+            self.menus.close()
+        self.branded_index.close()
+
+    def before_fork(self):
+        """
+        Flushes pending cache writes and closes this thread's connections, so a
+        forked child opens its own instead of sharing the parent's. The in-memory
+        cache tier and branded index stay loaded and are shared copy-on-write.
+        """
+        self.save_cache()
+        backend = self.cache.backend if isinstance(self.cache, WriteBehindCache) else self.cache
+        backend.close()
+        self._release_connections()
+
+    def after_fork(self):
+        """
+        Runs in a forked child: restarts the cache flusher thread, drops in-flight
+        lookups, whose leader threads only exist in the parent, and takes leases
+        under this process's own owner id.
+        """
+        if isinstance(self.cache, WriteBehindCache):
+            self.cache.after_fork()
+        self._inflight = SingleFlight()
+        self._leases.after_fork()
+
+    def _store_in_cache(self, cache_key: str, nutrition: dict):
+        """
+        Stores a result in the cache. Safe to call from worker threads.
+        """
+        self.cache.set(cache_key, nutrition)
     
+    def _note_request_failure(self, error: requests.exceptions.RequestException):
+        """
+        Records that the current lookup hit a transport error, so a failed lookup
+        isn't cached as a miss. A 404 is Nutritionix's "no foods matched" answer,
+        which is a real miss rather than a failure.
+        """
+        response = getattr(error, 'response', None)
+        if response is not None and response.status_code == 404:
+            return
+        self._lookup_state.transport_failed = True
+
+    def _item_cache_key(self, restaurant: str, item_name: str) -> str:
+        """
+        Builds the cache key for an item. Records are stored per serving, so the
+        key doesn't depend on quantity.
+        """
+        clean_name = ' '.join(self.clean_item_name(item_name).lower().split())
+        return f"{restaurant.lower().strip()}|{clean_name}"
+
+    def _migrate_quantity_keys(self):
+        """
+        Merges legacy `restaurant|name|quantity` entries into per-serving records.
+        Entries fetched for a single serving win; existing per-serving records are kept.
+        """
+        legacy = []
+        for key, value in self.cache.items():
+            parts = key.rsplit('|', 2)
+            if len(parts) == 3 and parts[2].isdigit():
+                legacy.append((int(parts[2]), key, f"{parts[0]}|{parts[1]}", value))
+        if not legacy:
+            return
+
+        for quantity, old_key, new_key, value in sorted(legacy):
+            if self.cache.get(new_key) is None and quantity > 0:
+                nutrition = value.copy()
+                # Instant Search results were scaled from one serving before being cached
+                if str(nutrition.get('source', '')).endswith('_scaled'):
+                    nutrition['source'] = nutrition['source'][:-len('_scaled')]
+                self.cache.set(new_key, normalize_nutrition(nutrition, quantity))
+            self.cache.delete(old_key)
+        self.cache.flush()
+        log.info('cache.migrated', f"📦 Merged {len(legacy)} quantity-keyed cache entries into per-serving records",
+                 entries=len(legacy))
+
     def clean_item_name(self, item_name: str) -> str:
         """
         Cleans up an item name by removing common clutter from delivery service emails.
@@ -86,21 +351,121 @@ class NutritionixTracker:
             'source': source,
         }
 
+    def _fetch_brand_menu(self, restaurant: str) -> Optional[List[dict]]:
+        """
+        Fetches the branded restaurant items Nutritionix has for a restaurant (one
+        detailed Instant Search call). Returns None if the request failed.
+        """
+        log.info('menu.fetch', f"📋 Fetching menu snapshot for '{restaurant}'", restaurant=restaurant)
+        params = {
+            'query': re.sub(r"[^\w\s]", "", restaurant),
+            'branded': True,
+            'common': False,
+            'detailed': True,
+            'branded_type': 1,  # restaurant items only
+        }
+        try:
+            response = self.client.get(self.instant_endpoint, params=params)
+            return response.json().get('branded', [])
+        except requests.exceptions.RequestException as e:
+            log.warning('menu.fetch_failed', f"❌ Menu snapshot request failed for '{restaurant}': {e}",
+                        restaurant=restaurant, error=str(e))
+            return None
+
+    def _coalesced(self, cache_key: str, fetch: Callable[[], Optional[dict]]) -> Optional[dict]:
+        """
+        Runs `fetch` for an uncached key at most once at a time: threads of this
+        process wait for the one already fetching, and other processes sharing the
+        cache database wait on its lease and then read the result from the cache.
+        """
+        return self._inflight.do(cache_key, lambda: self._fetch_with_lease(cache_key, fetch))
+
+    def _fetch_with_lease(self, cache_key: str, fetch: Callable[[], Optional[dict]]) -> Optional[dict]:
+        # Another thread or process may have finished this key while we were queued
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        if not self._leases.acquire(cache_key):
+            log.info('lookup.waiting', f"⏳ Another worker is looking up '{cache_key}', waiting for its result",
+                     key=cache_key)
+            deadline = time.monotonic() + LOOKUP_LEASE_SECONDS
+            while self._leases.held(cache_key) and time.monotonic() < deadline:
+                time.sleep(LOOKUP_WAIT_POLL)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+            # The other worker may have recorded a miss; `fetch` can't be trusted to
+            # check, since batch lookups skip the negative cache (prechecked)
+            if self.negative_cache.get(cache_key) is not None:
+                log.info('cache.known_miss', f"🚫 Another worker found no match for '{cache_key}', skipping API",
+                         key=cache_key)
+                return None
+            # No result (the other worker failed): look it up ourselves
+            if not self._leases.acquire(cache_key):
+                return fetch()
+
+        try:
+            record = fetch()
+            # Publish the result before the lease is released so waiting processes see it
+            self.cache.flush()
+            return record
+        finally:
+            self._leases.release(cache_key)
+
+    def _resolve_locally(self, item_name: str, restaurant: str) -> Optional[dict]:
+        """
+        Resolves an item from the local branded-item index when the restaurant's own
+        item matches with high confidence. The per-serving record is cached like an
+        API result. Returns None if the API is needed.
+        """
+        clean_name = self.clean_item_name(item_name)
+        threshold = LOCAL_MATCH_CONFIDENCE
+        if self.menus and self.menus.has_menu(restaurant):
+            threshold = SNAPSHOT_MATCH_CONFIDENCE
+        match = self.branded_index.best_match(clean_name, restaurant, threshold)
+        count_cache_lookup('local_index', match is not None)
+        if match is None:
+            return None
+
+        item = match['item']
+        log.info('lookup.local', f"📚 Resolved '{clean_name}' locally: {item['food_name']} ({item.get('brand_name')}) "
+                 f"- confidence {match['confidence']:.2f}", item=clean_name, confidence=match['confidence'])
+        nutrition = self._parse_nutrition_data(item, 'nutritionix_index', restaurant)
+        record = normalize_nutrition(nutrition, 1, clean_name)
+        self._store_in_cache(self._item_cache_key(restaurant, item_name), record)
+        return record
+
     def search_item(self, item_name: str, restaurant: str) -> Optional[dict]:
         """
         Searches for a single serving of an item using the Nutritionix instant search endpoint.
         This method is a fallback for when the natural language search fails.
         """
         clean_name = self.clean_item_name(item_name)
-        cache_key = f"{restaurant.lower()}|{clean_name.lower()}"
+        cache_key = self._item_cache_key(restaurant, item_name)
         
-        if cache_key in self.cache:
-            print(f"✅ Cache hit for '{clean_name}' from '{restaurant}'")
-            return self.cache[cache_key]
-            
-        print(f"🔍 Searching Nutritionix for: '{clean_name}' from '{restaurant}'")
+        cached = self.cache.get(cache_key)
+        count_cache_lookup('item', cached is not None)
+        if cached is not None:
+            log.info('cache.hit', f"✅ Cache hit for '{clean_name}' from '{restaurant}'", item=clean_name)
+            return scale_nutrition(cached, 1)
         
-        headers = {'x-app-id': self.app_id, 'x-app-key': self.app_key}
+        record = self._coalesced(
+            cache_key,
+            lambda: self._resolve_locally(item_name, restaurant) or self._search_instant(item_name, restaurant),
+        )
+        return scale_nutrition(record, 1) if record else None
+
+    def _search_instant(self, item_name: str, restaurant: str) -> Optional[dict]:
+        """
+        Looks an item up with Instant Search query variants, either one after another
+        until one returns an acceptable branded match, or (SEARCH_FANOUT) all at once.
+        Caches and returns the per-serving record, or None.
+        """
+        clean_name = self.clean_item_name(item_name)
+        cache_key = self._item_cache_key(restaurant, item_name)
+        log.info('search.start', f"🔍 Searching Nutritionix for: '{clean_name}' from '{restaurant}'",
+                 item=clean_name, restaurant=restaurant)
         
         search_queries = [
             f"{restaurant} {clean_name}",
@@ -108,81 +473,143 @@ class NutritionixTracker:
             clean_name,
         ]
         
-        # Special handling for McDonald's possessive
-        if "McDonald's" in restaurant:
-            search_queries.insert(0, f"McDonalds {clean_name}")
+        # Brands are often indexed without punctuation (e.g. "McDonalds", "Wendys")
+        plain_restaurant = re.sub(r"[^\w\s]", "", restaurant)
+        if plain_restaurant != restaurant:
+            search_queries.insert(0, f"{plain_restaurant} {clean_name}")
 
+        if SEARCH_FANOUT and len(search_queries) > 1:
+            found = self._search_queries_parallel(clean_name, restaurant, search_queries)
+        else:
+            found = self._search_queries_sequential(clean_name, restaurant, search_queries)
+        
+        if found is None:
+            log.info('search.no_match', f"❌ No suitable match found for '{clean_name}' after trying all queries.",
+                     item=clean_name)
+            return None
+        
+        best, query = found
+        best_match = best['item']
+        log.info('search.matched', f"✅ Best match: {best_match['food_name']} ({best_match.get('brand_name')}) "
+                 f"- Score: {best['score']:.2f}", item=clean_name, query=query, score=best['score'],
+                 confidence=best['confidence'])
+        
+        # Parse the nutrition data directly from the search result to be more efficient
+        nutrition = self._parse_nutrition_data(best_match, 'nutritionix_search', restaurant)
+        record = normalize_nutrition(nutrition, 1, query)
+        self._store_in_cache(cache_key, record)
+        return record
+
+    def _instant_query(self, query: str) -> List[dict]:
+        """
+        Runs one Instant Search query and returns its branded items. Raises
+        RequestException for bad status codes once retries are exhausted.
+        """
+        params = {
+            'query': query,
+            'branded': True,
+            'common': False,
+            'detailed': True  # Request detailed nutrition info to avoid a second API call
+        }
+        response = self.client.get(self.instant_endpoint, params=params)
+        return response.json().get('branded', [])
+
+    def _best_candidate(self, clean_name: str, restaurant: str, candidates: Set[int]) -> Optional[dict]:
+        """
+        Ranks candidate items (index doc ids) against the item name and returns the
+        best one if it is acceptable, else None.
+        """
+        ranked = self.branded_index.search(clean_name, restaurant, limit=10, doc_ids=candidates)
+        
+        if log.sample():
+            for i, result in enumerate(ranked):
+                item = result['item']
+                log.debug('search.candidate',
+                          f"  {i+1}. {item['food_name']} - {item.get('brand_name')} ({item.get('nf_calories', 0)} cal) "
+                          f"score {result['score']:.2f}, confidence {result['confidence']:.2f}",
+                          rank=i + 1, food=item['food_name'], brand=item.get('brand_name'),
+                          score=result['score'], confidence=result['confidence'])
+        
+        best = ranked[0] if ranked else None
+        if best and (best['confidence'] >= SEARCH_MIN_CONFIDENCE or best['brand_match']):
+            return best
+        return None
+
+    def _search_queries_sequential(self, clean_name: str, restaurant: str,
+                                   search_queries: List[str]) -> Optional[tuple]:
+        """Tries queries in order; returns (best result, query) for the first acceptable match."""
         for query in search_queries:
-            print(f"  Trying query: '{query}'")
-            params = {
-                'query': query,
-                'branded': True,
-                'common': False,
-                'detailed': True  # Request detailed nutrition info to avoid a second API call
-            }
-            
+            log.debug('search.query', f"  Trying query: '{query}'", query=query)
             try:
-                response = requests.get(self.instant_endpoint, headers=headers, params=params, timeout=self.timeout)
-                response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
+                branded_items = self._instant_query(query)
+            except requests.exceptions.RequestException as e:
+                log.warning('search.query_failed', f"  ❌ API request failed for query '{query}': {e}",
+                            query=query, error=str(e))
+                self._note_request_failure(e)
+                continue
+            
+            if branded_items:
+                log.debug('search.results', f"  Found {len(branded_items)} potential results for query '{query}'",
+                          query=query, results=len(branded_items))
+                # Keep every branded item we receive so later lookups can resolve locally
+                candidates = self.branded_index.add_items(branded_items)
+                best = self._best_candidate(clean_name, restaurant, candidates)
+                if best:
+                    return best, query
+        return None
 
-                data = response.json()
-                branded_items = data.get('branded', [])
+    def _search_queries_parallel(self, clean_name: str, restaurant: str,
+                                 search_queries: List[str]) -> Optional[tuple]:
+        """
+        Sends all queries at once, merges their (deduplicated) candidates and ranks
+        them together. Stops waiting for the remaining queries as soon as a confident
+        match of the restaurant's brand has arrived. Returns (best result, query) or None.
+        """
+        log.debug('search.fanout', f"  Sending {len(search_queries)} queries in parallel: {search_queries}",
+                  queries=search_queries)
+        candidates: Set[int] = set()
+        # The first query that returned each candidate, for provenance
+        source_query: Dict[int, str] = {}
+        
+        executor = ThreadPoolExecutor(max_workers=min(SEARCH_FANOUT_WORKERS, len(search_queries)))
+        futures = {executor.submit(self._instant_query, query): query for query in search_queries}
+        try:
+            for future in as_completed(futures):
+                query = futures[future]
+                try:
+                    branded_items = future.result()
+                except requests.exceptions.RequestException as e:
+                    # Noted here, on the lookup's own thread
+                    log.warning('search.query_failed', f"  ❌ API request failed for query '{query}': {e}",
+                            query=query, error=str(e))
+                    self._note_request_failure(e)
+                    continue
+                if not branded_items:
+                    continue
                 
-                if branded_items:
-                    print(f"  Found {len(branded_items)} potential results for query '{query}'")
-                    
-                    best_match = None
-                    best_score = 0
-                    
-                    for i, item in enumerate(branded_items[:10]):
-                        brand = item.get('brand_name', '').lower()
-                        name = item.get('food_name', '').lower()
-                        nf_calories = item.get('nf_calories', 0)
-                        
-                        print(f"  {i+1}. {item['food_name']} - {item['brand_name']} ({nf_calories} cal)")
-                        
-                        score = 0
-                        
-                        if any(rest_part in brand for rest_part in ['mcdonald', 'mc donald']):
-                            score += 10
-                        
-                        if clean_name.lower() == name:
-                            score += 20
-                        elif clean_name.lower() in name:
-                            score += 10
-                        
-                        clean_words = set(clean_name.lower().split())
-                        name_words = set(name.split())
-                        matching_words = clean_words.intersection(name_words)
-                        score += len(matching_words) * 3
-                        
-                        if 'spicy crispy chicken' in clean_name.lower() and 'crispy chicken' in name:
-                            score += 5
-                        if 'mcdouble' in clean_name.lower() and 'double' in name:
-                            score += 3
-                        
-                        print(f"      Score: {score}")
-                        
-                        if score > best_score:
-                            best_score = score
-                            best_match = item
-                    
-                    if best_match and best_score >= 3:
-                        print(f"✅ Best match: {best_match['food_name']} ({best_match['brand_name']}) - Score: {best_score}")
-                        
-                        # Parse the nutrition data directly from the search result to be more efficient
-                        nutrition = self._parse_nutrition_data(best_match, 'nutritionix_search', restaurant)
-                        
-                        if nutrition:
-                            self.cache[cache_key] = nutrition
-                            self.save_cache()
-                            return nutrition
-
-            except requests.exceptions.RequestException as e:
-                print(f"  ❌ API request failed for query '{query}': {e}")
+                log.debug('search.results', f"  Found {len(branded_items)} potential results for query '{query}'",
+                          query=query, results=len(branded_items))
+                # Items returned by several queries share one index entry, so merging dedupes them
+                for doc_id in self.branded_index.add_items(branded_items):
+                    source_query.setdefault(doc_id, query)
+                    candidates.add(doc_id)
                 
-        print(f"❌ No suitable match found for '{clean_name}' after trying all queries.")
-        return None
+                top = self.branded_index.search(clean_name, restaurant, limit=1, doc_ids=candidates)
+                if top and top[0]['brand_match'] and top[0]['confidence'] >= FANOUT_EARLY_STOP_CONFIDENCE:
+                    pending = sum(1 for other in futures if not other.done())
+                    if pending:
+                        log.debug('search.early_stop',
+                                  f"  ⚡ Confident match found, not waiting for {pending} remaining queries",
+                                  skipped=pending)
+                    break
+        finally:
+            # Queries that haven't started are cancelled; running ones finish unobserved
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        best = self._best_candidate(clean_name, restaurant, candidates) if candidates else None
+        if best is None:
+            return None
+        return best, source_query[best['doc_id']]
 
     def get_nutrition_natural_language(self, item_name: str, restaurant: str, quantity: int) -> Optional[dict]:
         """
@@ -192,18 +619,12 @@ class NutritionixTracker:
         clean_name = self.clean_item_name(item_name)
         query = f"{quantity} {clean_name} from {restaurant}"
         
-        print(f"🗣️ Using Natural Language API with query: '{query}'")
+        log.info('natural.start', f"🗣️ Using Natural Language API with query: '{query}'", query=query)
         
-        headers = {
-            'x-app-id': self.app_id,
-            'x-app-key': self.app_key,
-            'Content-Type': 'application/json'
-        }
         data = {'query': query}
         
         try:
-            response = requests.post(self.nutrients_endpoint, headers=headers, json=data, timeout=self.timeout)
-            response.raise_for_status()
+            response = self.client.post(self.nutrients_endpoint, json=data)
 
             result = response.json()
             foods = result.get('foods', [])
@@ -211,68 +632,303 @@ class NutritionixTracker:
             if foods:
                 food_item = foods[0] # Assume the first result is the best
                 nutrition = self._parse_nutrition_data(food_item, 'nutritionix_natural', restaurant)
-                print(f"✅ Found via Natural Language: {nutrition['calories']:.0f} cal, {nutrition['protein']:.1f}g protein")
+                log.info('natural.matched', f"✅ Found via Natural Language: {nutrition['calories']:.0f} cal, "
+                         f"{nutrition['protein']:.1f}g protein", query=query, calories=nutrition['calories'])
                 return nutrition
 
         except requests.exceptions.RequestException as e:
-            print(f"❌ Natural Language API request failed: {e}")
+            log.warning('natural.failed', f"❌ Natural Language API request failed: {e}", query=query, error=str(e))
+            self._note_request_failure(e)
         
         return None
 
-    def get_nutrition_for_item(self, restaurant: str, item_name: str, quantity: int = 1) -> Optional[dict]:
+    @staticmethod
+    def _name_tokens(name: str) -> set:
+        """
+        Splits a food name into lowercase word tokens with simple plural stripping,
+        so "French Fries" and "french fry" compare as similar.
+        """
+        return set(tokenize(name))
+
+    def _match_batch_foods(self, clean_names: List[str], foods: List[dict]) -> Dict[int, dict]:
+        """
+        Maps foods returned by a batched Natural Language query back to the item names
+        that produced them. Returns {item_index: food}; each food is used at most once.
+        """
+        item_tokens = [self._name_tokens(name) for name in clean_names]
+        candidates = []
+        for food_index, food in enumerate(foods):
+            food_tokens = self._name_tokens(food.get('food_name', ''))
+            if not food_tokens:
+                continue
+            for item_index, tokens in enumerate(item_tokens):
+                if not tokens:
+                    continue
+                overlap = len(tokens & food_tokens) / len(tokens | food_tokens)
+                if overlap >= BATCH_MATCH_THRESHOLD:
+                    # Prefer the same position on ties, since the API usually keeps query order
+                    candidates.append((overlap, food_index == item_index, item_index, food_index))
+
+        # Greedily assign the strongest pairs first
+        candidates.sort(reverse=True)
+        matches, used_foods = {}, set()
+        for _, _, item_index, food_index in candidates:
+            if item_index in matches or food_index in used_foods:
+                continue
+            matches[item_index] = foods[food_index]
+            used_foods.add(food_index)
+        return matches
+
+    def get_nutrition_natural_language_batch(self, items: List[dict], restaurant: str) -> List[Optional[dict]]:
+        """
+        Sends one Natural Language query listing every item and maps the returned foods
+        back to the source items. Matched foods are cached per serving. Returns a list
+        aligned with `items`; entries that could not be matched are None so the caller
+        can fall back to single lookups.
+        """
+        if not items:
+            return []
+
+        clean_names = [self.clean_item_name(item.get('name', 'Unknown Item')) for item in items]
+        phrases = [f"{item.get('quantity', 1)} {name}" for item, name in zip(items, clean_names)]
+        query = f"{', '.join(phrases)} from {restaurant}"
+
+        log.info('natural_batch.start', f"🗣️ Using batched Natural Language API for {len(items)} items: '{query}'",
+                 items=len(items), query=query)
+
+        try:
+            response = self.client.post(self.nutrients_endpoint, json={'query': query})
+            foods = response.json().get('foods', [])
+        except requests.exceptions.RequestException as e:
+            log.warning('natural_batch.failed', f"❌ Batched Natural Language API request failed: {e}", error=str(e))
+            return [None] * len(items)
+
+        matches = self._match_batch_foods(clean_names, foods)
+        log.info('natural_batch.matched', f"✅ Batched Natural Language matched {len(matches)} of {len(items)} items",
+                 matched=len(matches), items=len(items))
+
+        results = []
+        for i, item in enumerate(items):
+            nutrition = None
+            if i in matches:
+                quantity = item.get('quantity', 1)
+                record = normalize_nutrition(
+                    self._parse_nutrition_data(matches[i], 'nutritionix_natural_batch', restaurant), quantity, query)
+                self._store_in_cache(self._item_cache_key(restaurant, item.get('name', 'Unknown Item')), record)
+                nutrition = scale_nutrition(record, quantity)
+            results.append(nutrition)
+        return results
+
+    def get_nutrition_for_item(self, restaurant: str, item_name: str, quantity: int = 1,
+                               prechecked: bool = False) -> Optional[dict]:
         """
         Main method to get nutrition for an item. It tries the Natural Language API first,
-        and falls back to the instant search API if needed. It also handles caching.
+        and falls back to the instant search API if needed. It also handles caching:
+        results are cached per serving and scaled by `quantity` on the way out.
+        `prechecked` means the caller already found no local match and no known miss.
+        """
+        log.info('lookup.start', f"\n🍔 LOOKING UP: {quantity}x '{item_name}' from '{restaurant}'",
+                 item=item_name, quantity=quantity, restaurant=restaurant)
+        clean_name = self.clean_item_name(item_name)
+        
+        cache_key = self._item_cache_key(restaurant, item_name)
+        cached = self.cache.get(cache_key)
+        count_cache_lookup('item', cached is not None)
+        if cached is not None:
+            log.info('cache.hit', f"✅ Cache hit for {quantity}x '{clean_name}'", item=clean_name)
+            return scale_nutrition(cached, quantity)
+        
+        # Concurrent lookups of the same item share one fetch; the record is per serving,
+        # so each caller scales it by its own quantity
+        record = self._coalesced(
+            cache_key, lambda: self._lookup_item_record(restaurant, item_name, quantity, prechecked))
+        return scale_nutrition(record, quantity) if record else None
+
+    def _lookup_item_record(self, restaurant: str, item_name: str, quantity: int,
+                            prechecked: bool = False) -> Optional[dict]:
+        """
+        Resolves an uncached item: local index, known misses (unless `prechecked`),
+        then the Natural Language API and Instant Search. Returns the cached
+        per-serving record, or None.
         """
-        print(f"\n🍔 LOOKING UP: {quantity}x '{item_name}' from '{restaurant}'")
         clean_name = self.clean_item_name(item_name)
+        cache_key = self._item_cache_key(restaurant, item_name)
         
-        # Use a cache key that includes quantity, as it affects the result
-        cache_key = f"{restaurant.lower()}|{clean_name.lower()}|{quantity}"
-        if cache_key in self.cache:
-            print(f"✅ Cache hit for {quantity}x '{clean_name}'")
-            return self.cache[cache_key]
+        if not prechecked:
+            local = self._resolve_locally(item_name, restaurant)
+            if local is not None:
+                return local
+            
+            known_miss = self.negative_cache.get(cache_key)
+            if known_miss is not None:
+                log.info('cache.known_miss', f"🚫 Known miss for '{clean_name}' ({known_miss['reason']}), skipping API",
+                         item=clean_name, reason=known_miss['reason'])
+                return None
+        self._lookup_state.transport_failed = False
         
         # --- Primary Strategy: Natural Language API ---
         # This is generally better as it can parse quantity and context together.
         nutrition = self.get_nutrition_natural_language(item_name, restaurant, quantity)
+        if nutrition:
+            record = normalize_nutrition(nutrition, quantity, f"{quantity} {clean_name} from {restaurant}")
+            self._store_in_cache(cache_key, record)
+            return record
         
         # --- Fallback Strategy: Instant Search API ---
-        if not nutrition:
-            print("  -> Natural Language failed, falling back to Instant Search.")
-            # Search for a single item first
-            nutrition_single = self.search_item(item_name, restaurant)
-            
-            if nutrition_single:
-                # If found, scale the nutrition by the quantity
-                nutrition = nutrition_single.copy() # Create a copy to modify
-                if quantity > 1:
-                    for key in ['calories', 'protein', 'carbs', 'fat', 'fiber', 'sugar', 'sodium', 'saturated_fat']:
-                        if key in nutrition:
-                            nutrition[key] *= quantity
-                    nutrition['source'] += '_scaled'
+        log.info('lookup.fallback', "  -> Natural Language failed, falling back to Instant Search.", item=clean_name)
+        # Search for a single serving; it is cached under the same key
+        record = self._search_instant(item_name, restaurant)
+        if record:
+            return record
         
-        if nutrition:
-            # Cache the final result for the specific quantity
-            self.cache[cache_key] = nutrition
-            self.save_cache()
-        
-        return nutrition
+        # Every strategy answered without a match: remember it, unless an API call failed
+        if self._lookup_state.transport_failed:
+            log.warning('lookup.miss_not_cached', f"⚠️ Not caching miss for '{clean_name}': some API requests failed",
+                        item=clean_name)
+        else:
+            self.negative_cache.add(cache_key, 'no_match')
+            log.info('lookup.miss_cached', f"🚫 Cached '{clean_name}' as a known miss for {NEGATIVE_CACHE_TTL_DAYS} days",
+                     item=clean_name)
+        return None
+
+    def _lookup_batch(self, restaurant: str, items: List[dict], indexes: List[int],
+                      results: List[Optional[dict]]):
+        """
+        Resolves items[i] for each i in `indexes` with one batched Natural Language
+        call, filling `results` in place. Items are leased per cache key like single
+        lookups: keys another thread or worker is already fetching are left out of
+        the batch, and their single lookups wait on that fetch instead of repeating it.
+        """
+        claimed, keys = [], []
+        for i in indexes:
+            cache_key = self._item_cache_key(restaurant, items[i].get('name', 'Unknown Item'))
+            if self._leases.acquire(cache_key):
+                claimed.append(i)
+                keys.append(cache_key)
+        try:
+            if len(claimed) > 1:
+                batch_results = self.get_nutrition_natural_language_batch([items[i] for i in claimed], restaurant)
+                for i, nutrition in zip(claimed, batch_results):
+                    if nutrition:
+                        results[i] = nutrition
+                # Publish the results before the leases are released so waiting workers see them
+                self.cache.flush()
+        finally:
+            for cache_key in keys:
+                self._leases.release(cache_key)
 
-def enhance_order_with_nutrition(order_data: dict) -> dict:
+    def get_nutrition_for_items(self, restaurant: str, items: List[dict],
+                                max_workers: int = MAX_CONCURRENT_LOOKUPS,
+                                batch: bool = BATCH_NATURAL_LANGUAGE) -> List[Optional[dict]]:
+        """
+        Looks up nutrition for several order items at once. With `batch` enabled, all
+        uncached items are first resolved with one Natural Language call; the rest go
+        through get_nutrition_for_item on a bounded thread pool.
+        Results are returned in the same order as `items`; failed lookups are None.
+        """
+        results: List[Optional[dict]] = [None] * len(items)
+        pending = list(range(len(items)))
+
+        # First order from a restaurant: snapshot its menu so its items resolve offline
+        if self.menus and any(
+            self._item_cache_key(restaurant, item.get('name', 'Unknown Item')) not in self.cache for item in items
+        ):
+            self.menus.ensure(restaurant)
+
+        if batch:
+            uncached = uncached_all = [
+                i for i in pending
+                if self._item_cache_key(restaurant, items[i].get('name', 'Unknown Item')) not in self.cache
+            ]
+            # Items the local branded index can answer don't need to be in the batch,
+            # and known misses aren't looked up at all
+            known_misses = set()
+            for i in uncached:
+                item_name = items[i].get('name', 'Unknown Item')
+                local = self._resolve_locally(item_name, restaurant)
+                if local is not None:
+                    results[i] = scale_nutrition(local, items[i].get('quantity', 1))
+                elif self.negative_cache.get(self._item_cache_key(restaurant, item_name)) is not None:
+                    log.info('cache.known_miss', f"🚫 Known miss for '{self.clean_item_name(item_name)}', skipping API",
+                             item=item_name)
+                    known_misses.add(i)
+            uncached = [i for i in uncached if results[i] is None and i not in known_misses]
+            pending = [i for i in pending if results[i] is None and i not in known_misses]
+            if len(uncached) > 1:
+                self._lookup_batch(restaurant, items, uncached, results)
+                pending = [i for i in pending if results[i] is None]
+            # Items settled here never reach get_nutrition_for_item, which counts the rest
+            for i in uncached_all:
+                if i not in pending:
+                    count_cache_lookup('item', False)
+
+        def lookup(item: dict) -> Optional[dict]:
+            item_name = item.get('name', 'Unknown Item')
+            quantity = item.get('quantity', 1)
+            try:
+                # The batch pass already checked the local index and known misses
+                return self.get_nutrition_for_item(restaurant, item_name, quantity, prechecked=batch)
+            except Exception as e:
+                log.error('lookup.error', f"❌ Lookup for '{item_name}' raised an error: {e}", item=item_name,
+                          exc_info=True)
+                return None
+
+        pending_items = [items[i] for i in pending]
+        if max_workers <= 1 or len(pending_items) <= 1:
+            lookups = [lookup(item) for item in pending_items]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(pending_items))) as executor:
+                # executor.map yields results in submission order, preserving item order
+                lookups = list(executor.map(lookup, pending_items))
+
+        for i, nutrition in zip(pending, lookups):
+            results[i] = nutrition
+        return results
+
+_tracker: Optional[NutritionixTracker] = None
+_tracker_lock = threading.Lock()
+
+def get_tracker() -> NutritionixTracker:
+    """
+    Returns the process-wide tracker, creating it on first use. Reusing one tracker
+    keeps its cache warm, so per-order cost doesn't depend on the cache size.
+    """
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = NutritionixTracker()
+    return _tracker
+
+def _before_fork():
+    if _tracker is not None:
+        _tracker.before_fork()
+
+def _after_fork_in_child():
+    global _tracker_lock
+    _tracker_lock = threading.Lock()
+    if _tracker is not None:
+        _tracker.after_fork()
+
+# Pre-forking servers (see wsgi.py) build the tracker once and fork workers from it
+os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
+
+def enhance_order_with_nutrition(order_data: dict, max_workers: int = MAX_CONCURRENT_LOOKUPS,
+                                 tracker: Optional[NutritionixTracker] = None) -> dict:
     """
     Main function to process a whole order, fetch nutrition for each item,
     and return the order data enhanced with totals and percentages.
+    Item lookups run concurrently, up to `max_workers` at a time. Uses the
+    process-wide tracker unless one is passed in.
     """
-    print(f"\n{'='*20}\n🍎 STARTING NUTRITION LOOKUP 🍎\n{'='*20}")
-    
-    tracker = NutritionixTracker()
+    tracker = tracker or get_tracker()
     enhanced_order = order_data.copy()
     restaurant = order_data.get('restaurant', 'Unknown Restaurant')
     items = order_data.get('items', [])
     
-    print(f"🏪 Restaurant: {restaurant}")
-    print(f"📦 Items to analyze: {len(items)}")
+    log.info('order.lookup_start', f"\n{'='*20}\n🍎 STARTING NUTRITION LOOKUP 🍎\n{'='*20}\n"
+             f"🏪 Restaurant: {restaurant}\n📦 Items to analyze: {len(items)}",
+             restaurant=restaurant, items=len(items))
     
     meal_totals = {
         'total_calories': 0, 'total_protein': 0, 'total_carbs': 0, 'total_fat': 0,
@@ -282,11 +938,11 @@ def enhance_order_with_nutrition(order_data: dict) -> dict:
     enhanced_items = []
     success_count = 0
     
-    for i, item in enumerate(items, 1):
+    nutrition_results = tracker.get_nutrition_for_items(restaurant, items, max_workers)
+    
+    # Totals are summed in item order so they match a sequential lookup exactly
+    for item, nutrition in zip(items, nutrition_results):
         item_name = item.get('name', 'Unknown Item')
-        quantity = item.get('quantity', 1)
-        
-        nutrition = tracker.get_nutrition_for_item(restaurant, item_name, quantity)
         
         enhanced_item = item.copy()
         enhanced_item['nutrition'] = None
@@ -301,9 +957,10 @@ def enhance_order_with_nutrition(order_data: dict) -> dict:
                 nutrition_key = key.replace('total_', '') 
                 meal_totals[key] += nutrition.get(nutrition_key, 0)
 
-            print(f"  -> SUCCESS: {nutrition['calories']:.0f} cal, {nutrition['protein']:.1f}g protein")
+            log.debug('order.item', f"  -> SUCCESS: {nutrition['calories']:.0f} cal, {nutrition['protein']:.1f}g protein",
+                      item=item_name, calories=nutrition['calories'])
         else:
-            print(f"  -> FAILED to find nutrition for '{item_name}'")
+            log.info('order.item_failed', f"  -> FAILED to find nutrition for '{item_name}'", item=item_name)
             
         enhanced_items.append(enhanced_item)
     
@@ -325,14 +982,19 @@ def enhance_order_with_nutrition(order_data: dict) -> dict:
     else:
         meal_totals['macro_percentages'] = {'protein': 0, 'carbs': 0, 'fat': 0}
     
-    print(f"\n{'='*50}\n📊 NUTRITION SUMMARY FOR {restaurant.upper()}\n{'='*50}")
-    print(f"✅ Found nutrition for: {success_count} of {len(items)} items")
-    print(f"🔥 Total Calories: {meal_totals['total_calories']:.0f}")
-    print(f"🥩 Protein: {meal_totals['total_protein']:.1f}g ({meal_totals['macro_percentages']['protein']:.1f}%)")
-    print(f"🍞 Carbs:   {meal_totals['total_carbs']:.1f}g ({meal_totals['macro_percentages']['carbs']:.1f}%)")
-    print(f"🧈 Fat:     {meal_totals['total_fat']:.1f}g ({meal_totals['macro_percentages']['fat']:.1f}%)")
-    print(f"🧂 Sodium:  {meal_totals['total_sodium']:.0f}mg")
-    print(f"{'='*50}")
+    # One record for the whole summary block
+    macros = meal_totals['macro_percentages']
+    log.info('order.summary',
+             f"\n{'='*50}\n📊 NUTRITION SUMMARY FOR {restaurant.upper()}\n{'='*50}\n"
+             f"✅ Found nutrition for: {success_count} of {len(items)} items\n"
+             f"🔥 Total Calories: {meal_totals['total_calories']:.0f}\n"
+             f"🥩 Protein: {meal_totals['total_protein']:.1f}g ({macros['protein']:.1f}%)\n"
+             f"🍞 Carbs:   {meal_totals['total_carbs']:.1f}g ({macros['carbs']:.1f}%)\n"
+             f"🧈 Fat:     {meal_totals['total_fat']:.1f}g ({macros['fat']:.1f}%)\n"
+             f"🧂 Sodium:  {meal_totals['total_sodium']:.0f}mg\n"
+             f"{'='*50}",
+             restaurant=restaurant, found=success_count, items=len(items),
+             calories=round(meal_totals['total_calories'], 1))
     
     return enhanced_order
 
@@ -0,0 +1,263 @@
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from event_log import get_logger
+from metrics import NUTRITIONIX_REQUEST_SECONDS, NUTRITIONIX_REQUESTS
+
+log = get_logger('nutritionix_client')
+
+# Status codes worth retrying: rate limited, or a server-side problem
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class NutritionixUnavailable(requests.exceptions.RequestException):
+    """
+    Raised without calling the API: the circuit breaker is open, the daily budget
+    is spent, or no rate-limit token became available in time. It subclasses
+    RequestException so callers handle it like any other transport failure.
+    """
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait: float) -> bool:
+        """Takes one token, waiting up to `max_wait` seconds. Returns False on timeout."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class DailyBudget:
+    """
+    Counts API requests per UTC day in SQLite, so the count is shared by every
+    process and survives restarts. Requests beyond `limit` in a day are refused.
+    """
+
+    def __init__(self, path: str, limit: int):
+        self.path = path
+        self.limit = limit
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS api_usage (day TEXT PRIMARY KEY, requests INTEGER NOT NULL)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+    def try_consume(self) -> bool:
+        """Counts one request if today's budget allows it."""
+        conn = self._conn()
+        day = self._today()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO api_usage (day, requests) VALUES (?, 0)", (day,))
+            cursor = conn.execute(
+                "UPDATE api_usage SET requests = requests + 1 WHERE day = ? AND requests < ?", (day, self.limit))
+        return cursor.rowcount == 1
+
+    def used(self) -> int:
+        row = self._conn().execute("SELECT requests FROM api_usage WHERE day = ?", (self._today(),)).fetchone()
+        return row[0] if row else 0
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, so calls fail fast instead
+    of each waiting out a timeout. After `reset_timeout` seconds one trial call is
+    let through (half-open); its success closes the breaker, its failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                return True
+            # Open, or half-open with the trial call still in flight
+            return False
+
+    def cancel_trial(self):
+        """
+        Hands back a half-open trial call that was stopped before it reached
+        Nutritionix (by the rate limiter or the daily budget). The breaker goes back
+        to open with its old timestamp, so the next call becomes the trial instead.
+        """
+        with self._lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = 'closed'
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    log.warning('breaker.opened', f"🔌 Nutritionix circuit breaker opened after {self._failures} failures",
+                                failures=self._failures)
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+class NutritionixClient:
+    """
+    The one place Nutritionix HTTP calls are made. Requests share a pooled
+    keep-alive session and pass, in order, through the circuit breaker, the
+    token-bucket rate limiter and the daily budget. 429/5xx responses and
+    connection errors are retried with jittered exponential backoff (honouring
+    Retry-After).
+    Responses are returned after raise_for_status(), like plain `requests` calls.
+    """
+
+    def __init__(self, app_id: str, app_key: str, timeout: float = 10, usage_path: str = "nutritionix_cache.db",
+                 rate_per_second: float = 5.0, burst: int = 10, daily_budget: int = 500,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0, pool_size: int = 10):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        self.session.headers.update({'x-app-id': app_id, 'x-app-key': app_key})
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.limiter = TokenBucket(rate_per_second, burst)
+        self.budget = DailyBudget(usage_path, daily_budget)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0}
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        # "Full jitter": spreads retries from concurrent lookups apart
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _reject(self, endpoint: str, reason: str):
+        self._count('rejected')
+        NUTRITIONIX_REQUESTS.inc(endpoint, 'rejected')
+        raise NutritionixUnavailable(reason)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        # Last path segment ('instant', 'nutrients') labels the metrics
+        endpoint = url.rstrip('/').rsplit('/', 1)[-1]
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self._reject(endpoint, "Nutritionix circuit breaker is open")
+            if not self.limiter.acquire(max_wait=self.timeout):
+                # A call the breaker let through has to report back, or a half-open trial never ends
+                self.breaker.cancel_trial()
+                self._reject(endpoint, "Timed out waiting for a Nutritionix rate-limit token")
+            if not self.budget.try_consume():
+                self.breaker.cancel_trial()
+                self._reject(endpoint, f"Daily Nutritionix budget of {self.budget.limit} requests is used up")
+
+            self._count('requests')
+            response = None
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                NUTRITIONIX_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint)
+                NUTRITIONIX_REQUESTS.inc(endpoint, 'error')
+                self.breaker.record_failure()
+                self._count('failures')
+                retryable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                if not retryable or attempt == self.max_retries:
+                    raise
+            else:
+                NUTRITIONIX_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint)
+                NUTRITIONIX_REQUESTS.inc(endpoint, str(response.status_code))
+                if response.status_code not in RETRYABLE_STATUSES:
+                    self.breaker.record_success()
+                    response.raise_for_status()
+                    return response
+                self.breaker.record_failure()
+                self._count('failures')
+                if attempt == self.max_retries:
+                    response.raise_for_status()
+
+            self._count('retries')
+            time.sleep(self._backoff(attempt, response))
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            'breaker_state': self.breaker.state,
+            'budget_used_today': self.budget.used(),
+            'daily_budget': self.budget.limit,
+        })
+        return stats
+
+    def close(self):
+        self.session.close()
+        self.budget.close()
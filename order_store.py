@@ -0,0 +1,301 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional
+
+from event_log import get_logger
+
+log = get_logger('order_store')
+
+# meal_totals fields summed into the per-day rollups (as total_<name>)
+ROLLUP_NUTRIENTS = ('calories', 'protein', 'carbs', 'fat', 'fiber', 'sugar', 'sodium', 'saturated_fat')
+ROLLUP_COLUMNS = ('orders',) + ROLLUP_NUTRIENTS + ('cost',)
+ROLLUP_UPSERT_SQL = (
+    f"INSERT INTO daily_rollups (day, {', '.join(ROLLUP_COLUMNS)})"
+    f" VALUES (?, {', '.join('?' for _ in ROLLUP_COLUMNS)})"
+    f" ON CONFLICT(day) DO UPDATE SET {', '.join(f'{c} = {c} + excluded.{c}' for c in ROLLUP_COLUMNS)}"
+)
+
+
+class OrderStore:
+    """
+    Orders and their nutrition-enhanced versions in one SQLite database (WAL mode),
+    indexed by order time, restaurant and service. Replaces the per-order
+    order_*.json / enhanced_order_*.json files, which collided when two orders
+    arrived in the same second and had to be globbed and opened on every read.
+
+    Enhanced orders are also summed into per-day rollups (order count, meal_totals
+    nutrients and cost) in the same transaction that stores them, so a summary over
+    any date range reads one row per day instead of every order.
+    """
+
+    def __init__(self, path: str = "nutrisync_orders.db"):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS orders ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " ordered_at REAL NOT NULL,"
+            " service TEXT,"
+            " restaurant TEXT,"
+            " total REAL,"
+            " source TEXT NOT NULL,"
+            " source_key TEXT UNIQUE,"
+            " order_json TEXT NOT NULL,"
+            " enhanced_json TEXT);"
+            "CREATE INDEX IF NOT EXISTS idx_orders_ordered_at ON orders (ordered_at);"
+            "CREATE INDEX IF NOT EXISTS idx_orders_restaurant ON orders (restaurant, ordered_at);"
+            "CREATE INDEX IF NOT EXISTS idx_orders_service ON orders (service, ordered_at);"
+            "CREATE TABLE IF NOT EXISTS daily_rollups ("
+            " day TEXT PRIMARY KEY,"
+            + ",".join(f" {column} REAL NOT NULL DEFAULT 0" for column in ROLLUP_COLUMNS)
+            + ");"
+            "CREATE TABLE IF NOT EXISTS store_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+            "INSERT OR IGNORE INTO store_meta (name, value) VALUES ('revision', 0);"
+        )
+        conn.commit()
+        # Databases created before rollups existed get them built once from history
+        if (conn.execute("SELECT 1 FROM orders WHERE enhanced_json IS NOT NULL LIMIT 1").fetchone()
+                and not conn.execute("SELECT 1 FROM daily_rollups LIMIT 1").fetchone()):
+            self.rebuild_rollups()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_values(order: Dict, enhanced: Optional[Dict], ordered_at: Optional[datetime],
+                    source: str, source_key: Optional[str]) -> tuple:
+        ordered_at = ordered_at or datetime.now()
+        return (
+            ordered_at.timestamp(),
+            order.get('service'),
+            order.get('restaurant'),
+            order.get('total'),
+            source,
+            source_key,
+            json.dumps(order),
+            json.dumps(enhanced) if enhanced is not None else None,
+        )
+
+    @staticmethod
+    def _bump_revision(conn: sqlite3.Connection):
+        conn.execute("UPDATE store_meta SET value = value + 1 WHERE name = 'revision'")
+
+    def revision(self) -> int:
+        """A counter bumped by every write (from any process), for invalidating derived data."""
+        return self._conn().execute("SELECT value FROM store_meta WHERE name = 'revision'").fetchone()[0]
+
+    @staticmethod
+    def _day(ordered_at: float) -> str:
+        return datetime.fromtimestamp(ordered_at).strftime('%Y-%m-%d')
+
+    @staticmethod
+    def _rollup_row(day: str, enhanced: Dict, sign: int = 1) -> tuple:
+        meal_totals = enhanced.get('meal_totals') or {}
+        values = [1.0]
+        values.extend(float(meal_totals.get(f'total_{name}') or 0) for name in ROLLUP_NUTRIENTS)
+        values.append(float(enhanced.get('total') or 0))
+        return (day, *(sign * value for value in values))
+
+    def add_order(self, order: Dict, enhanced: Optional[Dict] = None, ordered_at: Optional[datetime] = None,
+                  source: str = "webhook", source_key: Optional[str] = None) -> int:
+        """Stores one order and returns its id."""
+        row = self._row_values(order, enhanced, ordered_at, source, source_key)
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO orders (ordered_at, service, restaurant, total, source, source_key, order_json,"
+                " enhanced_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            if enhanced is not None:
+                conn.execute(ROLLUP_UPSERT_SQL, self._rollup_row(self._day(row[0]), enhanced))
+            self._bump_revision(conn)
+        return cursor.lastrowid
+
+    def set_enhanced(self, order_id: int, enhanced: Dict):
+        """Attaches the nutrition-enhanced version of an order and updates its day's rollup."""
+        conn = self._conn()
+        with conn:
+            row = conn.execute("SELECT ordered_at, enhanced_json FROM orders WHERE id = ?", (order_id,)).fetchone()
+            if row is None:
+                return
+            day = self._day(row[0])
+            if row[1]:
+                # Replacing an earlier enhancement: take its contribution back out first
+                conn.execute(ROLLUP_UPSERT_SQL, self._rollup_row(day, json.loads(row[1]), sign=-1))
+            conn.execute("UPDATE orders SET enhanced_json = ? WHERE id = ?", (json.dumps(enhanced), order_id))
+            conn.execute(ROLLUP_UPSERT_SQL, self._rollup_row(day, enhanced))
+            self._bump_revision(conn)
+
+    def bulk_insert(self, records: Iterable[Dict]) -> int:
+        """
+        Inserts many orders in one transaction. Each record has 'order' and optionally
+        'enhanced', 'ordered_at' (datetime), 'source' and 'source_key'. Records whose
+        source_key is already stored are skipped. Returns the number inserted.
+        """
+        records = list(records)
+        rows = [
+            self._row_values(record['order'], record.get('enhanced'), record.get('ordered_at'),
+                             record.get('source', 'import'), record.get('source_key'))
+            for record in records
+        ]
+        conn = self._conn()
+        inserted = 0
+        with conn:
+            for record, row in zip(records, rows):
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO orders (ordered_at, service, restaurant, total, source, source_key,"
+                    " order_json, enhanced_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+                if cursor.rowcount != 1:
+                    continue
+                inserted += 1
+                if record.get('enhanced') is not None:
+                    conn.execute(ROLLUP_UPSERT_SQL, self._rollup_row(self._day(row[0]), record['enhanced']))
+            if inserted:
+                self._bump_revision(conn)
+        return inserted
+
+    @staticmethod
+    def _row_to_dict(row) -> Dict:
+        return {
+            'id': row[0],
+            'ordered_at': datetime.fromtimestamp(row[1]),
+            'service': row[2],
+            'restaurant': row[3],
+            'total': row[4],
+            'source': row[5],
+            'order': json.loads(row[6]),
+            'enhanced': json.loads(row[7]) if row[7] else None,
+        }
+
+    def get(self, order_id: int) -> Optional[Dict]:
+        row = self._conn().execute(
+            "SELECT id, ordered_at, service, restaurant, total, source, order_json, enhanced_json"
+            " FROM orders WHERE id = ?",
+            (order_id,),
+        ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def query(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+              restaurant: Optional[str] = None, service: Optional[str] = None,
+              enhanced_only: bool = False, limit: Optional[int] = None, newest_first: bool = True) -> List[Dict]:
+        """Orders in [start, end), optionally filtered by restaurant/service, using the indexes."""
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("ordered_at >= ?")
+            params.append(start.timestamp())
+        if end is not None:
+            clauses.append("ordered_at < ?")
+            params.append(end.timestamp())
+        if restaurant is not None:
+            clauses.append("restaurant = ?")
+            params.append(restaurant)
+        if service is not None:
+            clauses.append("service = ?")
+            params.append(service)
+        if enhanced_only:
+            clauses.append("enhanced_json IS NOT NULL")
+
+        sql = "SELECT id, ordered_at, service, restaurant, total, source, order_json, enhanced_json FROM orders"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY ordered_at " + ("DESC" if newest_first else "ASC")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [self._row_to_dict(row) for row in self._conn().execute(sql, params)]
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    def daily_rollups(self, start: Optional[date] = None, end: Optional[date] = None) -> List[Dict]:
+        """Per-day totals for days with enhanced orders in [start, end] (inclusive), oldest first."""
+        clauses, params = ["orders > 0"], []
+        if start is not None:
+            clauses.append("day >= ?")
+            params.append(start.isoformat())
+        if end is not None:
+            clauses.append("day <= ?")
+            params.append(end.isoformat())
+        rows = self._conn().execute(
+            f"SELECT day, {', '.join(ROLLUP_COLUMNS)} FROM daily_rollups"
+            f" WHERE {' AND '.join(clauses)} ORDER BY day",
+            params,
+        ).fetchall()
+        return [
+            dict(zip(('day',) + ROLLUP_COLUMNS, (date.fromisoformat(row[0]), int(row[1]), *row[2:])))
+            for row in rows
+        ]
+
+    def enhanced_columns(self) -> List[tuple]:
+        """
+        One (day_number, restaurant, total, calories, protein, carbs, fat) row per
+        enhanced order, oldest first, for building column arrays. day_number counts
+        local days since 1970-01-01; the meal totals are extracted by SQLite so no
+        order JSON is parsed in Python.
+        """
+        return self._conn().execute(
+            "SELECT CAST(julianday(date(ordered_at, 'unixepoch', 'localtime')) - 2440587.5 AS INTEGER),"
+            " COALESCE(restaurant, ''), COALESCE(total, 0),"
+            " COALESCE(json_extract(enhanced_json, '$.meal_totals.total_calories'), 0),"
+            " COALESCE(json_extract(enhanced_json, '$.meal_totals.total_protein'), 0),"
+            " COALESCE(json_extract(enhanced_json, '$.meal_totals.total_carbs'), 0),"
+            " COALESCE(json_extract(enhanced_json, '$.meal_totals.total_fat'), 0)"
+            " FROM orders WHERE enhanced_json IS NOT NULL ORDER BY ordered_at"
+        ).fetchall()
+
+    def rebuild_rollups(self):
+        """Recomputes every daily rollup from the stored enhanced orders."""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM daily_rollups")
+            for ordered_at, enhanced_json in conn.execute(
+                "SELECT ordered_at, enhanced_json FROM orders WHERE enhanced_json IS NOT NULL"
+            ).fetchall():
+                conn.execute(ROLLUP_UPSERT_SQL, self._rollup_row(self._day(ordered_at), json.loads(enhanced_json)))
+            self._bump_revision(conn)
+
+    def import_legacy_files(self, directory: str = ".") -> int:
+        """
+        Imports order_*.json / enhanced_order_*.json files written by earlier versions.
+        Files are keyed by their timestamp, so running this again imports nothing new.
+        Returns the number of orders imported.
+        """
+        records = {}
+        for prefix, field in (("order_", "order"), ("enhanced_order_", "enhanced")):
+            for path in glob.glob(os.path.join(directory, f"{prefix}*.json")):
+                timestamp_str = os.path.basename(path)[len(prefix):-len(".json")]
+                try:
+                    ordered_at = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S")
+                    with open(path, 'r') as f:
+                        data = json.load(f)
+                except (ValueError, OSError) as e:
+                    log.warning('orders.legacy_skipped', f"Skipping {path}: {e}", path=path, error=str(e))
+                    continue
+                record = records.setdefault(timestamp_str, {
+                    'ordered_at': ordered_at, 'source': 'legacy_file', 'source_key': f"file:{timestamp_str}",
+                })
+                record[field] = data
+
+        for record in records.values():
+            # Older runs sometimes only wrote the enhanced file (it contains the order too)
+            record.setdefault('order', record.get('enhanced'))
+
+        imported = self.bulk_insert(records.values()) if records else 0
+        if imported:
+            log.info('orders.legacy_imported', f"📦 Imported {imported} orders from legacy JSON files",
+                     orders=imported)
+        return imported
@@ -0,0 +1,186 @@
+import functools
+import hashlib
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+from event_log import get_logger
+
+log = get_logger('request_profiler')
+
+# Per-request profiling is off unless one of these is set when the app is imported:
+# - NUTRISYNC_PROFILE_KEY: requests carrying a valid X-NutriSync-Profile header
+#   ("<unix time>:<hex HMAC-SHA256 of the time with this key>") are profiled
+# - NUTRISYNC_PROFILE_RATE: this fraction of requests is profiled (1 = all)
+# When neither is set, handlers are not wrapped at all.
+PROFILE_KEY = os.environ.get("NUTRISYNC_PROFILE_KEY") or None
+PROFILE_RATE = float(os.environ.get("NUTRISYNC_PROFILE_RATE", "0"))
+PROFILE_HEADER = "X-NutriSync-Profile"
+# Signed headers older (or further in the future) than this are refused
+PROFILE_SIGNATURE_MAX_AGE = 300
+
+# Profiles are written here as folded stacks ("frame;frame;frame count" per line),
+# which flamegraph.pl, inferno and speedscope read directly
+PROFILE_DIR = "profiles"
+PROFILE_MAX_FILES = 200
+# Seconds between stack samples
+PROFILE_INTERVAL = 0.001
+# Also sample every other thread (lookup workers, cache flusher...), each stack
+# prefixed with its thread name. Other requests' threads are included too.
+PROFILE_ALL_THREADS = False
+
+
+def profiling_available() -> bool:
+    return PROFILE_KEY is not None or PROFILE_RATE > 0
+
+
+def sign_profile_request(timestamp: Optional[int] = None, key: Optional[str] = None) -> str:
+    """The X-NutriSync-Profile header value that asks for a profile."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new((key or PROFILE_KEY).encode('utf-8'), str(timestamp).encode('utf-8'),
+                      hashlib.sha256).hexdigest()
+    return f"{timestamp}:{digest}"
+
+
+def _valid_signature(value: str) -> bool:
+    if PROFILE_KEY is None or not value:
+        return False
+    timestamp, _, signature = value.partition(':')
+    if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > PROFILE_SIGNATURE_MAX_AGE:
+        return False
+    expected = sign_profile_request(int(timestamp)).partition(':')[2]
+    return hmac.compare_digest(signature, expected)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Samples the call stacks of the given threads (all threads when None) every
+    `interval` seconds from a background thread, counting identical stacks.
+    """
+
+    def __init__(self, thread_ids: Optional[set] = None, interval: float = PROFILE_INTERVAL):
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self) -> 'StackSampler':
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                if self.thread_ids is None:
+                    if thread_id not in names:
+                        names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                    stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+def _prune(directory: str):
+    """Keeps the newest PROFILE_MAX_FILES profiles."""
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.folded')]
+    if len(paths) <= PROFILE_MAX_FILES:
+        return
+    paths.sort(key=os.path.getmtime)
+    for path in paths[:len(paths) - PROFILE_MAX_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def write_profile(name: str, stacks: Counter, duration: float, samples: int) -> Dict:
+    """Writes folded stacks to PROFILE_DIR and returns the profile's description."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    filename = f"{time.strftime('%Y%m%d_%H%M%S')}_{name}_{uuid.uuid4().hex[:8]}.folded"
+    with open(os.path.join(PROFILE_DIR, filename), 'w', encoding='utf-8') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    _prune(PROFILE_DIR)
+    return {
+        'file': filename,
+        'url': f"/profiles/{filename}",
+        'format': 'folded stacks (flamegraph.pl, inferno, speedscope)',
+        'duration_ms': round(duration * 1000, 1),
+        'samples': samples,
+        'interval_ms': PROFILE_INTERVAL * 1000,
+    }
+
+
+def _requested() -> bool:
+    from flask import request
+    if PROFILE_KEY is not None and _valid_signature(request.headers.get(PROFILE_HEADER, '')):
+        return True
+    return PROFILE_RATE > 0 and random.random() < PROFILE_RATE
+
+
+def _attach(rv, profile: Dict):
+    """Adds the profile to a JSON response body, and as a header on any response."""
+    from flask import current_app
+    response = current_app.make_response(rv)
+    response.headers[f"{PROFILE_HEADER}-URL"] = profile['url']
+    data = response.get_json(silent=True) if response.is_json else None
+    if isinstance(data, dict):
+        data['profile'] = profile
+        response.set_data(current_app.json.dumps(data))
+    return response
+
+
+def profiled(name: str) -> Callable:
+    """
+    Decorator for Flask view functions: profiles a request when it is asked for
+    (see PROFILE_KEY / PROFILE_RATE) and links the profile from its response.
+    Returns the view unchanged when profiling is not configured.
+    """
+    def decorator(view: Callable) -> Callable:
+        if not profiling_available():
+            return view
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _requested():
+                return view(*args, **kwargs)
+            thread_ids = None if PROFILE_ALL_THREADS else {threading.get_ident()}
+            sampler = StackSampler(thread_ids).start()
+            start = time.perf_counter()
+            try:
+                rv = view(*args, **kwargs)
+            finally:
+                stacks = sampler.stop()
+                duration = time.perf_counter() - start
+            profile = write_profile(name, stacks, duration, sampler.samples)
+            log.info('profile.written', f"🔬 Profile of {name} ({profile['duration_ms']} ms): {profile['url']}",
+                     view=name, **profile)
+            return _attach(rv, profile)
+
+        return wrapper
+    return decorator
@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key within a process: the first caller
+    runs the function and later callers wait for its result (or its exception)
+    instead of repeating the work. Nothing is remembered once the call finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class LeaseTable:
+    """
+    Short-lived named leases in SQLite, so worker processes sharing a database can
+    tell that another process is already working on a key. A lease expires after
+    `lease_seconds` in case its holder dies without releasing it.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 60.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.owner = self._new_owner()
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lookup_leases ("
+            " key TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    @staticmethod
+    def _new_owner() -> str:
+        return f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, key: str) -> bool:
+        """Takes the lease on `key` unless another live holder has it."""
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute("DELETE FROM lookup_leases WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO lookup_leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, self.owner, now + self.lease_seconds),
+            )
+        return cursor.rowcount == 1
+
+    def held(self, key: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM lookup_leases WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return row is not None
+
+    def release(self, key: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM lookup_leases WHERE key = ? AND owner = ?", (key, self.owner))
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def after_fork(self):
+        """
+        Runs in a forked child: takes a new owner id, so each worker process releases
+        only its own leases, and drops the connections inherited from the parent.
+        """
+        self.owner = self._new_owner()
+        self._local = threading.local()
@@ -0,0 +1,197 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from event_log import get_logger
+
+log = get_logger('work_queue')
+
+
+class WorkQueue:
+    """
+    A durable job queue stored in SQLite (WAL mode). Jobs survive restarts: a job
+    claimed by a worker that dies is handed out again once its lease expires.
+    Every method opens its own short transaction, so the queue can be shared by
+    threads and by several processes using the same database file.
+    """
+
+    def __init__(self, path: str = "nutrisync_queue.db", max_attempts: int = 3, lease_seconds: float = 300):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        # Set whenever a job is enqueued so idle workers wake up immediately
+        self.new_job = threading.Event()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " result TEXT,"
+            " error TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " lease_until REAL,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None lets claim() issue BEGIN IMMEDIATE itself
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, payload: Dict) -> str:
+        """Adds a job and returns its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, status, payload, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, json.dumps(payload), now, now),
+        )
+        self.new_job.set()
+        return job_id
+
+    def claim(self) -> Optional[Tuple[str, Dict]]:
+        """
+        Atomically takes the oldest queued job (or a running job whose lease has
+        expired) and marks it running. Returns (job_id, payload) or None.
+        Expired jobs that already used max_attempts are marked failed instead: their
+        payload keeps killing or hanging its worker, so it must not be handed out again.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            abandoned = conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Lease expired on the last attempt',"
+                " lease_until = NULL, updated_at = ?"
+                " WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            ).rowcount
+            if abandoned:
+                log.warning('job.abandoned', f"💀 {abandoned} job(s) failed after their last lease expired",
+                            jobs=abandoned)
+            row = conn.execute(
+                "SELECT id, payload FROM jobs"
+                " WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ?"
+                " WHERE id = ?",
+                (now + self.lease_seconds, now, row[0]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row[0], json.loads(row[1])
+
+    def complete(self, job_id: str, result: Dict):
+        self._conn().execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL, updated_at = ?"
+            " WHERE id = ?",
+            (json.dumps(result), time.time(), job_id),
+        )
+
+    def fail(self, job_id: str, error: str):
+        """Records a failure; the job is retried until it reaches max_attempts."""
+        self._conn().execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,"
+            " error = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+            (self.max_attempts, error, time.time(), job_id),
+        )
+        self.new_job.set()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Returns the status of one job, including its result once it is done."""
+        row = self._conn().execute(
+            "SELECT id, status, result, error, attempts, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row[0],
+            'status': row[1],
+            'result': json.loads(row[2]) if row[2] else None,
+            'error': row[3],
+            'attempts': row[4],
+            'created_at': row[5],
+            'updated_at': row[6],
+        }
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of jobs in each status."""
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class WorkerPool:
+    """
+    Background threads that pull jobs from a WorkQueue and run `handler(payload)`.
+    The handler's return value is stored as the job result; an exception marks the
+    job failed (and retried, up to the queue's max_attempts).
+    """
+
+    def __init__(self, queue: WorkQueue, handler: Callable[[Dict], Dict], num_workers: int = 2,
+                 poll_interval: float = 1.0):
+        self.queue = queue
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f'ingest-worker-{i + 1}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        log.info('workers.started', f"👷 Started {self.num_workers} ingestion workers", workers=self.num_workers)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self.queue.new_job.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim()
+            except sqlite3.Error as e:
+                log.error('job.claim_failed', f"❌ Could not claim job: {e}", error=str(e))
+                job = None
+
+            if job is None:
+                # Sleep until a new job arrives (or poll again for expired leases)
+                self.queue.new_job.wait(self.poll_interval)
+                self.queue.new_job.clear()
+                continue
+
+            job_id, payload = job
+            try:
+                result = self.handler(payload)
+                self.queue.complete(job_id, result)
+            except Exception as e:
+                log.error('job.failed', f"❌ Job {job_id} failed: {e}", job_id=job_id, exc_info=True)
+                self.queue.fail(job_id, str(e))
@@ -0,0 +1,17 @@
+"""Production entry point for a pre-forking WSGI server.
+
+The app is built with preload=True when this module is imported, which gunicorn
+does once in the master with preload_app (see gunicorn.conf.py). Workers forked
+afterwards share the loaded parsers, cache and index copy-on-write:
+
+    gunicorn -c gunicorn.conf.py
+"""
+import gc
+
+from app import create_app
+
+application = create_app(preload=True)
+
+# Move everything loaded so far out of the garbage collector's view: collections in
+# the workers would otherwise write to those objects and copy the shared pages
+gc.freeze()